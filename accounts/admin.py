@@ -1,6 +1,16 @@
 from django.contrib import admin
 
-from .models import User, UserProfile
+from .models import OutboundEmail, User, UserProfile
 
 admin.site.register(User)
 admin.site.register(UserProfile)
+
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    # The context of a message still to be sent may hold live sign-up or
+    # password links.
+    exclude = ('context',)
+    list_display = ('to_email', 'status', 'attempts', 'next_attempt',
+                    'sent_at')
+    list_filter = ('status',)
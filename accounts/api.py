@@ -0,0 +1,194 @@
+from datetime import timedelta
+
+from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.core import signing
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from kernel.api import ApiBase, ApiError, CursorSerializer, Preparer
+from kernel.models import Tombstone
+
+from .bloom import usernames
+from .models import User, UserProfile
+
+
+class UsernameApi(ApiBase):
+    """
+    Whether a username is free, for checking as the user types:
+
+        GET /api/username?name=<username>
+
+    Answered from a Bloom filter of the names in use (see accounts.bloom),
+    so most checks make no query.  A name saved since the filter was
+    built without going through ``save()`` may show as free until its
+    next rebuild; registration itself still checks the database.
+    """
+    http_methods = {
+        'list': {
+            'GET': 'list',
+        },
+        'detail': {},
+    }
+    validator = UnicodeUsernameValidator()
+
+    @classmethod
+    def urls(cls, name_prefix=None):
+        return super().urls(name_prefix)[:1]    # there's no detail view
+
+    def list(self):
+        name = self.request.GET.get('name', '')
+        try:
+            self.validator(name)
+        except ValidationError:
+            raise ApiError('Invalid username.')
+        return {'username': name, 'available': not usernames.is_taken(name)}
+
+
+class UserSyncApi(ApiBase):
+    """
+    What changed in users and their profiles since a watermark:
+
+        GET /api/usersync?since=<watermark>
+
+    returns the rows saved since then, the primary keys of those deleted
+    (``deleted``), and the ``watermark`` to send next time.  Without a
+    watermark -- or with one older than the deletions are kept for -- the
+    answer is a full copy, marked ``"full": true``: the client should
+    replace what it has.
+
+    Rows come ``limit`` (at most ``max_page_size``) of each kind at a
+    time; while there are more, ``next`` is the URL of the following
+    page, and ``watermark`` is null.  The last page has the watermark of
+    the first, so a client only moves its watermark on once it has read
+    every page.
+
+    The new watermark is a little behind the time of the query, so that
+    rows committed while it ran are sent again next time rather than
+    missed; applying a row twice must do no harm.
+    """
+    http_methods = {
+        'list': {
+            'GET': 'list',
+        },
+        'detail': {},
+    }
+    token_auth = True
+    cursor_salt = 'accounts.api.usersync'
+    user_preparer = Preparer({
+        'id': 'id', 'username': 'username', 'email': 'email',
+        'first_name': 'first_name', 'last_name': 'last_name',
+        'is_active': 'is_active', 'updated_at': 'updated_at',
+    })
+    profile_preparer = Preparer({
+        'user_id': 'user_id', 'gender': 'gender', 'location': 'location',
+        'website': 'website', 'company': 'company', 'about_me': 'about_me',
+        'updated_at': 'updated_at',
+    })
+    overlap = 5             # seconds of changes sent twice, to be safe
+    tombstone_days = 30     # how long deletions are remembered
+
+    @classmethod
+    def urls(cls, name_prefix=None):
+        return super().urls(name_prefix)[:1]    # there's no detail view
+
+    def is_authenticated(self):
+        user = getattr(self.request, 'user', None)
+        return bool(user and user.is_authenticated and
+                    user.has_perm('accounts.view_user'))
+
+    def get_since(self):
+        since = self.request.GET.get('since')
+        if not since:
+            return None
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            raise ApiError('Invalid watermark.')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since, timezone.utc)
+        return since
+
+    def get_position(self):
+        """
+        Where this page starts: the time the first page was asked for, the
+        watermark it was asked with, and for each kind of row the key
+        (``updated_at``, pk) of the last one sent -- None before the
+        first, False once all are.
+        """
+        cursor = self.request.GET.get('cursor')
+        if not cursor:
+            return (timezone.now(), self.get_since(),
+                    {'users': None, 'profiles': None})
+        try:
+            started, since, after = signing.loads(
+                cursor, salt=self.cursor_salt, serializer=CursorSerializer)
+        except (signing.BadSignature, ValueError):
+            raise ApiError('Invalid cursor.')
+        return (parse_datetime(started), since and parse_datetime(since),
+                after)
+
+    def page(self, queryset, after, limit):
+        """
+        The ``limit`` rows of the queryset after the key ``after``, and the
+        key of the last of them -- False if no rows come after it.
+        """
+        if after is False:
+            return queryset.none(), False
+        if after is not None:
+            updated_at, pk = after
+            queryset = queryset.filter(
+                Q(updated_at__gt=updated_at) |
+                Q(updated_at=updated_at, pk__gt=pk))
+        keys = queryset.values_list('updated_at', 'pk')
+        keys = list(keys[limit - 1:limit + 1])
+        return queryset[:limit], keys[0] if len(keys) > 1 else False
+
+    def list(self):
+        started, since, after = self.get_position()
+        first = not self.request.GET.get('cursor')
+        horizon = started - timedelta(days=self.tombstone_days)
+        full = since is None or since < horizon
+
+        users = User.objects.order_by('updated_at', 'pk')
+        profiles = UserProfile.objects.order_by('updated_at', 'pk')
+        deleted = {'users': [], 'profiles': []}
+        if full:
+            if first:
+                Tombstone.objects.filter(deleted_at__lt=horizon).delete()
+        else:
+            users = users.filter(updated_at__gt=since)
+            profiles = profiles.filter(updated_at__gt=since)
+        if first and not full:      # deletions all come on the first page
+            models = {User._meta.label_lower: (User, 'users'),
+                      UserProfile._meta.label_lower: (UserProfile, 'profiles')}
+            tombstones = Tombstone.objects.filter(
+                model__in=models, deleted_at__gt=since
+            ).order_by('deleted_at', 'pk').values_list('model', 'object_pk')
+            for label, pk in tombstones:
+                model, key = models[label]
+                deleted[key].append(model._meta.pk.to_python(pk))
+
+        limit = self.get_limit()
+        users, after['users'] = self.page(users, after['users'], limit)
+        profiles, after['profiles'] = self.page(profiles, after['profiles'],
+                                                limit)
+        next_url = watermark = None
+        if any(after.values()):
+            next_url = self.page_url(signing.dumps(
+                [started, since, after], salt=self.cursor_salt,
+                serializer=CursorSerializer), limit)
+        else:
+            watermark = (started - timedelta(seconds=self.overlap)).isoformat()
+
+        return {
+            'full': full,
+            'users': self.user_preparer.prepare(users),
+            'profiles': self.profile_preparer.prepare(profiles),
+            'deleted': deleted,
+            'next': next_url,
+            'watermark': watermark,
+        }
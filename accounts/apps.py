@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+        from kernel.models import Tombstone
+        from .bloom import usernames
+        from .models import User, UserProfile
+
+        post_save.connect(usernames.saved, sender=User,
+                          dispatch_uid='accounts.bloom.usernames')
+
+        for model in (User, UserProfile):
+            post_delete.connect(
+                Tombstone.record, sender=model,
+                dispatch_uid='accounts.tombstone.{}'.format(model.__name__))
@@ -0,0 +1,160 @@
+"""
+A per-process Bloom filter of usernames, to say which names are free
+without asking the database.
+"""
+import hashlib
+import math
+import time
+from threading import Lock
+
+from django.conf import settings
+
+
+class BloomFilter(object):
+    """
+    A set that can only be added to, and only answers "no" for certain:
+    ``name in bloom`` may be true for a name never added, at about
+    ``error_rate`` when ``capacity`` names are in it.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.bits = max(8, int(-capacity * math.log(error_rate) /
+                               math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.capacity = capacity
+        self.count = 0
+
+    def positions(self, item):
+        # Two hashes from one digest, combined k ways (Kirsch-Mitzenmacher).
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for pos in self.positions(item):
+            self.array[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        array = self.array
+        return all(array[pos >> 3] & (1 << (pos & 7))
+                   for pos in self.positions(item))
+
+    def expected_error_rate(self):
+        return (1 - math.exp(-self.hashes * self.count / self.bits)
+                ) ** self.hashes
+
+
+class UsernameFilter(object):
+    """
+    Answers "is this username taken?" from a Bloom filter of the names in
+    use, asking the database only when the filter says "maybe".  Names go
+    in case-folded, so that "no" holds where the database compares them
+    without regard to case (as MariaDB's default collation does).
+
+    The filter is filled from the database when first needed, grows with
+    every ``post_save`` of a user, and is rebuilt from scratch every
+    ``USERNAME_FILTER_REBUILD`` seconds (or once it's over capacity) --
+    which is how renamed and deleted users, and those saved without
+    signals (``bulk_create``), are caught up with.
+    """
+
+    def __init__(self):
+        self.bloom = None
+        self.built_at = None
+        self.added_meanwhile = None     # names saved during a rebuild
+        self.lock = Lock()
+        self.stats_lock = Lock()
+        self.checks = self.maybes = self.false_positives = 0
+
+    def model(self):
+        from django.contrib.auth import get_user_model
+        return get_user_model()
+
+    def is_stale(self):
+        rebuild = getattr(settings, 'USERNAME_FILTER_REBUILD', 60 * 60)
+        return (self.bloom is None or
+                time.monotonic() - self.built_at > rebuild or
+                self.bloom.count > self.bloom.capacity)
+
+    def rebuild(self):
+        model = self.model()
+        names = model._default_manager.values_list(model.USERNAME_FIELD,
+                                                   flat=True)
+        self.added_meanwhile = []
+        count = names.count()
+        error_rate = getattr(settings, 'USERNAME_FILTER_ERROR_RATE', 0.01)
+        # Room to grow until the next rebuild.
+        bloom = BloomFilter(max(1000, count * 2), error_rate)
+        for name in names.iterator():
+            bloom.add(name.casefold())
+        added, self.added_meanwhile = self.added_meanwhile, None
+        for name in added:
+            bloom.add(name)
+        self.bloom, self.built_at = bloom, time.monotonic()
+
+    def refresh(self):
+        """
+        Rebuilds the filter if it's due -- in just one thread: the others
+        carry on with the old one, if there is one, meanwhile.
+        """
+        if not self.is_stale():
+            return
+        if self.lock.acquire(blocking=self.bloom is None):
+            try:
+                if self.is_stale():
+                    self.rebuild()
+            finally:
+                self.lock.release()
+
+    def add(self, name):
+        name = name.casefold()
+        if self.added_meanwhile is not None:
+            self.added_meanwhile.append(name)
+        if self.bloom is not None:
+            self.bloom.add(name)
+
+    def saved(self, sender, instance, **kwargs):
+        """
+        A ``post_save`` receiver for the user model.
+        """
+        self.add(instance.get_username())
+
+    def is_taken(self, name):
+        self.refresh()
+        maybe = taken = name.casefold() in self.bloom
+        if maybe:
+            model = self.model()
+            taken = model._default_manager.filter(
+                **{model.USERNAME_FIELD: name}).exists()
+        with self.stats_lock:
+            self.checks += 1
+            if maybe:
+                self.maybes += 1
+                self.false_positives += not taken
+        return taken
+
+    def stats(self):
+        """
+        Checks made, how many the filter couldn't settle alone, and the
+        false-positive rate measured among names that were free --
+        against what the filter's size and fill predict.
+        """
+        with self.stats_lock:
+            free = self.checks - self.maybes + self.false_positives
+            return {
+                'checks': self.checks,
+                'database_checks': self.maybes,
+                'false_positives': self.false_positives,
+                'false_positive_rate': (self.false_positives / free
+                                        if free else 0.0),
+                'expected_rate': (self.bloom.expected_error_rate()
+                                  if self.bloom else 0.0),
+                'names': self.bloom.count if self.bloom else 0,
+            }
+
+
+usernames = UsernameFilter()
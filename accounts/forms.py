@@ -1,17 +1,52 @@
-from datetime import datetime
+import secrets
+import time
 
 from django.contrib.auth import get_user_model
 from django.contrib.auth.forms import (_unicode_ci_compare, AuthenticationForm,
                                        PasswordResetForm, UserCreationForm,
                                        UsernameField)
 from django.core.exceptions import ValidationError
+from django.db import connections, router
+from django.db.models import Value
+from django.db.models.functions import Lower
 from django.forms import CharField, HiddenInput, ModelForm
 
+from .hashing import PasswordPoolFull
+from .mailqueue import enqueue
 from .models import User, UserProfile
 
 UserModel = get_user_model()
 
 
+def placeholder_email():
+    """
+    A stand-in for the email address, which must be unique but isn't asked
+    for at signup: milliseconds since the epoch, then 80 random bits, in
+    hex.  Time-ordered, like the old seconds count, but no two workers or
+    hosts need to agree on anything for it to be unique.
+    """
+    return '{:012x}{}'.format(time.time_ns() // 1000000,
+                              secrets.token_hex(10))
+
+
+def users_with_email(email):
+    """
+    Users whose email matches, ignoring case.  Where the database has
+    expression indexes, that's ``LOWER(email) = LOWER(%s)``, to use the
+    index on ``Lower(email)``; elsewhere (MariaDB, MySQL) it's plain
+    ``email__iexact`` -- a ``LIKE`` that the unique index on ``email``
+    serves under a case-insensitive collation.
+    """
+    email_field_name = UserModel.get_email_field_name()
+    users = UserModel._default_manager
+    db = connections[router.db_for_read(UserModel)]
+    if not db.features.supports_expression_indexes:
+        return users.filter(**{email_field_name + '__iexact': email})
+    return users.annotate(
+        email_lower=Lower(email_field_name),
+    ).filter(email_lower=Lower(Value(email)))
+
+
 class CustomUserCreationForm(UserCreationForm):
 
     class Meta(UserCreationForm.Meta):
@@ -21,10 +56,8 @@ class CustomUserCreationForm(UserCreationForm):
     def save(self, commit=True):
         user = super().save(commit=False)
         user.set_password(self.cleaned_data["password1"])
-        # kludge to get past unique constraint of email address:
-        # number of seconds since Day One, converted to hexstring
-        interval = (datetime.now() - datetime(1, 1, 1)).total_seconds()
-        user.email = hex(int(interval))[2:]
+        # kludge to get past unique constraint of email address
+        user.email = placeholder_email()
         user.is_active = True
         if commit:
             user.save()
@@ -117,25 +150,29 @@ class EmailForm(PasswordResetForm):
         data = self.cleaned_data['email']
         email_field_name = UserModel.get_email_field_name()
 
-        dupl_addrs = UserModel._default_manager.filter(**{
-            '%s__iexact' % email_field_name: data,
-            'is_active': True,
-        }).count()
-        if dupl_addrs > 0:
+        dupl_addrs = users_with_email(data).filter(is_active=True).exists()
+        if dupl_addrs:
             self.add_error('%s' % email_field_name,
                            ValidationError('Email in use -- try another'))
 
         return data
 
+    def send_mail(self, subject_template_name, email_template_name,
+                  context, from_email, to_email, html_email_template_name=None):
+        """
+        Queue the registration email, for the sendqueuedmail command to send.
+        """
+        context = dict(context)
+        user = context.pop('user')
+        enqueue(to_email, subject_template_name, email_template_name, context,
+                from_email, html_email_template_name, user)
+
     def get_users(self, email):
         """Given an email, return matching user(s) who should receive a link
             for registration.
         """
         email_field_name = UserModel.get_email_field_name()
-        inactive_users = UserModel._default_manager.filter(**{
-            '%s__iexact' % email_field_name: email,
-            'is_active': False,
-        })
+        inactive_users = users_with_email(email).filter(is_active=False)
         return (
             u for u in inactive_users
             if not u.has_usable_password() and
@@ -143,7 +180,20 @@ class EmailForm(PasswordResetForm):
         )
 
 
-class IngressForm(AuthenticationForm):
+class SigninForm(AuthenticationForm):
+    """
+    Says so when the password can't be checked just now (see
+    accounts.hashing), rather than failing the request.
+    """
+
+    def clean(self):
+        try:
+            return super().clean()
+        except PasswordPoolFull as err:
+            raise ValidationError(str(err), code='busy')
+
+
+class IngressForm(SigninForm):
 
     username = UsernameField(widget=HiddenInput())
 
@@ -0,0 +1,111 @@
+"""
+Password hashing on a small pool of threads of its own.
+
+Checking or setting a password is a deliberately slow hash (PBKDF2, by
+default), so a burst of sign-ins could otherwise keep every request
+thread busy hashing.  ``User.check_password`` and ``User.set_password``
+hand the work to this pool instead: ``PASSWORD_POOL_WORKERS`` threads
+(default: one per CPU) hash, up to ``PASSWORD_POOL_QUEUE`` more hashes
+wait for them, and beyond that ``PasswordPoolFull`` is raised at once
+rather than leaving the request to queue.  The hash functions let go of
+the GIL, so the workers do run in parallel.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+
+class PasswordPoolFull(Exception):
+    """
+    Raised when there are already as many hashes waiting as allowed.
+    """
+
+
+class PasswordPool(object):
+
+    def __init__(self, workers, queue):
+        self.workers = workers
+        self.queue = queue
+        self.executor = ThreadPoolExecutor(workers,
+                                           thread_name_prefix='password')
+        self.slots = BoundedSemaphore(workers + queue)
+        self.lock = Lock()
+        self.pending = 0
+        self.peak = 0
+        self.done = 0
+        self.rejected = 0
+
+    def submit(self, fn, *args, **kwargs):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise PasswordPoolFull('Too many passwords being checked just '
+                                   'now; please try again.')
+        with self.lock:
+            self.pending += 1
+            self.peak = max(self.peak, self.pending)
+        try:
+            future = self.executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self.finished(None)
+            raise
+        future.add_done_callback(self.finished)
+        return future
+
+    def finished(self, future):
+        with self.lock:
+            self.pending -= 1
+            self.done += future is not None
+        self.slots.release()
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Calls ``fn`` on one of the pool's threads, and waits for it.
+        """
+        return self.submit(fn, *args, **kwargs).result()
+
+    def stats(self):
+        with self.lock:
+            return {'workers': self.workers, 'queue': self.queue,
+                    'pending': self.pending, 'peak': self.peak,
+                    'done': self.done, 'rejected': self.rejected}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_pool = None
+_pool_lock = Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(settings, 'PASSWORD_POOL_WORKERS',
+                              None) or os.cpu_count() or 1
+            queue = getattr(settings, 'PASSWORD_POOL_QUEUE', workers * 4)
+            _pool = PasswordPool(workers, queue)
+        return _pool
+
+
+@receiver(setting_changed)
+def reset_pool(setting, **kwargs):
+    global _pool
+    if setting in ('PASSWORD_POOL_WORKERS', 'PASSWORD_POOL_QUEUE'):
+        with _pool_lock:
+            if _pool is not None:
+                _pool.shutdown()
+            _pool = None
+
+
+def pool_stats():
+    """
+    The pool's size, the hashes running or waiting now and at most, and
+    how many were done and turned away, in this process.
+    """
+    return get_pool().stats()
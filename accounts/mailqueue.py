@@ -0,0 +1,191 @@
+"""
+Outbound email, queued in the database rather than sent during the
+request.
+
+``enqueue`` saves an ``OutboundEmail``; the ``sendqueuedmail`` command
+sends what's due, in batches of ``MAIL_QUEUE_BATCH``, over one connection
+to the mail server that it keeps open between messages and batches.  A
+message that fails is tried again after ``MAIL_QUEUE_BACKOFF`` seconds,
+doubling each time (up to ``MAIL_QUEUE_MAX_BACKOFF``), and given up on
+after ``MAIL_QUEUE_MAX_ATTEMPTS`` tries.  Once a message is sent or given
+up on, its ``context`` -- sign-up and password links, say -- is cleared,
+and ``purge`` deletes sent messages ``MAIL_QUEUE_KEEP_SENT`` seconds
+later.
+
+Claiming a batch moves its ``next_attempt`` on by ``MAIL_QUEUE_LEASE``
+seconds, so several workers can share a queue, and a worker that dies
+mid-batch only delays its messages.  Rows are claimed with ``SELECT ...
+FOR UPDATE SKIP LOCKED`` where Django has it for the database, and
+otherwise (as on MariaDB) one by one, each with an ``UPDATE`` that only
+matches while the row is as it was read.
+"""
+import datetime
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import connection as db_connection, transaction
+from django.template import loader
+from django.utils import timezone
+
+from .models import OutboundEmail
+
+
+def enqueue(to_email, subject_template, body_template, context,
+            from_email=None, html_template=None, user=None):
+    """
+    Queues an email, to be rendered from the named templates when it's
+    sent.  ``context`` must be JSON-serializable; ``user``, if given, is
+    added to it.
+    """
+    return OutboundEmail.objects.create(
+        to_email=to_email, from_email=from_email or '',
+        subject_template=subject_template, body_template=body_template,
+        html_template=html_template or '', context=context, user=user)
+
+
+def backoff(attempts):
+    base = getattr(settings, 'MAIL_QUEUE_BACKOFF', 60)
+    most = getattr(settings, 'MAIL_QUEUE_MAX_BACKOFF', 60 * 60)
+    return datetime.timedelta(seconds=min(base * 2 ** (attempts - 1), most))
+
+
+def claim_batch(size):
+    """
+    The next ``size`` messages due, leased to this worker.
+    """
+    now = timezone.now()
+    until = now + datetime.timedelta(
+        seconds=getattr(settings, 'MAIL_QUEUE_LEASE', 5 * 60))
+    due = OutboundEmail.objects.filter(
+        status=OutboundEmail.Status.PENDING,
+        next_attempt__lte=now).order_by('next_attempt').select_related('user')
+    if not db_connection.features.has_select_for_update_skip_locked:
+        return lease(list(due[:size]), until)
+    with transaction.atomic():
+        batch = list(due.select_for_update(skip_locked=True)[:size])
+        OutboundEmail.objects.filter(pk__in=[m.pk for m in batch]).update(
+            next_attempt=until)
+    return batch
+
+
+def lease(batch, until):
+    """
+    Claims the messages of ``batch``, read without locks, that no other
+    worker has claimed since: those whose ``next_attempt`` is still the
+    one read.
+    """
+    claimed = []
+    for outbound in batch:
+        if OutboundEmail.objects.filter(
+                pk=outbound.pk, status=OutboundEmail.Status.PENDING,
+                next_attempt=outbound.next_attempt).update(next_attempt=until):
+            outbound.next_attempt = until
+            claimed.append(outbound)
+    return claimed
+
+
+class Mailer(object):
+    """
+    Sends queued messages over one connection, rendering them with
+    templates it compiles once.
+    """
+
+    def __init__(self, connection=None):
+        self.connection = connection or get_connection()
+        self.templates = {}
+        self.sent = 0
+        self.failed = 0
+
+    def template(self, name):
+        if name not in self.templates:
+            self.templates[name] = loader.get_template(name)
+        return self.templates[name]
+
+    def render(self, outbound):
+        context = dict(outbound.context, user=outbound.user)
+        # Email subject *must not* contain newlines
+        subject = ''.join(
+            self.template(outbound.subject_template).render(context)
+            .splitlines())
+        body = self.template(outbound.body_template).render(context)
+        message = EmailMultiAlternatives(
+            subject, body, outbound.from_email or None, [outbound.to_email],
+            connection=self.connection)
+        if outbound.html_template:
+            message.attach_alternative(
+                self.template(outbound.html_template).render(context),
+                'text/html')
+        return message
+
+    def send(self, outbound):
+        try:
+            self.render(outbound).send()
+        except Exception as err:
+            self.failed += 1
+            self.retry(outbound, err)
+            self.reconnect()
+            return False
+        self.sent += 1
+        outbound.status = OutboundEmail.Status.SENT
+        outbound.sent_at = timezone.now()
+        outbound.attempts += 1
+        outbound.context = {}
+        outbound.save(update_fields=['status', 'sent_at', 'attempts',
+                                     'context'])
+        return True
+
+    def reconnect(self):
+        # In case it was the connection that failed; if the server can't
+        # be reached, the next send() tries again.
+        self.connection.close()
+        try:
+            self.connection.open()
+        except Exception:
+            pass
+
+    def retry(self, outbound, err):
+        outbound.attempts += 1
+        outbound.last_error = '{}: {}'.format(type(err).__name__, err)
+        if outbound.attempts >= getattr(settings, 'MAIL_QUEUE_MAX_ATTEMPTS',
+                                        6):
+            outbound.status = OutboundEmail.Status.FAILED
+            outbound.context = {}
+        else:
+            outbound.next_attempt = timezone.now() + backoff(outbound.attempts)
+        outbound.save(update_fields=['attempts', 'last_error', 'status',
+                                     'next_attempt', 'context'])
+
+    def drain(self, batch_size=None):
+        """
+        Sends batches until none are due, connecting to the mail server
+        only if there are any.  Raises what ``connection.open()`` does if
+        the server can't be reached (the batch claimed then waits out its
+        lease).
+        """
+        if batch_size is None:
+            batch_size = getattr(settings, 'MAIL_QUEUE_BATCH', 100)
+        opened = False
+        try:
+            while True:
+                batch = claim_batch(batch_size)
+                if batch and not opened:
+                    self.connection.open()
+                    opened = True
+                for outbound in batch:
+                    self.send(outbound)
+                if len(batch) < batch_size:
+                    return
+        finally:
+            if opened:
+                self.connection.close()
+
+
+def purge():
+    """
+    Deletes the messages sent more than ``MAIL_QUEUE_KEEP_SENT`` seconds
+    ago; returns how many there were.
+    """
+    before = timezone.now() - datetime.timedelta(
+        seconds=getattr(settings, 'MAIL_QUEUE_KEEP_SENT', 7 * 24 * 60 * 60))
+    return OutboundEmail.objects.filter(
+        status=OutboundEmail.Status.SENT, sent_at__lt=before).delete()[0]
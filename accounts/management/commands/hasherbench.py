@@ -0,0 +1,74 @@
+import math
+import time
+
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+from accounts.hashing import get_pool
+
+
+def recommend(hasher, seconds, target):
+    """
+    The hasher's work factor, and what it would be to take ``target``
+    seconds rather than ``seconds`` -- or None, for hashers without one.
+    """
+    scale = target / seconds
+    if hasattr(hasher, 'iterations'):           # PBKDF2: time is linear
+        return ('iterations', hasher.iterations,
+                max(1000, int(round(hasher.iterations * scale, -3))))
+    if hasattr(hasher, 'time_cost'):            # Argon2: linear, too
+        return ('time_cost', hasher.time_cost,
+                max(1, round(hasher.time_cost * scale)))
+    if hasattr(hasher, 'rounds'):               # bcrypt: log2 of the cost
+        return ('rounds', hasher.rounds,
+                max(4, hasher.rounds + round(math.log2(scale))))
+    return None
+
+
+class Command(BaseCommand):
+    help = ('Times each of PASSWORD_HASHERS on this machine and recommends '
+            'the work factor that would take the target time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', type=float, default=250,
+                            help='milliseconds a hash should take '
+                                 '(default: %(default)s)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='hashes timed with each hasher; the '
+                                 'fastest counts')
+
+    def handle(self, *args, **options):
+        target = options['target'] / 1000
+        for hasher in get_hashers():
+            self.stdout.write(self.bench(hasher, target, options['repeat']))
+
+        workers = get_pool().workers
+        self.stdout.write(
+            'At {:.0f} ms a hash, {} password worker{} can check about {:.0f} '
+            'passwords a second.'.format(target * 1000, workers,
+                                         's' if workers > 1 else '',
+                                         workers / target))
+        self.stdout.write('To change a work factor, subclass the hasher with '
+                          'the new value and put it first in PASSWORD_HASHERS.')
+
+    def bench(self, hasher, target, repeat):
+        password = 'correct horse battery staple'
+        try:
+            hasher.encode(password, hasher.salt())  # loads its library
+        except ValueError as err:
+            return '{:<24} skipped: {}'.format(hasher.algorithm, err)
+        timings = []
+        for n in range(repeat):
+            salt = hasher.salt()
+            started = time.perf_counter()
+            hasher.encode(password, salt)
+            timings.append(time.perf_counter() - started)
+        seconds = min(timings)
+
+        line = '{:<24} {:9.1f} ms'.format(hasher.algorithm, seconds * 1000)
+        advice = recommend(hasher, seconds, target)
+        if advice is None:
+            return line + '  (no work factor: not for new passwords)'
+        attr, current, suggested = advice
+        return line + '  {}={}; for {:.0f} ms use {}={}'.format(
+            attr, current, target * 1000, attr, suggested)
@@ -0,0 +1,43 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.mailqueue import Mailer, purge
+
+logger = logging.getLogger('accounts.mailqueue')
+
+
+class Command(BaseCommand):
+    help = ('Sends the queued emails that are due, in batches over one '
+            'connection to the mail server, and deletes old sent ones.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=None,
+                            help='messages claimed at a time '
+                                 '(default: MAIL_QUEUE_BATCH)')
+        parser.add_argument('--loop', action='store_true',
+                            help="keep going, checking the queue every "
+                                 "--interval seconds once it's empty")
+        parser.add_argument('--interval', type=float, default=10)
+
+    def handle(self, *args, **options):
+        mailer = Mailer()
+        while True:
+            try:
+                mailer.drain(options['batch'])
+            except OSError as err:      # smtplib's errors are OSErrors
+                if not options['loop']:
+                    raise CommandError(
+                        'Could not reach the mail server: {}'.format(err))
+                logger.exception('Could not reach the mail server; trying '
+                                 'again in %s seconds.', options['interval'])
+            purged = purge()
+            if options['verbosity'] > 1 or not options['loop']:
+                self.stdout.write('Sent {}; {} failed.'.format(
+                    mailer.sent, mailer.failed))
+            if options['verbosity'] > 1 and purged:
+                self.stdout.write('Deleted {} sent.'.format(purged))
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,27 @@
+from django.http import HttpResponse
+
+from .hashing import PasswordPoolFull
+
+
+class PasswordPoolMiddleware:
+    """
+    Answers a request whose password couldn't be hashed, the password pool
+    being full (see accounts.hashing), with a 503 and ``Retry-After`` --
+    for the views, like django.contrib.auth's, that don't show that as a
+    form error of their own.
+    """
+    retry_after = 1
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_exception(self, request, exception):
+        if not isinstance(exception, PasswordPoolFull):
+            return None
+        response = HttpResponse(str(exception), content_type='text/plain',
+                                status=503)
+        response['Retry-After'] = str(self.retry_after)
+        return response
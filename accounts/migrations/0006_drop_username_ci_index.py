@@ -0,0 +1,17 @@
+# Generated by Django 3.2.1 on 2026-10-18 04:04
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_outboundemail'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='user',
+            name='accounts_user_username_ci',
+        ),
+    ]
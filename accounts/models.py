@@ -1,5 +1,10 @@
+from django.contrib.auth import hashers
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+from .hashing import get_pool
 
 
 class User(AbstractUser):
@@ -17,6 +22,34 @@ class User(AbstractUser):
             'Unselect this instead of deleting accounts.'
         ),
     )
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    class Meta(AbstractUser.Meta):
+        # for case-insensitive email lookups (see accounts.forms): filter
+        # on Lower('email') to use it.  Not made where the database has no
+        # expression indexes.
+        indexes = [
+            models.Index(Lower('email'), name='accounts_user_email_ci'),
+        ]
+
+    # Hashing goes to the password pool (see accounts.hashing), and may
+    # raise PasswordPoolFull when that's busy.
+
+    def set_password(self, raw_password):
+        self.password = get_pool().run(hashers.make_password, raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        # The rehash (on a change of hasher or work factor) is saved here,
+        # on the request's thread, not the pool's.
+        upgrade = []
+        correct = get_pool().run(hashers.check_password, raw_password,
+                                 self.password, upgrade.append)
+        if upgrade:
+            self.set_password(raw_password)
+            self._password = None
+            self.save(update_fields=['password'])
+        return correct
 
 
 class UserProfile(models.Model):
@@ -35,6 +68,43 @@ class UserProfile(models.Model):
     website = models.CharField(max_length=100, null=True, blank=True)
     company = models.CharField(max_length=100, null=True, blank=True)
     about_me = models.TextField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return 'Profile for {}'.format(self.user.get_username())
+
+
+class OutboundEmail(models.Model):
+    """
+    An email waiting to be sent, or sent, by the ``sendqueuedmail``
+    command (see accounts.mailqueue).  The templates are rendered when it's
+    sent, with ``context`` and ``user``.
+    """
+
+    class Status(models.IntegerChoices):
+        PENDING = 1, 'Pending'
+        SENT = 2, 'Sent'
+        FAILED = 3, 'Failed'
+
+    to_email = models.CharField(max_length=254)
+    from_email = models.CharField(max_length=254, blank=True)
+    subject_template = models.CharField(max_length=200)
+    body_template = models.CharField(max_length=200)
+    html_template = models.CharField(max_length=200, blank=True)
+    context = models.JSONField(default=dict)
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             null=True, blank=True)
+    status = models.IntegerField(choices=Status.choices,
+                                 default=Status.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt'])]
+
+    def __str__(self):
+        return 'Email to {} ({})'.format(self.to_email,
+                                         self.get_status_display())
@@ -0,0 +1,149 @@
+import json
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.contrib.auth.models import Permission
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from kernel import tokens
+from kernel.models import Tombstone
+from ..api import UserSyncApi
+from ..bloom import BloomFilter, usernames
+from ..models import User, UserProfile
+
+
+class UserSyncApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usr = User.objects.create_user(username='ozma',
+                                           email='ozma@oz.gov',
+                                           is_active=True)
+        cls.usr.user_permissions.add(
+            Permission.objects.get(codename='view_user'))
+        for name in ('dorothy', 'glinda'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov')
+            UserProfile.objects.create(user=usr, company='Oz Inc.')
+
+    def sync(self, since=None, url='/api/usersync'):
+        if since:
+            url += '?since=' + quote(since)
+        auth = 'Bearer ' + tokens.mint(self.usr)
+        return json.loads(self.client.get(url, HTTP_AUTHORIZATION=auth).content)
+
+    def test_sync(self):
+        d = self.sync()
+        self.assertTrue(d['full'])
+        self.assertEqual(len(d['users']), 3)
+        self.assertEqual(len(d['profiles']), 2)
+        self.assertNotIn('password', d['users'][0])
+
+        # Move everything out of the overlap window.
+        past = timezone.now() - timedelta(minutes=1)
+        User.objects.update(updated_at=past)
+        UserProfile.objects.update(updated_at=past)
+        watermark = (past + timedelta(seconds=1)).isoformat()
+
+        d = self.sync(watermark)
+        self.assertFalse(d['full'])
+        self.assertEqual((d['users'], d['profiles']), ([], []))
+
+        glinda = User.objects.get(username='glinda')
+        glinda.first_name = 'Glinda'
+        glinda.save()
+        User.objects.get(username='dorothy').delete()
+        d = self.sync(watermark)
+        self.assertEqual([row['first_name'] for row in d['users']], ['Glinda'])
+        dorothy_pk = Tombstone.objects.get(model='accounts.user').object_pk
+        self.assertEqual(d['deleted'], {'users': [int(dorothy_pk)],
+                                        'profiles': [int(dorothy_pk)]})
+        self.assertLess(d['watermark'], timezone.now().isoformat())
+
+    def test_pages(self):
+        glinda = User.objects.get(username='glinda')
+        glinda.first_name = 'Glinda'
+        glinda.save()       # last, by updated_at
+        pages = [self.sync(url='/api/usersync?limit=1')]
+        first_done = timezone.now()
+        while pages[-1]['next']:
+            pages.append(self.sync(url=pages[-1]['next']))
+        self.assertEqual(len(pages), 3)
+        self.assertEqual([[row['username'] for row in page['users']]
+                          for page in pages], [['ozma'], ['dorothy'],
+                                               ['glinda']])
+        self.assertEqual(sum(len(page['profiles']) for page in pages), 2)
+        self.assertTrue(all(page['full'] for page in pages))
+        self.assertEqual([page['watermark'] is None for page in pages],
+                         [True, True, False],
+                         "should only give the watermark with the last page")
+        watermark = parse_datetime(pages[-1]['watermark'])
+        self.assertLess(watermark + timedelta(seconds=UserSyncApi.overlap),
+                        first_done,
+                        "should be the watermark from the first page")
+
+        d = self.sync(url='/api/usersync?cursor=forged')
+        self.assertEqual(d, {'error': 'Invalid cursor.'})
+
+    def test_expired_watermark(self):
+        since = (timezone.now() - timedelta(days=60)).isoformat()
+        self.assertTrue(self.sync(since)['full'])
+        self.assertEqual(self.sync('yesterday'),
+                         {'error': 'Invalid watermark.'})
+
+    def test_permission(self):
+        auth = 'Bearer ' + tokens.mint(User.objects.get(username='glinda'))
+        resp = self.client.get('/api/usersync', HTTP_AUTHORIZATION=auth)
+        self.assertEqual(json.loads(resp.content), {'error': 'Unauthorized'})
+
+
+class UsernameApiTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='dorothy', email='dot@kansas.gov')
+
+    def setUp(self):
+        usernames.bloom = None
+        usernames.checks = usernames.maybes = usernames.false_positives = 0
+
+    def check(self, name):
+        resp = self.client.get('/api/username', {'name': name})
+        return json.loads(resp.content)
+
+    def test_availability(self):
+        self.assertEqual(self.check('dorothy'),
+                         {'username': 'dorothy', 'available': False})
+        with self.assertNumQueries(0):
+            self.assertTrue(self.check('toto')['available'],
+                            "should answer free names from the filter")
+
+        User.objects.create_user(username='toto', email='toto@kansas.gov')
+        self.assertFalse(self.check('toto')['available'],
+                         "should add names as users are saved")
+        self.assertEqual(self.check('no spaces'), {'error': 'Invalid username.'})
+        with self.assertNumQueries(1):
+            self.check('Dorothy')   # the database decides case
+
+        stats = usernames.stats()
+        self.assertEqual((stats['checks'], stats['database_checks']), (4, 3))
+
+    def test_rebuild(self):
+        usernames.is_taken('dorothy')
+        User.objects.filter(username='dorothy').update(username='elphaba')
+        self.assertFalse(usernames.is_taken('elphaba'),
+                        "should miss changes made without save()...")
+        with override_settings(USERNAME_FILTER_REBUILD=-1):
+            self.assertTrue(usernames.is_taken('elphaba'),
+                            "...until the filter is rebuilt")
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(1000, error_rate=0.01)
+        for n in range(1000):
+            bloom.add('user{}'.format(n))
+        self.assertTrue(all('user{}'.format(n) in bloom for n in range(1000)))
+        false = sum('other{}'.format(n) in bloom for n in range(10000))
+        self.assertLess(false / 10000, 0.02)
+        self.assertAlmostEqual(bloom.expected_error_rate(), 0.01, places=2)
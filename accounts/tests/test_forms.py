@@ -1,9 +1,17 @@
 import string
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from threading import Barrier
+from unittest import mock, skipIf
 
-from django.test import TestCase
+from django.db import connection
+from django.test import (TestCase, TransactionTestCase, override_settings,
+                         skipUnlessDBFeature, tag)
 
-from ..forms import (CustomUserCreationForm, EmailForm,
-                     IngressForm, UserNameForm)
+from ..forms import (CustomUserCreationForm, EmailForm, IngressForm,
+                     UserNameForm, placeholder_email, users_with_email)
 from ..models import User, UserProfile
 
 
@@ -21,6 +29,85 @@ class UserCreationFormTest(TestCase):
         self.assertIsNotNone(user.pk, "Should be saved to db now")
         return
 
+    def test_placeholders_under_concurrency(self):
+        # 16 workers, all starting at once, 2000 signups' worth each.
+        workers, each = 16, 2000
+        start = Barrier(workers)
+
+        def signups(n):
+            start.wait()
+            return [placeholder_email() for i in range(each)]
+
+        with ThreadPoolExecutor(workers) as pool:
+            emails = [e for batch in pool.map(signups, range(workers))
+                      for e in batch]
+        self.assertEqual(len(set(emails)), workers * each,
+                         "no two placeholders should collide")
+        self.assertTrue(all(set(e).issubset(string.hexdigits)
+                            for e in emails))
+        self.assertLessEqual(int(emails[0][:12], 16), time.time() * 1000,
+                             "should lead with the time, in milliseconds")
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher'])
+    def test_signup_burst(self):
+        for n in range(300):
+            form = CustomUserCreationForm(data={'username': 'munchkin%d' % n,
+                                                'password1': 'brandNewDay',
+                                                'password2': 'brandNewDay'})
+            form.save()
+        self.assertEqual(User.objects.values('email').distinct().count(), 300)
+        # The old seconds-since-Day-One placeholder collided on the second
+        # signup in any one second.
+        seconds = {joined.replace(microsecond=0) for joined in
+                   User.objects.values_list('date_joined', flat=True)}
+        self.assertLess(len(seconds), 300,
+                        "should have had signups within the same second")
+
+
+@skipUnlessDBFeature('test_db_allows_multiple_connections')
+@override_settings(PASSWORD_HASHERS=[
+    'django.contrib.auth.hashers.MD5PasswordHasher'])
+class ConcurrentSignupTest(TransactionTestCase):
+    """
+    Signups from parallel threads, each on a connection of its own,
+    against the database's unique constraint on email.  (Not with an
+    in-memory SQLite database, which threads can't write to at once.)
+    """
+    workers = 8
+    signups = 50
+
+    def sign_up(self, worker):
+        try:
+            for n in range(self.signups):
+                name = 'munchkin{}x{}'.format(worker, n)
+                form = CustomUserCreationForm(data={'username': name,
+                                                    'password1': 'brandNewDay',
+                                                    'password2': 'brandNewDay'})
+                self.assertTrue(form.is_valid(), form.errors)
+                form.save()     # an email collision raises IntegrityError
+        finally:
+            connection.close()
+
+    def test_concurrent_signups(self):
+        start = Barrier(self.workers)
+
+        def worker(n):
+            start.wait()
+            self.sign_up(n)
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(self.workers) as pool:
+            list(pool.map(worker, range(self.workers)))   # re-raises
+        elapsed = time.monotonic() - started
+
+        total = self.workers * self.signups
+        self.assertEqual(User.objects.count(), total)
+        self.assertEqual(User.objects.values('email').distinct().count(),
+                         total)
+        sys.stderr.write('\n{} concurrent signups in {:.2f}s: {:.0f}/s\n'
+                         .format(total, elapsed, total / elapsed))
+
 
 class EmailFormTests(TestCase):
 
@@ -55,6 +142,17 @@ class EmailFormTests(TestCase):
                              "should have been saved as inactive")
         return
 
+    def test_users_with_email(self):
+        for expression_indexes in (True, False):
+            with mock.patch.object(connection.features,
+                                   'supports_expression_indexes',
+                                   expression_indexes):
+                users = users_with_email('Dorothy@Kansas.GOV')
+                self.assertEqual([u.username for u in users], ['dorothy'])
+                sql = str(users.query).upper()
+            self.assertEqual('LOWER(' in sql, expression_indexes,
+                             "should use iexact without expression indexes")
+
 
 class IngressFormTests(TestCase):
 
@@ -114,3 +212,57 @@ class UserNameFormTests(TestCase):
                                   'username': 'dorothy'})
         form.full_clean()   # needed to create cleaned_data
         self.assertTrue(form.username_found, "Dorothy should be in database!")
+
+
+@tag('slow')
+@skipIf(connection.vendor == 'sqlite',
+        "only the plans of the servers we deploy on are worth the seeding")
+class EmailIndexTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        A million users, made in the database: through the ORM it would
+        take minutes.
+        """
+        if connection.vendor == 'mysql':
+            def concat(*parts):
+                return 'CONCAT({})'.format(', '.join(parts))
+        else:
+            def concat(*parts):
+                return ' || '.join(parts)
+
+        then = datetime(2021, 1, 1, tzinfo=timezone.utc)
+        user = connection.ops.quote_name(User._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "WITH RECURSIVE d(n) AS ("
+                " SELECT 0 UNION ALL SELECT n + 1 FROM d WHERE n < 999) "
+                "INSERT INTO {} (password, is_superuser, username, first_name,"
+                " last_name, email, is_staff, is_active, date_joined,"
+                " updated_at) "
+                "SELECT '', %s, {}, '', '', {}, %s, %s, %s, %s "
+                "FROM (SELECT a.n * 1000 + b.n AS n FROM d a, d b) seq".format(
+                    user, concat("'user'", 'seq.n'),
+                    concat("'User'", 'seq.n', "'@Example.com'")),
+                [False, False, False, then, then])
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def test_query_plan(self):
+        self.assertEqual(User.objects.count(), 1000000)
+        users = users_with_email('user424242@EXAMPLE.com')
+        self.assertEqual([u.username for u in users], ['user424242'])
+
+        if connection.vendor == 'mysql':
+            # No expression indexes: the LIKE of email__iexact, served by
+            # the unique index on email under a case-insensitive collation.
+            index, plan_format = '"key": "email"', 'json'
+        else:
+            index, plan_format = 'accounts_user_email_ci', None
+
+        # the queries of EmailForm.clean_email and EmailForm.get_users
+        for qs in (users.filter(is_active=True), users.filter(is_active=False)):
+            self.assertIn(index, qs.explain(format=plan_format),
+                          "should look up emails through the index")
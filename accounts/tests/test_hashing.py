@@ -0,0 +1,158 @@
+from io import StringIO
+from threading import Event
+
+from django.contrib.auth.tokens import default_token_generator
+from django.contrib.auth.views import INTERNAL_RESET_SESSION_TOKEN
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+
+from ..forms import IngressForm
+from ..hashing import (PasswordPool, PasswordPoolFull, get_pool, pool_stats,
+                       reset_pool)
+from ..views import RegisterConfirmView
+from ..management.commands.hasherbench import recommend
+from ..models import User
+
+
+class PasswordPoolTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usr = User.objects.create_user(username='dorothy',
+                                           email='dot@kansas.gov',
+                                           is_active=True,
+                                           password='rubySlippers')
+
+    def test_rejects_when_full(self):
+        pool = PasswordPool(workers=1, queue=1)
+        release = Event()
+        running = pool.submit(release.wait)
+        waiting = pool.submit(release.wait)
+        with self.assertRaises(PasswordPoolFull):
+            pool.submit(release.wait)
+        release.set()
+        self.assertTrue(running.result() and waiting.result())
+        self.assertEqual(pool.run(sum, [1, 2]), 3, "should have room again")
+        stats = pool.stats()
+        self.assertEqual((stats['pending'], stats['peak'], stats['done'],
+                          stats['rejected']), (0, 2, 3, 1))
+        pool.shutdown()
+
+    def test_user_passwords(self):
+        done = pool_stats()['done']
+        self.assertTrue(self.usr.check_password('rubySlippers'))
+        self.assertFalse(self.usr.check_password('silverShoes'))
+        self.usr.set_password('silverShoes')
+        self.assertTrue(self.usr.check_password('silverShoes'))
+        self.assertEqual(pool_stats()['done'], done + 4,
+                         "should hash on the pool's threads")
+
+    @override_settings(PASSWORD_HASHERS=[
+        'django.contrib.auth.hashers.MD5PasswordHasher',
+        'django.contrib.auth.hashers.PBKDF2PasswordHasher'])
+    def test_upgrade(self):
+        self.assertTrue(self.usr.check_password('rubySlippers'))
+        self.usr.refresh_from_db()
+        self.assertTrue(self.usr.password.startswith('md5$'),
+                        "should save the rehashed password")
+
+    @override_settings(PASSWORD_POOL_WORKERS=1, PASSWORD_POOL_QUEUE=0)
+    def test_busy_signin(self):
+        release = Event()
+        get_pool().submit(release.wait)
+        try:
+            form = IngressForm(data={'username': 'dorothy',
+                                     'password': 'rubySlippers'})
+            self.assertFalse(form.is_valid())
+            self.assertEqual(form.errors.as_data()['__all__'][0].code, 'busy')
+        finally:
+            release.set()
+
+    def test_hasherbench(self):
+        class PBKDF2:
+            iterations = 100000
+
+        class BCrypt:
+            rounds = 12
+
+        self.assertEqual(recommend(PBKDF2(), 0.05, 0.1),
+                         ('iterations', 100000, 200000))
+        self.assertEqual(recommend(BCrypt(), 0.4, 0.1), ('rounds', 12, 10))
+
+        out = StringIO()
+        with override_settings(PASSWORD_HASHERS=[
+                'django.contrib.auth.hashers.MD5PasswordHasher']):
+            call_command('hasherbench', '--repeat', '1', '--target', '100',
+                         stdout=out)
+        self.assertIn('md5', out.getvalue())
+        self.assertIn('no work factor', out.getvalue())
+
+
+@override_settings(PASSWORD_POOL_WORKERS=1, PASSWORD_POOL_QUEUE=0)
+class BusyPasswordViewsTest(TestCase):
+    """
+    Every view that checks or sets a password, with the pool full.
+    """
+    busy = 'Too many passwords being checked just now'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usr = User.objects.create_user(username='dorothy',
+                                           email='dot@kansas.gov',
+                                           is_active=True,
+                                           password='rubySlippers')
+
+    def setUp(self):
+        reset_pool(setting='PASSWORD_POOL_WORKERS')     # a pool of our own
+        release = Event()
+        get_pool().submit(release.wait)
+        self.addCleanup(release.set)
+
+    def test_signin(self):
+        for url in (reverse('access'), reverse('ingress')):
+            resp = self.client.post(url, {'username': 'dorothy',
+                                          'password': 'rubySlippers'})
+            self.assertContains(resp, self.busy)
+            self.assertNotIn('_auth_user_id', self.client.session)
+
+    def test_signup(self):
+        resp = self.client.post(reverse('signup'),
+                                {'username': 'toto',
+                                 'password1': 'brandNewDay',
+                                 'password2': 'brandNewDay'})
+        self.assertContains(resp, self.busy)
+        self.assertFalse(User.objects.filter(username='toto').exists())
+
+    def test_register_confirm(self):
+        usr = User.objects.create_user(username='some1New',
+                                       email='i.am@home.com')
+        session = self.client.session
+        session[INTERNAL_RESET_SESSION_TOKEN] = (
+            default_token_generator.make_token(usr))
+        session.save()
+        url = '/accounts/vestibule/{}/{}/'.format(
+            urlsafe_base64_encode(force_bytes(usr.pk)),
+            RegisterConfirmView.reset_url_token)
+        resp = self.client.post(url, {'new_password1': 'brandNewDay',
+                                      'new_password2': 'brandNewDay'})
+        self.assertContains(resp, self.busy)
+        usr.refresh_from_db()
+        self.assertFalse(usr.is_active)
+
+    def test_other_views(self):
+        # django.contrib.auth's own views get a 503 from the middleware.
+        resp = self.client.post(reverse('login'),
+                                {'username': 'dorothy',
+                                 'password': 'rubySlippers'})
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp['Retry-After'], '1')
+
+        self.client.force_login(self.usr)
+        resp = self.client.post(reverse('password_change'),
+                                {'old_password': 'rubySlippers',
+                                 'new_password1': 'brandNewDay',
+                                 'new_password2': 'brandNewDay'})
+        self.assertEqual(resp.status_code, 503)
@@ -0,0 +1,145 @@
+from datetime import timedelta
+from io import StringIO
+from smtplib import SMTPServerDisconnected
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import CommandError, call_command
+from django.template import loader
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ..mailqueue import (Mailer, backoff, claim_batch, enqueue, lease,
+                         purge)
+from ..models import OutboundEmail, User
+
+
+class CountingBackend(EmailBackend):
+    """
+    The locmem backend, counting the connections opened.
+    """
+    opened = 0
+
+    def open(self):
+        CountingBackend.opened += 1
+        return True
+
+
+@override_settings(
+    EMAIL_BACKEND='accounts.tests.test_mailqueue.CountingBackend',
+    MAIL_QUEUE_BACKOFF=60, MAIL_QUEUE_MAX_ATTEMPTS=3)
+class MailQueueTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usr = User.objects.create_user(username='dorothy',
+                                           email='dot@kansas.gov')
+
+    def setUp(self):
+        mail.outbox = []
+        CountingBackend.opened = 0
+
+    def queue(self, count):
+        for n in range(count):
+            enqueue('dot{}@kansas.gov'.format(n),
+                    'accounts/registration_subject.txt',
+                    'accounts/registration_email.html',
+                    {'site_name': 'Oz', 'domain': 'oz.gov', 'uid': 'MQ',
+                     'token': 'set-abc', 'protocol': 'https'},
+                    user=self.usr)
+
+    def test_batches(self):
+        self.queue(5)
+        with mock.patch.object(loader, 'get_template',
+                               wraps=loader.get_template) as get_template:
+            out = StringIO()
+            call_command('sendqueuedmail', '--batch', '2', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Sent 5; 0 failed.')
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(mail.outbox[0].subject, 'Registration on Oz')
+        self.assertIn('dorothy', mail.outbox[0].body)
+        self.assertEqual(CountingBackend.opened, 1,
+                         "should send every batch over one connection")
+        self.assertEqual(get_template.call_count, 2,
+                         "should compile each template once")
+        self.assertFalse(OutboundEmail.objects.exclude(
+            status=OutboundEmail.Status.SENT).exists())
+        self.assertFalse(OutboundEmail.objects.exclude(context={}).exists(),
+                         "should not keep the links sent")
+
+        Mailer().drain()
+        self.assertEqual(CountingBackend.opened, 1,
+                         "should not connect for an empty queue")
+
+    def test_server_down(self):
+        self.queue(1)
+        refused = mock.patch.object(CountingBackend, 'open',
+                                    side_effect=ConnectionRefusedError)
+        with refused, self.assertRaises(CommandError):
+            call_command('sendqueuedmail', stdout=StringIO())
+
+        # Looping, it waits and tries again.
+        OutboundEmail.objects.update(next_attempt=timezone.now())
+        sleep = mock.patch('time.sleep', side_effect=[None, KeyboardInterrupt])
+        with refused, sleep, self.assertLogs('accounts.mailqueue') as logs:
+            with self.assertRaises(KeyboardInterrupt):
+                call_command('sendqueuedmail', '--loop', stdout=StringIO())
+        self.assertEqual(len(logs.output), 1,
+                         "should only try once the lease is over")
+        self.assertEqual(OutboundEmail.objects.get().status,
+                         OutboundEmail.Status.PENDING)
+
+    def test_purge(self):
+        self.queue(2)
+        Mailer().drain()
+        OutboundEmail.objects.filter(to_email='dot0@kansas.gov').update(
+            sent_at=timezone.now() - timedelta(days=8))
+        self.queue(1)
+        self.assertEqual(purge(), 1)
+        self.assertEqual(OutboundEmail.objects.count(), 2)
+
+    def test_retry(self):
+        self.queue(2)
+        failing = mock.patch.object(
+            CountingBackend, 'send_messages',
+            side_effect=[SMTPServerDisconnected('gone'), 1])
+        with failing:
+            Mailer().drain()
+        self.assertEqual(CountingBackend.opened, 2, "should reconnect")
+
+        failed = OutboundEmail.objects.get(last_error__contains='gone')
+        self.assertEqual((failed.status, failed.attempts),
+                         (OutboundEmail.Status.PENDING, 1))
+        self.assertGreater(failed.next_attempt,
+                           timezone.now() + timedelta(seconds=50))
+        self.assertEqual(OutboundEmail.objects.filter(
+            status=OutboundEmail.Status.SENT).count(), 1)
+
+        Mailer().drain()
+        self.assertEqual(len(mail.outbox), 0, "should wait for the backoff")
+
+        with mock.patch.object(CountingBackend, 'send_messages',
+                               side_effect=SMTPServerDisconnected('gone')):
+            for attempt in range(2):
+                OutboundEmail.objects.update(next_attempt=timezone.now())
+                Mailer().drain()
+        failed.refresh_from_db()
+        self.assertEqual((failed.status, failed.attempts),
+                         (OutboundEmail.Status.FAILED, 3))
+
+    def test_claims(self):
+        self.queue(3)
+        seen = list(OutboundEmail.objects.all())    # by another worker...
+        self.assertEqual(len(claim_batch(2)), 2)
+        later = timezone.now() + timedelta(minutes=5)
+        claimed = lease(seen, later)                # ...which claims late
+        self.assertEqual([m.to_email for m in claimed], ['dot2@kansas.gov'],
+                         "should not claim what another worker has")
+        self.assertEqual(claim_batch(10), [])
+
+    def test_backoff(self):
+        self.assertEqual([backoff(n).total_seconds() for n in (1, 2, 3)],
+                         [60, 120, 240])
+        with override_settings(MAIL_QUEUE_MAX_BACKOFF=100):
+            self.assertEqual(backoff(5).total_seconds(), 100)
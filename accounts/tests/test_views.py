@@ -1,8 +1,11 @@
+from io import StringIO
+
 from django.contrib import messages
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.auth.views import INTERNAL_RESET_SESSION_TOKEN
 from django.contrib.messages.storage.fallback import FallbackStorage
 from django.core import mail
+from django.core.management import call_command
 from django.test import RequestFactory, TestCase
 from django.urls import reverse
 from django.utils.encoding import force_bytes
@@ -10,7 +13,7 @@ from django.utils.http import urlsafe_base64_encode
 
 from ..views import (CustomUserCreationForm, EmailAddrView,
                      RegisterConfirmView, PasswordView)
-from ..models import User, UserProfile
+from ..models import OutboundEmail, User, UserProfile
 
 
 class SigninViewTest(TestCase):
@@ -110,12 +113,18 @@ class AtriumViewTest(TestCase):
                          "wrong username found")
         self.assertEqual(response.status_code, 200)
 
+    def send_queued(self):
+        call_command('sendqueuedmail', stdout=StringIO())
+
     def test_sends_email(self):
 
         mail.outbox = []
         response = self.client.post(self.the_url,
                                     {'usrname': "anotherPerson",
                                      'email': "i.am@waiting.4u"})
+        self.assertEqual(len(mail.outbox), 0, "should only queue the email")
+        self.assertEqual(OutboundEmail.objects.count(), 1)
+        self.send_queued()
         self.assertGreater(len(mail.outbox), 0)
 
         mail.outbox = []
@@ -124,6 +133,7 @@ class AtriumViewTest(TestCase):
             response = self.client.post(self.the_url,
                                         {'usrname': "someoneElse",
                                          'email': "i.am@myPeak.org"})
+            self.send_queued()
             email = mail.outbox[0]
             self.assertTrue(svc_name in email.body)
 
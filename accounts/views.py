@@ -11,16 +11,32 @@ from django.views import View
 from django.views.generic import CreateView, FormView
 
 from .forms import (CustomUserCreationForm, EmailForm, IngressForm,
-                    ProfileForm, UserForm, UserNameForm)
+                    ProfileForm, SigninForm, UserForm, UserNameForm)
+from .hashing import PasswordPoolFull
 
 
-class SignUpView(CreateView):
+class PasswordBusyMixin:
+    """
+    For views whose form_valid() sets a password: when the password pool
+    is full (see accounts.hashing), shows the form again, with the error.
+    """
+
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form)
+        except PasswordPoolFull as err:
+            form.add_error(None, str(err))
+            return self.form_invalid(form)
+
+
+class SignUpView(PasswordBusyMixin, CreateView):
     form_class = CustomUserCreationForm
     success_url = reverse_lazy('access')
     template_name = 'accounts/signup.html'
 
 
 class SigninView(LoginView):
+    form_class = SigninForm
     profile_url = reverse_lazy('profile')
     template_name = 'accounts/access.html'
 
@@ -130,10 +146,11 @@ class EmailAddrView(PasswordResetView):
         if hasattr(settings, 'SERVICE_HOSTNAME'):
             opts['domain_override'] = settings.SERVICE_HOSTNAME
         form.save(**opts)
-        return super().form_valid(form)
+        # PasswordResetView.form_valid would save (and queue the email) again
+        return super(PasswordResetView, self).form_valid(form)
 
 
-class RegisterConfirmView(PasswordResetConfirmView):
+class RegisterConfirmView(PasswordBusyMixin, PasswordResetConfirmView):
     template_name = 'accounts/vestibule.html'
     success_url = reverse_lazy('threshold')
 
@@ -1,18 +1,297 @@
+import asyncio
+import codecs
+import datetime
+import hashlib
+import inspect
+import json
+import logging
 import sys
+import time
 import traceback
-from functools import wraps
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, reduce, wraps
+from io import BytesIO
+from itertools import chain, islice
+from operator import attrgetter, itemgetter, or_
+from threading import Event, Lock
 
+from urllib.parse import urlsplit
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
 from django.conf import settings
+from django.core import signing
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.exceptions import FieldDoesNotExist, ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
-from django.http import JsonResponse
-from django.urls import path
+from django.core.signals import got_request_exception
+from django.db import (DatabaseError, close_old_connections, connections,
+                       transaction)
+from django.db.models import FileField, Q, prefetch_related_objects
+from django.db.models.query import ModelIterable, QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.http import (HttpRequest, HttpResponse, JsonResponse, QueryDict,
+                         StreamingHttpResponse)
+from django.urls import Resolver404, get_resolver, path
+from django.utils.cache import (get_conditional_response, patch_vary_headers,
+                                quote_etag)
+from django.utils.functional import SimpleLazyObject
+from django.utils.http import http_date
 from django.views.decorators.csrf import csrf_exempt
 
+from . import tokens
+from .idempotency import get_store as get_idempotency_store
+from .serializers import get_serializer
+
+logger = logging.getLogger('django.request')
+
+
+# How a value is treated while descending a lookup path, as bit flags.
+_MAPPING = 1    # read with ``data[key]`` rather than ``getattr(data, key)``
+_INVOKE = 2     # call it (callable, and not a Django DB manager)
+_URLIZE = 4     # replace it with ``get_absolute_url()`` at the end
+
+_kinds = {}     # type -> flags, for instances of that type
+
+
+def _kind(value):
+    """
+    Classify ``value``, caching the answer per type.  Classes themselves
+    are checked directly (and not cached), as the answer for a class can
+    differ from the one for its instances.
+    """
+    kind = _kinds.get(type(value))
+    if kind is not None:
+        return kind
+
+    if isinstance(value, type):
+        target, invocable = value, True
+    else:
+        target = type(value)
+        # ``hasattr(target, '__call__')`` would find ``type.__call__``
+        invocable = any('__call__' in vars(k) for k in target.__mro__)
+
+    kind = 0
+    if callable(getattr(target, 'keys', None)) and (
+            hasattr(target, '__getitem__')):
+        kind |= _MAPPING
+    # Call if it's callable except if it's a Django DB manager instance
+    #   We check if is a manager by checking the db_manager (duck typing)
+    if invocable and not hasattr(target, 'db_manager'):
+        kind |= _INVOKE
+    if hasattr(target, 'get_absolute_url'):
+        kind |= _URLIZE
+
+    if target is not value:
+        _kinds[target] = kind
+    return kind
+
+
+def _build_accessor(lookup, source):
+    """
+    Compile a dotted lookup string into a function which, given an instance
+    of ``source``, returns the value at the end of the path.  All string
+    handling happens here, so the accessor itself does none.
+    """
+    chunks = lookup.split('.')
+    if not chunks[0]:
+        return _identity
+    if source is type(None):
+        return _nothing
+    # An empty chunk ends the descent: a trailing dot is ignored, while
+    # "a..b" hands back the value of "a" as-is, without urlizing it.
+    urlize = _URLIZE
+    if '' in chunks:
+        stop = chunks.index('')
+        if stop < len(chunks) - 1:
+            urlize = 0
+        chunks = chunks[:stop]
+
+    # The source type is known, so the first step is settled right now.
+    first = chunks[0]
+    if _kinds.get(source, 0) & _MAPPING or (
+            callable(getattr(source, 'keys', None)) and
+            hasattr(source, '__getitem__')):
+        get_first = itemgetter(first)
+    else:
+        get_first = attrgetter(first)
+    rest = tuple(chunks[1:])
+    kinds = _kinds
+
+    def accessor(data):
+        value = get_first(data)
+        kind = kinds.get(type(value))
+        if kind is None:
+            kind = _kind(value)
+        if kind & _INVOKE:
+            value = value()
+            kind = kinds.get(type(value))
+            if kind is None:
+                kind = _kind(value)
+
+        for chunk in rest:
+            if value is None:
+                return None
+            if kind & _MAPPING:
+                value = value[chunk]
+            else:
+                value = getattr(value, chunk)
+            kind = kinds.get(type(value))
+            if kind is None:
+                kind = _kind(value)
+            if kind & _INVOKE:
+                value = value()
+                kind = kinds.get(type(value))
+                if kind is None:
+                    kind = _kind(value)
+
+        if kind & urlize:
+            value = value.get_absolute_url()
+        return value
+
+    return accessor
+
+
+def _column_path(model, lookup):
+    """
+    Translate a dotted lookup into an ORM path (``user.username`` becomes
+    ``user__username``) when it names a concrete column, possibly across
+    forward relations, on ``model``.  Returns None if reading the value
+    needs Python-side logic -- methods, properties, reverse or many-to-many
+    relations, a related object to urlize, or a field (like a FileField)
+    whose attribute differs from its column value.
+    """
+    chunks = lookup.split('.')
+    opts = model._meta
+    for num, chunk in enumerate(chunks):
+        last = num == len(chunks) - 1
+        try:
+            field = opts.pk if chunk == 'pk' else opts.get_field(chunk)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.many_to_many:
+            return None
+        if field.is_relation:
+            if chunk == field.attname and last:
+                break                       # the raw key, e.g. "user_id"
+            if last:
+                return None                 # a related object
+            opts = field.related_model._meta
+        elif not last or isinstance(field, FileField):
+            return None
+    return '__'.join(chunks)
+
+
+def _relation_plan(model, lookup):
+    """
+    Work out what a dotted lookup needs loaded on a queryset of ``model``:
+    returns ``(select, prefetch, only)`` where ``select`` is a
+    select_related() path (forward and one-to-one hops), ``prefetch`` a
+    prefetch_related() path (reverse and many-to-many hops, and anything
+    beyond them) and ``only`` the columns to load, or None if they cannot
+    be known (a method, property or whole related object is used).
+    """
+    select, prefetch, only = [], [], []
+    opts = model._meta
+    for chunk in lookup.split('.'):
+        try:
+            field = opts.pk if chunk == 'pk' else opts.get_field(chunk)
+        except FieldDoesNotExist:
+            field = None
+        if field is None or (field.is_relation and
+                             field.related_model is None):
+            if not prefetch:        # past a prefetch, columns don't matter
+                only = None
+            break
+        path = select + [chunk]
+        raw_key = chunk == getattr(field, 'attname', field.name) != field.name
+        if not field.is_relation or raw_key:        # e.g. "user_id"
+            if not prefetch:
+                only.append('__'.join(path))
+            break
+        if prefetch or field.many_to_many or field.one_to_many:
+            prefetch = (prefetch or select) + [chunk]
+        else:
+            if field.concrete:
+                only.append('__'.join(path))
+            select = path
+        opts = field.related_model._meta
+    else:
+        if not prefetch:
+            only = None     # the related object itself, all of it
+    return '__'.join(select), '__'.join(prefetch), only
+
+
+def _chunks(queryset, chunk_size):
+    """
+    The queryset's rows in lists of ``chunk_size``, read with
+    ``iterator()`` -- or, where the database's driver reads the whole
+    result of a query into memory regardless (MySQL's and MariaDB's do),
+    a page at a time by keyset as paginate() does, each page a query of
+    its own.  Querysets that can't be ordered by keyset are read whole
+    there.
+    """
+    ordering = None
+    if (connections[queryset.db].vendor == 'mysql'
+            and not queryset.query.is_sliced):
+        try:
+            ordering = _keyset_ordering(queryset)
+        except ApiError:
+            pass
+    if ordering is None:
+        rows = queryset.iterator(chunk_size=chunk_size)
+        while True:
+            batch = list(islice(rows, chunk_size))
+            if not batch:
+                return
+            yield batch
+
+    queryset = queryset.order_by(*ordering)
+    names = [name.lstrip('-') for name in ordering]
+    page = queryset
+    while True:
+        keys = list(page.values_list(*names)[chunk_size - 1:chunk_size + 1])
+        yield list(page[:chunk_size])
+        if len(keys) < 2:   # no row after the last one of this page
+            return
+        page = queryset.filter(_keyset_filter(ordering, keys[0]))
+
+
+def _chunked(queryset, chunk_size):
+    """
+    Iterate over a queryset ``chunk_size`` rows at a time (see _chunks),
+    still honouring its prefetch_related() lookups (which ``iterator()``
+    on its own ignores) by prefetching for each chunk.
+    """
+    prefetch = queryset._prefetch_related_lookups
+    for batch in _chunks(queryset, chunk_size):
+        if prefetch:
+            prefetch_related_objects(batch, *prefetch)
+        yield from batch
+
+
+def _identity(data):
+    return data
+
+
+def _nothing(data):
+    return None
+
 
 class Preparer(object):
+    """
+    The ``fields`` map is compiled on first use into one accessor per
+    (lookup, source type), so preparing a long list of objects does no
+    string handling and no recursion per row.
+    """
 
     def __init__(self, fields):
         self.fields = fields
+        self._accessors = {}    # (lookup, source type) -> accessor
+        self._plans = {}        # source type -> ((keyname, accessor), ...)
+        self._columns = {}      # model -> ORM paths for ``fields``, or None
+        self._loads = {}        # model -> (select, prefetch, only) for ``fields``
 
     def prepare(self, data, fieldlist=None):
         """
@@ -23,13 +302,151 @@ class Preparer(object):
              self.fields if self.fields else None)
         if not isinstance(fields, dict):  # No fields specified -- do nothing.
             return data
+        if isinstance(data, QuerySet):
+            return self.prepare_queryset(data, fieldlist)
+
+        source = type(data)
+        if fields is self.fields:
+            plan = self._plans.get(source)
+            if plan is None:
+                plan = self._plans[source] = self.plan(fields, source)
+        else:
+            plan = self.plan(fields, source)
 
         result = {}
-        for keyname, lookup in fields.items():
-            result[keyname] = self.extract_data(lookup, data)
+        for keyname, accessor in plan:
+            result[keyname] = accessor(data)
 
         return result
 
+    def prepare_queryset(self, queryset, fieldlist=None):
+        """
+        Prepares every object of a queryset, returning a list.
+        """
+        return list(self.iterate(queryset, fieldlist))
+
+    def iterate(self, queryset, fieldlist=None, chunk_size=None):
+        """
+        Yields the prepared objects of a queryset one at a time.  When every
+        lookup maps to a column, the rows are read with ``values_list()``
+        and no model instances are built at all; otherwise each object is
+        prepared in turn.  Given a ``chunk_size``, rows are fetched that many
+        at a time (see _chunks) instead of being cached on the queryset.
+        """
+        fields = fieldlist if fieldlist else self.fields
+        if not isinstance(fields, dict):  # No fields specified -- do nothing.
+            yield from queryset
+            return
+        models = issubclass(queryset._iterable_class, ModelIterable)
+        columns = self.columns(queryset.model, fieldlist) if models else None
+
+        if columns is None:
+            if models:
+                queryset = self.optimize(queryset, fieldlist)
+            if chunk_size:
+                queryset = _chunked(queryset, chunk_size)
+            plan, source = None, None
+            for obj in queryset:
+                if type(obj) is not source:
+                    source = type(obj)
+                    plan = self.plan(fields, source)
+                yield {keyname: accessor(obj) for keyname, accessor in plan}
+            return
+
+        keys = tuple(fields)
+        unique = tuple(dict.fromkeys(columns))
+        rows = queryset.values_list(*unique)
+        if chunk_size:
+            rows = chain.from_iterable(_chunks(rows, chunk_size))
+        if len(unique) == len(columns):
+            for row in rows:
+                yield dict(zip(keys, row))
+            return
+
+        index = tuple((key, unique.index(col))
+                      for key, col in zip(keys, columns))
+        for row in rows:
+            yield {key: row[num] for key, num in index}
+
+    def columns(self, model, fieldlist=None):
+        """
+        Returns the ORM paths for the fields (in order) on ``model``, or None
+        if any of them needs the per-object path.
+        """
+        if fieldlist:
+            paths = tuple(_column_path(model, lookup)
+                          for lookup in fieldlist.values())
+            return None if None in paths else paths
+
+        if model not in self._columns:
+            paths = tuple(_column_path(model, lookup)
+                          for lookup in self.fields.values())
+            self._columns[model] = None if None in paths else paths
+        return self._columns[model]
+
+    def optimize(self, queryset, fieldlist=None):
+        """
+        Applies select_related(), prefetch_related() and only() to a queryset
+        so that preparing its objects takes a fixed number of queries,
+        however many objects there are, and skips unused columns.
+        """
+        select, prefetch, only = self.loads(queryset.model, fieldlist)
+        query = queryset.query
+        if only and (query.select_related is not False or
+                     query.deferred_loading != (frozenset(), True)):
+            only = None     # the caller has made other arrangements
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        if only:
+            queryset = queryset.only(*only)
+        return queryset
+
+    def loads(self, model, fieldlist=None):
+        """
+        Returns the ``(select, prefetch, only)`` paths the fields need loaded
+        on a queryset of ``model``; ``only`` is None if unknown.
+        """
+        if not fieldlist and model in self._loads:
+            return self._loads[model]
+
+        fields = fieldlist if fieldlist else self.fields
+        select, prefetch, only = set(), set(), set()
+        for lookup in fields.values():
+            sel, pre, cols = _relation_plan(model, lookup)
+            if sel:
+                select.add(sel)
+            if pre:
+                prefetch.add(pre)
+            if cols is None or only is None:
+                only = None
+            else:
+                only.update(cols)
+        loads = (tuple(sorted(select)), tuple(sorted(prefetch)),
+                 tuple(sorted(only)) if only is not None else None)
+        if not fieldlist:
+            self._loads[model] = loads
+        return loads
+
+    def plan(self, fields, source):
+        """
+        Returns the compiled ``(keyname, accessor)`` pairs for ``fields``.
+        """
+        return tuple((keyname, self.compile(lookup, source))
+                     for keyname, lookup in fields.items())
+
+    def compile(self, lookup, source):
+        """
+        Returns the accessor for ``lookup`` applied to instances of
+        ``source``, building and caching it on first use.
+        """
+        key = (lookup, source)
+        accessor = self._accessors.get(key)
+        if accessor is None:
+            accessor = self._accessors[key] = _build_accessor(lookup, source)
+        return accessor
+
     def extract_data(self, lookup, data):
         """
         Given a lookup string, attempts to descend through nested data looking
@@ -37,33 +454,38 @@ class Preparer(object):
             lookup:  a non-empty string, without leading dot(s)
             data: anything
         """
-        chunks = lookup.split('.')
-        if not chunks[0]:
-            return data
-        chunk = chunks[0]                   # what we're looking for
-        remaining = '.'.join(chunks[1:])    # what we'll do later
-
-        value = getattr(data, 'keys', None)
-        if callable(value) and hasattr(data, '__getitem__'):
-            value = data[chunk]             # a dictionary(-like) object
-        elif data is not None:
-            value = getattr(data, chunk)    # a generic object
-        else:
-            value = None                    # nothing at all
+        return self.compile(lookup, type(data))(data)
+
+
+def _accepted_types(header):
+    """
+    The media types of an Accept header, most preferred first; those with
+    a q-value of 0 are left out.
+    """
+    accepted = []
+    for index, item in enumerate((header or '').split(',')):
+        media_type, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if media_type.strip() and quality > 0:
+            accepted.append((-quality, index, media_type.strip().lower()))
+    return [media_type for _, _, media_type in sorted(accepted)]
 
-        # Call if it's callable except if it's a Django DB manager instance
-        #   We check if is a manager by checking the db_manager (duck typing)
-        if callable(value) and not hasattr(value, 'db_manager'):
-            value = value()
 
-        if not remaining:
-            # See if it needs to be urlized
-            if hasattr(value, 'get_absolute_url'):
-                value = value.get_absolute_url()
-            return value
+class EncodedJsonResponse(JsonResponse):
+    """
+    A JsonResponse for a body that has been encoded already.
+    """
 
-        # There's more to lookup, so dive in recursively.
-        return self.extract_data(remaining, value)
+    def __init__(self, content, **kwargs):
+        kwargs.setdefault('content_type', 'application/json')
+        super(JsonResponse, self).__init__(content=content, **kwargs)
 
 
 class ApiError(Exception):
@@ -75,17 +497,148 @@ class ApiError(Exception):
         super(ApiError, self).__init__(msg)
 
 
+class CursorEncoder(DjangoJSONEncoder):
+    """
+    DjangoJSONEncoder cuts times to milliseconds, and a cursor on a time
+    key must keep every digit or rows are skipped or repeated.
+    """
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+class CursorSerializer(object):
+    """
+    Signing serializer for pagination cursors; ordering keys may be dates,
+    decimals or UUIDs, which come back as strings the ORM will accept.
+    """
+
+    def dumps(self, obj):
+        return json.dumps(obj, separators=(',', ':'),
+                          cls=CursorEncoder).encode('latin-1')
+
+    def loads(self, data):
+        return json.loads(data.decode('latin-1'))
+
+
+def _keyset_ordering(queryset):
+    """
+    The queryset's ordering as a list of field names, with the primary key
+    added as a tie-breaker so that every row has a unique position.
+    """
+    query = queryset.query
+    ordering = list(query.order_by or (
+        query.default_ordering and queryset.model._meta.ordering or []))
+    if not all(isinstance(name, str) for name in ordering) or (
+            '?' in ordering or query.extra_order_by):
+        raise ApiError('This list cannot be paginated.')
+    pk_names = ('pk', queryset.model._meta.pk.name)
+    if not any(name.lstrip('-') in pk_names for name in ordering):
+        ordering.append('pk')
+    return ordering
+
+
+def _keyset_filter(ordering, values):
+    """
+    Selects the rows after ``values`` in ``ordering``: for keys (a, b) that
+    is ``a > va OR (a = va AND b > vb)``, flipped for descending keys.
+    """
+    clauses, equal = [], {}
+    for name, value in zip(ordering, values):
+        field = name.lstrip('-')
+        after = '{}__{}'.format(field, 'lt' if name[0] == '-' else 'gt')
+        clauses.append(Q(**equal, **{after: value}))
+        equal[field] = value
+    return reduce(or_, clauses)
+
+
+_cache_registry = defaultdict(set)  # model label -> Api classes depending on it
+_cache_stats = Counter()            # (Api class, event) -> count
+_cache_stats_lock = Lock()
+
+
+_flights = {}                       # flight key -> _Flight
+_flights_lock = Lock()
+_flight_stats = Counter()           # (Api class, event) -> count
+
+
+class _Flight(object):
+    """
+    One response being made, for any number of identical requests.
+    """
+
+    def __init__(self):
+        self.done = Event()
+        self.snapshot = None    # what the followers copy, once it's made
+
+
+def _snapshot(response):
+    """
+    A copy of what a (not streaming) response sends, to make more of it.
+    Taken before the response goes back through the middleware, which may
+    change it -- compress it, say.
+    """
+    if response.streaming:
+        return None
+    return (response.content, response.status_code, list(response.items()),
+            getattr(response, 'compressed', None),
+            getattr(response, 'store_compressed', None))
+
+
+def _replay(snapshot):
+    content, status, headers, compressed, store_compressed = snapshot
+    response = HttpResponse(content, status=status)
+    for header, value in headers:
+        response[header] = value
+    if compressed is not None:
+        response.compressed = compressed
+        response.store_compressed = store_compressed
+    return response
+
+
+def _model_label(model):
+    if isinstance(model, str):
+        return model.lower()
+    return model._meta.label_lower
+
+
+def invalidate_api_caches(sender, **kwargs):
+    """
+    Receiver for ``post_save`` / ``post_delete``: drops the cached responses
+    of every Api that declared a dependency on the sender's model.
+    """
+    for api in _cache_registry.get(sender._meta.label_lower, ()):
+        api.invalidate_cache()
+
+
+def connect_invalidation(label):
+    """
+    Connects ``invalidate_api_caches`` to the ``post_save`` and
+    ``post_delete`` of the one model -- not of every model, which would
+    keep Django from fast-deleting any of them.
+    """
+    model = apps.get_model(label)
+    post_save.connect(invalidate_api_caches, sender=model,
+                      dispatch_uid='kernel.api.invalidate_on_save')
+    post_delete.connect(invalidate_api_caches, sender=model,
+                        dispatch_uid='kernel.api.invalidate_on_delete')
+
+
 class ApiBase(object):
 
     http_methods = {
         'list': {
             'GET': 'list',
+            'HEAD': 'list',
             'POST': 'create',
             'PUT': 'update_list',
             'DELETE': 'delete_list',
         },
         'detail': {
             'GET': 'detail',
+            'HEAD': 'detail',
             'POST': 'create_detail',
             'PUT': 'update',
             'DELETE': 'delete',
@@ -93,11 +646,45 @@ class ApiBase(object):
     }
     preparer = Preparer(None)
     serializer = DjangoJSONEncoder
+    serializer_backend = 'json'     # see kernel.serializers
+    negotiated_backends = ('msgpack',)  # also offered, by the Accept header
+    list_key = 'objects'    # where a list view's results go in the response
+    streaming = False       # stream list results instead of building them
+    chunk_size = 2000       # rows fetched (and sent) at a time when streaming
+    page_size = None        # paginate lists by default, this many per page
+    max_page_size = 1000    # the most rows a client may ask for in one page
+    cursor_salt = 'kernel.api.cursor'
+    cache_timeout = None    # seconds to cache GET responses; None to not
+    cache_models = ()       # models (or "app_label.Model") whose changes
+                            #   invalidate the cache
+    cache_per_user = False  # whether responses differ from user to user
+    cache_alias = DEFAULT_CACHE_ALIAS
+    token_auth = False      # accept "Authorization: Bearer <kernel.tokens>"
+    coalesce = False        # answer identical concurrent GETs only once
+    coalesce_timeout = 5    # seconds to wait on another request's answer
+    idempotency_store = 'database'  # see kernel.idempotency; None to ignore
+                                    #   Idempotency-Key headers.  'cache'
+                                    #   only with a cache shared between
+                                    #   processes
+    idempotency_ttl = 24 * 60 * 60  # seconds to keep responses for replays
+    idempotency_wait = 30   # seconds a duplicate waits for the original
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        for model in cls.cache_models:
+            label = _model_label(model)
+            _cache_registry[label].add(cls)
+            if apps.models_ready:   # else KernelConfig.ready() connects it
+                connect_invalidation(label)
 
     def __init__(self, *args, **kwargs):
         self.init_args = args
         self.init_kwargs = kwargs
         self.request = None
+        self.etag = None
+        self.last_modified = None
+        self.fieldlist = None   # the preparer's fields this request asks for
+        self.token = None       # the request's valid API token, if any
 
     @classmethod
     def build_url_name(cls, name, name_prefix=None):
@@ -151,15 +738,451 @@ class ApiBase(object):
             if method not in self.http_methods.get(endpoint, {}):
                 msg = "The specified HTTP method {} is not implemented.".format(method)
                 raise ApiError(msg)
+            if self.token_auth:
+                self.authenticate_token()
             if not self.is_authenticated():
                 raise ApiError('Unauthorized')
+            self.fieldlist = self.get_fieldlist()
+            if method in ('GET', 'HEAD'):
+                response = self.conditional_response(endpoint, *args, **kwargs)
+                if response is not None:
+                    return response
+            caching = method == 'GET' and bool(self.cache_timeout)
+            if caching:
+                response = self.cached_response()
+                if response is not None:
+                    return response
+            respond = partial(self.respond, endpoint, method, caching,
+                              *args, **kwargs)
+            if self.coalesce and method == 'GET':
+                return self.single_flight(respond)
+            key = self.idempotency_key() if method in ('POST', 'PUT') else None
+            if key:
+                return self.idempotent(respond, key)
+
+        except ApiError as err:
+            return self.build_response(self.build_error(err))
+
+        return respond()
+
+    def respond(self, endpoint, method, caching, *args, **kwargs):
+        """
+        Calls the view method and builds its response.
+        """
+        try:
             view_method = getattr(self, self.http_methods[endpoint][method])
             data = view_method(*args, **kwargs)
+            if method == 'HEAD':
+                # Nothing is prepared or encoded (or, for a queryset,
+                # even fetched) for a body that is never sent.
+                return self.add_validators(HttpResponse(
+                    content_type=self.get_serializer().content_type))
+            if isinstance(data, QuerySet) and self.is_paginated():
+                data = self.paginate(data)
 
         except ApiError as err:
-            data = self.build_error(err)
+            response = self.build_response(self.build_error(err))
+            response.api_error = True   # not kept for idempotent replays
+            return response
+
+        response = self.add_validators(self.build_response(data))
+        if caching:
+            self.cache_response(response)
+        return response
+
+    def idempotency_key(self):
+        """
+        The request's Idempotency-Key, scoped to its user, or None.
+        """
+        key = self.request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if not (key and self.idempotency_store):
+            return None
+        if self.token is not None:
+            user = self.token.user_id
+        else:
+            user = getattr(getattr(self.request, 'user', None), 'pk', None)
+        return hashlib.sha256('{}|{}'.format(user, key).encode()).hexdigest()
+
+    def idempotent(self, respond, key):
+        """
+        Returns ``respond()`` the first time a key (``idempotency_key()``)
+        is used, and a copy of that response when it comes again, within
+        ``idempotency_ttl`` seconds, without calling the view.  A duplicate
+        that arrives while the original is running waits for it (up to
+        ``idempotency_wait`` seconds).  Reusing a key for a different
+        request is an error.  Errors are not kept: a retry runs again.
+        """
+        store = get_idempotency_store(self.idempotency_store)
+        fingerprint = self.request_fingerprint()
+        deadline = time.monotonic() + self.idempotency_wait
+        delay = 0.01
+        while True:
+            response = self.claim_idempotency_key(store, key, fingerprint)
+            if response is not False:
+                break
+            if time.monotonic() > deadline:
+                raise ApiError('The request with this Idempotency-Key is '
+                               'still in progress.')
+            time.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        if response is not None:
+            return response
+
+        try:
+            response = respond()
+        except BaseException:
+            store.release(key)
+            raise
+        self.store_idempotent(store, key, fingerprint, response)
+        return response
+
+    def request_fingerprint(self):
+        return hashlib.sha256(b'|'.join([
+            self.request.method.encode(),
+            self.request.get_full_path().encode(),
+            self.request.body])).hexdigest()
+
+    def claim_idempotency_key(self, store, key, fingerprint):
+        """
+        Returns None if this request is the first with its key, the stored
+        response if it's a replay, or False while the original is running.
+        """
+        record = store.claim(key, fingerprint, self.idempotency_wait)
+        if record is None:
+            return None
+        if record['fingerprint'] != fingerprint:
+            raise ApiError('The Idempotency-Key was used for a '
+                           'different request.')
+        if record['response'] is None:
+            return False
+        content, status, headers = record['response']
+        response = HttpResponse(content, status=status)
+        for header, value in headers:
+            response[header] = value
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    def store_idempotent(self, store, key, fingerprint, response):
+        if response.streaming or getattr(response, 'api_error', False):
+            store.release(key)
+            return
+        store.save(key, fingerprint, (response.content, response.status_code,
+                                      list(response.items())),
+                   self.idempotency_ttl)
+
+    def flight_key(self):
+        """
+        Identifies the requests that may share one response: the same
+        Api, path and query, format, and user.
+        """
+        if self.token is not None:
+            user = self.token.user_id
+        else:
+            user = getattr(getattr(self.request, 'user', None), 'pk', None)
+        return (type(self), self.request.get_full_path(),
+                self.get_serializer().content_type, user)
+
+    def single_flight(self, respond):
+        """
+        Returns ``respond()``, unless the same request (by ``flight_key``)
+        is already being answered in this process: then waits for that
+        response, up to ``coalesce_timeout`` seconds, and sends a copy of
+        it.  Followers that time out, or whose leader fails or streams,
+        answer for themselves.
+        """
+        key = self.flight_key()
+        with _flights_lock:
+            flight = _flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _flights[key] = _Flight()
+
+        if leader:
+            self.count_flight_event('leaders')
+            try:
+                response = respond()
+                flight.snapshot = _snapshot(response)
+                return response
+            finally:
+                with _flights_lock:
+                    del _flights[key]
+                flight.done.set()
+
+        if flight.done.wait(self.coalesce_timeout):
+            if flight.snapshot is not None:
+                self.count_flight_event('coalesced')
+                return _replay(flight.snapshot)
+            self.count_flight_event('fallbacks')
+        else:
+            self.count_flight_event('timeouts')
+        return respond()
+
+    @classmethod
+    def count_flight_event(cls, event):
+        with _cache_stats_lock:
+            _flight_stats[cls, event] += 1
+
+    @classmethod
+    def coalesce_stats(cls):
+        """
+        For this Api, in this process: requests answered as leaders, those
+        that shared a leader's response, and those that answered for
+        themselves after a timeout or a failed (or streaming) leader.
+        """
+        events = ('leaders', 'coalesced', 'timeouts', 'fallbacks')
+        return {event: _flight_stats[cls, event] for event in events}
+
+    def get_fieldlist(self):
+        """
+        The preparer's fields narrowed by the ``fields`` and ``exclude``
+        query parameters (comma-separated names), or None for all of them.
+        Passed on to the preparer, the narrowing reaches the query too:
+        only the selected columns are fetched.
+        """
+        params = self.request.GET
+        fields = self.preparer.fields
+        if not isinstance(fields, dict) or not (
+                'fields' in params or 'exclude' in params):
+            return None
+
+        def names(param):
+            return [name for name in params.get(param, '').split(',') if name]
+
+        wanted = names('fields') if 'fields' in params else list(fields)
+        excluded = names('exclude')
+        unknown = set(wanted).union(excluded).difference(fields)
+        if unknown:
+            raise ApiError('Unknown field(s): {}.'.format(
+                ', '.join(sorted(unknown))))
+        selected = {keyname: lookup for keyname, lookup in fields.items()
+                    if keyname in wanted and keyname not in excluded}
+        if not selected:
+            raise ApiError('No fields selected.')
+        return selected
+
+    def get_etag(self, endpoint, *args, **kwargs):
+        """
+        Returns a cheap version of the resource -- a row hash, a counter, a
+        max-updated timestamp -- from which the ETag is made, or None.
+        Should be overwritten by subclasses wanting conditional requests.
+        """
+        return None
+
+    def get_last_modified(self, endpoint, *args, **kwargs):
+        """
+        Returns when the resource last changed (a datetime), or None.
+        Should be overwritten by subclasses wanting conditional requests.
+        """
+        return None
+
+    def conditional_response(self, endpoint, *args, **kwargs):
+        """
+        Answers ``If-None-Match`` / ``If-Modified-Since`` from the declared
+        version source alone, returning a 304 response -- or None, if the
+        view has to run after all.
+        """
+        version = self.get_etag(endpoint, *args, **kwargs)
+        modified = self.get_last_modified(endpoint, *args, **kwargs)
+        return self.check_conditions(version, modified)
+
+    def check_conditions(self, version, modified):
+        if version is not None:
+            # The same data is represented differently per query string,
+            # and per format.
+            tag = '{}|{}|{}'.format(version, self.request.get_full_path(),
+                                    self.get_serializer().content_type)
+            self.etag = quote_etag(hashlib.md5(tag.encode()).hexdigest())
+        if modified is not None:
+            self.last_modified = int(modified.timestamp())
+        if self.etag is None and self.last_modified is None:
+            return None
+
+        response = get_conditional_response(
+            self.request, etag=self.etag, last_modified=self.last_modified)
+        if response is not None:
+            self.add_validators(response)
+            if self.negotiated_backends:
+                patch_vary_headers(response, ('Accept',))
+        return response
+
+    def add_validators(self, response):
+        if self.etag is not None:
+            response['ETag'] = self.etag
+        if self.last_modified is not None:
+            response['Last-Modified'] = http_date(self.last_modified)
+        return response
+
+    # Server-side response cache.  Entries are keyed on a generation number
+    # per Api class, so invalidating is one increment: the old entries are
+    # never read again, and simply expire.  The generation lives in the
+    # cache too, so with a cache of each process's own (the local-memory
+    # one Django uses when CACHES isn't set), a change only invalidates the
+    # responses cached by the process that made it: use a shared cache
+    # wherever there's more than one.
+
+    @classmethod
+    def cache_prefix(cls):
+        return 'kernel.api:{}.{}'.format(cls.__module__, cls.__qualname__)
+
+    @classmethod
+    def cache_generation_key(cls):
+        return cls.cache_prefix() + ':generation'
+
+    @classmethod
+    def invalidate_cache(cls):
+        cache = caches[cls.cache_alias]
+        key = cls.cache_generation_key()
+        try:
+            cache.incr(key)
+        except ValueError:  # not there (yet, or any more)
+            cache.add(key, time.time_ns(), None)
+        cls.count_cache_event('invalidations')
+
+    @classmethod
+    def count_cache_event(cls, event):
+        with _cache_stats_lock:
+            _cache_stats[cls, event] += 1
+
+    @classmethod
+    def cache_stats(cls):
+        """
+        Hit, miss and invalidation counts for this Api, in this process.
+        """
+        events = ('hits', 'misses', 'invalidations')
+        return {event: _cache_stats[cls, event] for event in events}
+
+    def cache_key(self):
+        cache = caches[self.cache_alias]
+        gen_key = self.cache_generation_key()
+        generation = cache.get(gen_key)
+        if generation is None:
+            # Not starting from 0 again, in case an eviction lost it:
+            # entries from before then must not come back to life.
+            cache.add(gen_key, time.time_ns(), None)
+            generation = cache.get(gen_key)
+        scope = '{}|{}'.format(self.request.get_full_path(),
+                               self.get_serializer().content_type)
+        if self.cache_per_user:
+            scope = '{}|{}'.format(scope, self.request.user.pk)
+        return '{}:{}:{}'.format(self.cache_prefix(), generation,
+                                 hashlib.md5(scope.encode()).hexdigest())
+
+    def cached_response(self):
+        """
+        Returns the stored response for this request, already encoded, or
+        None (remembering the key for ``cache_response``).
+        """
+        self._cache_key = self.cache_key()
+        entry = caches[self.cache_alias].get(self._cache_key)
+        if entry is None:
+            self.count_cache_event('misses')
+            return None
+
+        self.count_cache_event('hits')
+        response = HttpResponse(entry['content'],
+                                content_type=entry['content_type'])
+        for header, value in entry['headers']:
+            response[header] = value
+        self.attach_compressed(response, entry)
+        return response
+
+    def cache_response(self, response):
+        if response.streaming or response.status_code != 200:
+            return
+        headers = [(header, response[header])
+                   for header in ('ETag', 'Last-Modified', 'Vary')
+                   if header in response]
+        entry = {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'headers': headers,
+            'compressed': {},
+            'expires': time.time() + self.cache_timeout,
+        }
+        caches[self.cache_alias].set(self._cache_key, entry, self.cache_timeout)
+        self.attach_compressed(response, entry)
+
+    def attach_compressed(self, response, entry):
+        """
+        Hands ``CompressionMiddleware`` the compressed copies of a cached
+        body, and a way to add to them, so each encoding of an entry is
+        compressed only once.
+        """
+        key = self._cache_key
+        alias = self.cache_alias
 
-        return self.build_response(data)
+        def store_compressed(encoding, body):
+            entry['compressed'][encoding] = body
+            remaining = entry['expires'] - time.time()
+            if remaining > 0:
+                caches[alias].set(key, entry, remaining)
+
+        response.compressed = entry['compressed']
+        response.store_compressed = store_compressed
+
+    def is_paginated(self):
+        params = self.request.GET
+        return bool(self.page_size or 'limit' in params or 'cursor' in params)
+
+    def paginate(self, queryset):
+        """
+        Returns one page of a list, found by keyset rather than by offset:
+        the ``cursor`` parameter carries the ordering key of the last row
+        sent, so every page is a range scan starting right after it, no
+        matter how deep the client pages.  The keys should be indexed (the
+        primary key always is) and not null.
+        """
+        limit = self.get_limit()
+        ordering = _keyset_ordering(queryset)
+        queryset = queryset.order_by(*ordering)
+        cursor = self.request.GET.get('cursor')
+        if cursor:
+            values = self.read_cursor(cursor, ordering)
+            queryset = queryset.filter(_keyset_filter(ordering, values))
+
+        names = [name.lstrip('-') for name in ordering]
+        keys = list(queryset.values_list(*names)[limit - 1:limit + 1])
+        next_url = None
+        if len(keys) > 1:   # there is a row after the last one of this page
+            next_url = self.page_url(self.make_cursor(ordering, keys[0]),
+                                     limit)
+        return {
+            self.list_key: self.preparer.prepare(queryset[:limit],
+                                                 self.fieldlist),
+            'next': next_url,
+        }
+
+    def get_limit(self):
+        limit = self.request.GET.get('limit') or (
+            self.page_size or self.max_page_size)
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ApiError('The limit must be a number.')
+        if limit < 1:
+            raise ApiError('The limit must be at least 1.')
+        return min(limit, self.max_page_size)
+
+    def make_cursor(self, ordering, values):
+        return signing.dumps([ordering, list(values)], salt=self.cursor_salt,
+                             serializer=CursorSerializer)
+
+    def read_cursor(self, cursor, ordering):
+        try:
+            cursor_ordering, values = signing.loads(
+                cursor, salt=self.cursor_salt, serializer=CursorSerializer)
+        except (signing.BadSignature, ValueError):
+            raise ApiError('Invalid cursor.')
+        if cursor_ordering != ordering:
+            raise ApiError('Invalid cursor.')
+        return values
+
+    def page_url(self, cursor, limit):
+        params = self.request.GET.copy()
+        params['cursor'] = cursor
+        params['limit'] = limit
+        return self.request.build_absolute_uri(
+            '{}?{}'.format(self.request.path, params.urlencode()))
 
     def build_error(self, err):
         data = {'error': err.args[0]}
@@ -177,11 +1200,104 @@ class ApiBase(object):
         return data
 
     def build_response(self, data):
-        return JsonResponse(data, encoder=self.serializer)
+        if isinstance(data, QuerySet):
+            if self.streaming:
+                return self.build_streaming_response(data)
+            data = self.prepare_list(data)
+        backend = self.get_serializer()
+        response_class = (EncodedJsonResponse if backend.streaming
+                          else HttpResponse)
+        response = response_class(backend.dumps(data),
+                                  content_type=backend.content_type)
+        if self.negotiated_backends:
+            patch_vary_headers(response, ('Accept',))
+        return response
+
+    def get_serializer(self):
+        """
+        The backend for the response body: the first of
+        ``negotiated_backends`` whose content type the client's Accept
+        header prefers to the default ``serializer_backend``'s.
+        """
+        default = get_serializer(self.serializer_backend, self.serializer)
+        if not self.negotiated_backends:
+            return default
+        offered = {default.content_type: default}
+        for name in self.negotiated_backends:
+            backend = get_serializer(name, self.serializer)
+            offered.setdefault(backend.content_type, backend)
+        for media_type in _accepted_types(self.request.META.get('HTTP_ACCEPT')):
+            if media_type in offered:
+                return offered[media_type]
+            if media_type in ('*/*', 'application/*'):
+                break
+        return default
+
+    def get_parser(self):
+        """
+        The backend that reads the request body, by its Content-Type.
+        """
+        content_type = self.request.content_type
+        for name in self.negotiated_backends:
+            backend = get_serializer(name, self.serializer)
+            if backend.content_type == content_type:
+                return backend
+        return get_serializer(self.serializer_backend, self.serializer)
+
+    def prepare_list(self, queryset):
+        return {self.list_key: self.preparer.prepare(queryset, self.fieldlist)}
+
+    def build_streaming_response(self, queryset):
+        """
+        Sends the prepared rows of a queryset as they are produced, so that
+        neither the queryset nor the whole payload is ever held in memory.
+        The body is still a single JSON document.
+        """
+        backend = self.get_serializer()
+        if not backend.streaming:
+            return self.build_response(self.prepare_list(queryset))
+        return StreamingHttpResponse(self.stream_json(queryset, backend),
+                                     content_type=backend.content_type)
+
+    def stream_json(self, queryset, backend):
+        dumps = backend.dumps
+        chunk_size = self.chunk_size
+        rows = self.preparer.iterate(queryset, self.fieldlist, chunk_size)
+
+        yield b'{' + dumps(self.list_key) + b': ['
+        separator = b''
+        while True:
+            batch = [dumps(row) for row in islice(rows, chunk_size)]
+            if not batch:
+                break
+            yield separator + b', '.join(batch)
+            separator = b', '
+        yield b']}'
+
+    def authenticate_token(self):
+        """
+        Checks the request's bearer token, if it has one.  A good token is
+        kept in ``self.token`` and its user becomes ``request.user`` -- but
+        is only fetched if something asks for it: checking the token takes
+        no query.  Since the user isn't read, deactivating one doesn't stop
+        their tokens; revoke them too (see kernel.tokens).
+        """
+        scheme, _, credentials = self.request.META.get(
+            'HTTP_AUTHORIZATION', '').partition(' ')
+        if scheme.lower() != 'bearer':
+            return
+        try:
+            self.token = tokens.verify(credentials.strip())
+        except tokens.InvalidToken as err:
+            raise ApiError('Invalid token: {}.'.format(err))
+        self.request.user = SimpleLazyObject(partial(tokens.get_user,
+                                                     self.token))
 
     def is_authenticated(self):
         # Should be overwritten by subclasses
-        if self.request.method.upper() == 'GET':
+        if self.token is not None:
+            return True
+        if self.request.method.upper() in ('GET', 'HEAD'):
             return True
 
         return False
@@ -215,3 +1331,635 @@ class ApiBase(object):
 
     def delete_list(self, *args, **kwargs):     # pragma: no cover
         raise ApiError('The "delete_list" method is not implemented.')
+
+
+async def _call(func, *args, **kwargs):
+    """
+    Await ``func`` if it is a coroutine function; otherwise it may well
+    touch the database, so run it in a thread.
+    """
+    if asyncio.iscoroutinefunction(func):
+        return await func(*args, **kwargs)
+    return await sync_to_async(func)(*args, **kwargs)
+
+
+class AsyncApiBase(ApiBase):
+    """
+    An ApiBase for ASGI deployments: the view and its handlers are
+    coroutines, so a request only leaves the event loop for the work that
+    really has to be synchronous -- evaluating querysets, reading the
+    cache, and any handler a subclass writes as a plain method.
+
+    Lists are always built in full: this version of Django iterates a
+    streaming response on the event loop, where the ORM may not run.
+    """
+
+    @classmethod
+    def as_list(cls, *args, **kwargs):
+        return cls.as_view('list', *args, **kwargs)
+
+    @classmethod
+    def as_detail(cls, *args, **kwargs):
+        return cls.as_view('detail', *args, **kwargs)
+
+    @classmethod
+    def as_view(cls, view_type, *init_args, **init_kwargs):
+
+        @wraps(cls)
+        async def _wrapper(request, *args, **kwargs):
+            # Make a new instance so that no state potentially leaks between
+            # instances.
+            inst = cls(*init_args, **init_kwargs)
+            inst.request = request
+            return await inst.handle(view_type, *args, **kwargs)
+
+        # csrf_exempt() would hide the coroutine behind a plain function.
+        _wrapper.csrf_exempt = True
+        return _wrapper
+
+    async def handle(self, endpoint, *args, **kwargs):
+        method = self.request.method.upper()
+        try:
+            if method not in self.http_methods.get(endpoint, {}):
+                msg = "The specified HTTP method {} is not implemented.".format(method)
+                raise ApiError(msg)
+            if self.token_auth:
+                self.authenticate_token()
+            if not await _call(self.is_authenticated):
+                raise ApiError('Unauthorized')
+            self.fieldlist = self.get_fieldlist()
+            if method in ('GET', 'HEAD'):
+                version = await _call(self.get_etag, endpoint, *args, **kwargs)
+                modified = await _call(self.get_last_modified, endpoint,
+                                       *args, **kwargs)
+                response = self.check_conditions(version, modified)
+                if response is not None:
+                    return response
+            caching = method == 'GET' and bool(self.cache_timeout)
+            if caching:
+                response = await sync_to_async(self.cached_response)()
+                if response is not None:
+                    return response
+            respond = partial(self.respond, endpoint, method, caching,
+                              *args, **kwargs)
+            if self.coalesce and method == 'GET':
+                return await self.single_flight(respond)
+            key = None
+            if method in ('POST', 'PUT'):
+                # In a thread, as the user may have to be loaded.
+                key = await sync_to_async(self.idempotency_key)()
+            if key:
+                return await self.idempotent(respond, key)
+
+        except ApiError as err:
+            return self.build_response(self.build_error(err))
+
+        return await respond()
+
+    async def respond(self, endpoint, method, caching, *args, **kwargs):
+        try:
+            view_method = getattr(self, self.http_methods[endpoint][method])
+            data = await _call(view_method, *args, **kwargs)
+            if method == 'HEAD':
+                return self.add_validators(HttpResponse(
+                    content_type=self.get_serializer().content_type))
+            if isinstance(data, QuerySet):
+                data = await sync_to_async(self.evaluate_list)(data)
+
+        except ApiError as err:
+            response = self.build_response(self.build_error(err))
+            response.api_error = True   # not kept for idempotent replays
+            return response
+
+        response = self.add_validators(self.build_response(data))
+        if caching:
+            await sync_to_async(self.cache_response)(response)
+        return response
+
+    async def idempotent(self, respond, key):
+        # As ApiBase.idempotent, with the waiting done on the event loop.
+        store = get_idempotency_store(self.idempotency_store)
+        fingerprint = self.request_fingerprint()
+        deadline = time.monotonic() + self.idempotency_wait
+        delay = 0.01
+        while True:
+            response = await sync_to_async(self.claim_idempotency_key)(
+                store, key, fingerprint)
+            if response is not False:
+                break
+            if time.monotonic() > deadline:
+                raise ApiError('The request with this Idempotency-Key is '
+                               'still in progress.')
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.5)
+        if response is not None:
+            return response
+
+        try:
+            response = await respond()
+        except BaseException:
+            await sync_to_async(store.release)(key)
+            raise
+        await sync_to_async(self.store_idempotent)(store, key, fingerprint,
+                                                   response)
+        return response
+
+    async def single_flight(self, respond):
+        # As ApiBase.single_flight, with the waiting done on the event loop.
+        # The key is made in a thread: finding out who the user is may
+        # well query the database.
+        key = (asyncio.get_running_loop(),
+               await sync_to_async(self.flight_key)())
+        flight = _flights.get(key)
+        if flight is None:
+            flight = _flights[key] = asyncio.get_running_loop().create_future()
+            self.count_flight_event('leaders')
+            snapshot = None
+            try:
+                response = await respond()
+                snapshot = _snapshot(response)
+                return response
+            finally:
+                del _flights[key]
+                flight.set_result(snapshot)
+
+        try:
+            snapshot = await asyncio.wait_for(asyncio.shield(flight),
+                                              self.coalesce_timeout)
+        except asyncio.TimeoutError:
+            self.count_flight_event('timeouts')
+            return await respond()
+        if snapshot is None:
+            self.count_flight_event('fallbacks')
+            return await respond()
+        self.count_flight_event('coalesced')
+        return _replay(snapshot)
+
+    def evaluate_list(self, queryset):
+        if self.is_paginated():
+            return self.paginate(queryset)
+        return self.prepare_list(queryset)
+
+    async def is_authenticated(self):
+        # Should be overwritten by subclasses
+        if self.token is not None:
+            return True
+        if self.request.method.upper() in ('GET', 'HEAD'):
+            return True
+
+        return False
+
+    async def get_etag(self, endpoint, *args, **kwargs):
+        return None
+
+    async def get_last_modified(self, endpoint, *args, **kwargs):
+        return None
+
+    # Common methods the child class should implement.
+
+    async def list(self, *args, **kwargs):      # pragma: no cover
+        raise ApiError('The "list" method is not implemented.')
+
+    async def detail(self, *args, **kwargs):    # pragma: no cover
+        raise ApiError('The "detail" method is not implemented.')
+
+    async def create(self, *args, **kwargs):    # pragma: no cover
+        raise ApiError('The "create" method is not implemented.')
+
+    async def update(self, *args, **kwargs):    # pragma: no cover
+        raise ApiError('The "update" method is not implemented.')
+
+    async def delete(self, *args, **kwargs):    # pragma: no cover
+        raise ApiError('The "delete" method is not implemented.')
+
+    # Uncommon methods the child class should implement.
+
+    async def update_list(self, *args, **kwargs):       # pragma: no cover
+        raise ApiError('The "update_list" method is not implemented.')
+
+    async def create_detail(self, *args, **kwargs):     # pragma: no cover
+        raise ApiError('The "create_detail" method is not implemented.')
+
+    async def delete_list(self, *args, **kwargs):       # pragma: no cover
+        raise ApiError('The "delete_list" method is not implemented.')
+
+
+class BatchApi(ApiBase):
+    """
+    Runs several Api calls in one HTTP request, so that middleware, session
+    and authentication are paid for once per batch instead of once per
+    call.  The body is a JSON array of sub-requests:
+
+        [{"method": "GET", "path": "/api/user/3"},
+         {"method": "PUT", "path": "/api/user/4", "body": {...}}, ...]
+
+    and the response lists, in the same order, ``{"status": ..., "body":
+    ...}`` for each.  Only ApiBase routes can be called.  Consecutive
+    read-only (GET/HEAD) sub-requests run in parallel on a bounded thread
+    pool; anything else runs alone, in order, so reads see earlier writes.
+    """
+
+    http_methods = {
+        'list': {
+            'POST': 'create',
+        },
+        'detail': {},
+    }
+    max_items = 25      # sub-requests allowed in one batch
+    batch_only_headers = ('HTTP_IDEMPOTENCY_KEY', 'HTTP_IF_MATCH',
+                          'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE',
+                          'HTTP_IF_UNMODIFIED_SINCE')
+    max_workers = 4     # threads shared by all batches in this process
+    _executor = None
+    _executor_lock = Lock()
+
+    @classmethod
+    def urls(cls, name_prefix=None):
+        name = cls.__name__.replace('Api', '').strip('_').lower()
+        return [path(name, cls.as_list(), name=cls.build_url_name('list', name))]
+
+    @classmethod
+    def executor(cls):
+        with cls._executor_lock:
+            if cls._executor is None:
+                cls._executor = ThreadPoolExecutor(
+                    cls.max_workers, thread_name_prefix='api-batch')
+        return cls._executor
+
+    def is_authenticated(self):
+        # Each sub-request is checked by the Api it is sent to.
+        return True
+
+    def create(self, *args, **kwargs):
+        try:
+            items = self.get_parser().loads(self.request.body)
+        except ValueError:
+            raise ApiError('The batch must be a JSON array.')
+        if not isinstance(items, list) or not all(
+                isinstance(item, dict) for item in items):
+            raise ApiError('The batch must be a JSON array of objects.')
+        if len(items) > self.max_items:
+            raise ApiError('At most {} requests may be batched.'.format(
+                self.max_items))
+
+        # Settle the user now, rather than in several threads at once.
+        user = getattr(self.request, 'user', None)
+        if user is not None:
+            user.is_authenticated
+
+        results, reads = [], []
+        for item in items:
+            if str(item.get('method', 'GET')).upper() in ('GET', 'HEAD'):
+                reads.append(item)
+                continue
+            results.extend(self.run_parallel(reads))
+            results.append(self.run(item))
+            reads = []
+        results.extend(self.run_parallel(reads))
+        return {self.list_key: results}
+
+    def run_parallel(self, items):
+        if len(items) < 2:
+            return [self.run(item) for item in items]
+        return list(self.executor().map(self.run_in_thread, items))
+
+    def run_in_thread(self, item):
+        try:
+            return self.run(item)
+        finally:
+            close_old_connections()
+
+    def run(self, item):
+        """
+        Calls the Api view for one sub-request, returning its result.
+        """
+        method = str(item.get('method', 'GET')).upper()
+        url = urlsplit(str(item.get('path', '')))
+        try:
+            match = get_resolver(getattr(self.request, 'urlconf', None)
+                                 ).resolve(url.path)
+        except Resolver404:
+            match = None
+        api = inspect.unwrap(match.func) if match else None
+        if not (isinstance(api, type) and issubclass(api, ApiBase)) or (
+                issubclass(api, BatchApi)):
+            return {'status': 404,
+                    'body': {'error': 'No Api found at {}'.format(url.path)}}
+
+        request = self.sub_request(method, url, item.get('body'))
+        view = match.func
+        if asyncio.iscoroutinefunction(view):
+            view = async_to_sync(view)
+        try:
+            response = view(request, *match.args, **match.kwargs)
+            body = _response_body(response)
+        except Exception:
+            # One broken call fails only its own item, not the batch; it's
+            # still reported, as Django reports any other.
+            got_request_exception.send(sender=None, request=request)
+            logger.exception('Internal Server Error: %s', url.path,
+                             extra={'status_code': 500, 'request': request})
+            return {'status': 500,
+                    'body': self.build_error(ApiError('Server Error'))}
+        return {'status': response.status_code, 'body': body}
+
+    def sub_request(self, method, url, body):
+        """
+        A request for one sub-request, sharing the batch's user, session
+        and headers.
+        """
+        outer = self.request
+        request = HttpRequest()
+        request.method = method
+        request.path = request.path_info = url.path
+        # JSON responses, to be nested in the batch's own (whatever it is)
+        request.META = dict(outer.META, REQUEST_METHOD=method,
+                            PATH_INFO=url.path, QUERY_STRING=url.query,
+                            HTTP_ACCEPT='application/json')
+        # These are about the batch, not about any one call in it.
+        for header in self.batch_only_headers:
+            request.META.pop(header, None)
+        request.GET = QueryDict(url.query)
+        if body is not None:
+            request._body = body if isinstance(body, str) else json.dumps(body)
+            request._body = request._body.encode()
+            request.META['CONTENT_TYPE'] = 'application/json'
+            request.META['CONTENT_LENGTH'] = str(len(request._body))
+        else:
+            request._body = b''
+        request._stream = BytesIO(request._body)
+        for attr in ('user', 'session', 'urlconf'):
+            if hasattr(outer, attr):
+                setattr(request, attr, getattr(outer, attr))
+        return request
+
+
+def _response_body(response):
+    if response.streaming:
+        content = b''.join(response.streaming_content)
+    else:
+        content = response.content
+    if not content:
+        return None
+    if response.get('Content-Type', '').startswith('application/json'):
+        return json.loads(content)
+    return content.decode(response.charset)
+
+
+def iter_json_array(stream, chunk_size=64 * 1024):
+    """
+    Yields the items of a JSON array read from a file-like ``stream`` of
+    bytes, one at a time, without ever holding the whole document (or
+    the list it decodes to) in memory.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        chunk = stream.read(chunk_size)
+        eof = not chunk
+        buf = buf[pos:] + text.decode(chunk or b'', final=eof)
+        pos = 0
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\n\r':
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            fill()
+
+    skip_space()
+    if buf[pos:pos + 1] != '[':
+        raise ValueError('Expected a JSON array.')
+    pos += 1
+    skip_space()
+    if buf[pos:pos + 1] == ']':
+        return
+    while True:
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            item, end = None, None
+        # A number (or literal) at the end of the buffer may go on in the
+        # next chunk, so only take an item once what follows it is seen.
+        if end is None or not eof and (
+                end == len(buf) or buf[end] not in ' \t\n\r,]'):
+            if eof:
+                raise ValueError('Invalid or truncated JSON array.')
+            fill()
+            continue
+        pos = end
+        yield item
+        skip_space()
+        delimiter = buf[pos:pos + 1]
+        pos += 1
+        if delimiter == ']':
+            return
+        if delimiter != ',':
+            raise ValueError('Invalid or truncated JSON array.')
+        skip_space()
+
+
+class ModelApi(ApiBase):
+    """
+    An Api over one model.  The output of ``list`` and ``detail`` is shaped
+    by the preparer; the same names are used for input, for every field
+    whose lookup is a plain column of the model.
+
+    The list-level writes take a JSON array in the body -- objects to
+    create, objects (with their primary key) to update, primary keys to
+    delete.  The body is parsed incrementally, every row is validated
+    before the database is touched, and all of it is written in one
+    transaction with ``bulk_create`` / ``bulk_update`` (``batch_size`` rows
+    per statement) or a single ``delete()``.
+    """
+
+    model = None
+    batch_size = 1000
+    max_errors = 20     # invalid rows reported before giving up
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def list(self, *args, **kwargs):
+        return self.get_queryset()
+
+    def detail(self, pk, *args, **kwargs):
+        queryset = self.preparer.optimize(self.get_queryset(), self.fieldlist)
+        try:
+            obj = queryset.get(pk=pk)
+        except self.model.DoesNotExist:
+            raise ApiError('Not found.')
+        return self.preparer.prepare(obj, self.fieldlist)
+
+    def writable_fields(self):
+        """
+        Maps input names to the model fields they are written to.
+        """
+        opts = self.model._meta
+        writable = {}
+        for keyname, lookup in (self.preparer.fields or {}).items():
+            try:
+                field = opts.pk if lookup == 'pk' else opts.get_field(lookup)
+            except FieldDoesNotExist:
+                continue
+            if field.concrete and not field.many_to_many and (
+                    lookup in (field.name, field.attname, 'pk')):
+                writable[keyname] = field
+        return writable
+
+    def pk_name(self):
+        pk = self.model._meta.pk
+        for keyname, field in self.writable_fields().items():
+            if field is pk:
+                return keyname
+        return 'pk'
+
+    def read_rows(self):
+        parser = self.get_parser()
+        try:
+            if parser.streaming:
+                yield from iter_json_array(self.request)
+                return
+            rows = parser.loads(self.request.body)
+        except ValueError as err:
+            raise ApiError(str(err))
+        if not isinstance(rows, list):
+            raise ApiError('Expected an array.')
+        yield from rows
+
+    def row_values(self, row, writable):
+        """
+        Returns ``{field: value}`` for one input row (a JSON object).
+        """
+        if not isinstance(row, dict):
+            raise ValidationError('Each row must be a JSON object.')
+        unknown = set(row) - set(writable)
+        if unknown:
+            raise ValidationError('Cannot write {}.'.format(
+                ', '.join(sorted(unknown))))
+        return {writable[key]: value for key, value in row.items()}
+
+    def validate(self, obj, fields):
+        """
+        Validates the given fields of ``obj``.  Uniqueness is left to the
+        database: checking it here would cost a query per row.
+        """
+        exclude = [f.name for f in obj._meta.fields if f not in fields]
+        obj.full_clean(exclude=exclude, validate_unique=False)
+
+    def check_errors(self, errors):
+        if errors:
+            raise ApiError({'invalid': errors})
+
+    def add_error(self, errors, index, err):
+        errors.append({'index': index,
+                       'errors': getattr(err, 'message_dict', err.messages)})
+        if len(errors) >= self.max_errors:
+            self.check_errors(errors)
+
+    def write(self, func, *args, **kwargs):
+        try:
+            with transaction.atomic(using=self.get_queryset().db):
+                result = func(*args, **kwargs)
+        except DatabaseError as err:
+            raise ApiError('The changes could not be saved: {}'.format(err))
+        # bulk operations send no post_save/post_delete signals
+        invalidate_api_caches(self.model)
+        return result
+
+    def create(self, *args, **kwargs):
+        writable = self.writable_fields()
+        objs, errors = [], []
+        for index, row in enumerate(self.read_rows()):
+            try:
+                values = self.row_values(row, writable)
+                obj = self.model()
+                for field, value in values.items():
+                    setattr(obj, field.attname, value)
+                self.validate(obj, values)
+            except ValidationError as err:
+                self.add_error(errors, index, err)
+                continue
+            objs.append(obj)
+        self.check_errors(errors)
+
+        self.write(self.model._default_manager.bulk_create, objs,
+                   batch_size=self.batch_size)
+        return {'created': len(objs)}
+
+    def update_list(self, *args, **kwargs):
+        writable = self.writable_fields()
+        pk_name = self.pk_name()
+        changes, errors = [], []
+        for index, row in enumerate(self.read_rows()):
+            try:
+                if not isinstance(row, dict) or pk_name not in row:
+                    raise ValidationError(
+                        'Each row must be a JSON object with "{}".'.format(
+                            pk_name))
+                values = self.row_values(row, writable)
+                pk = self.model._meta.pk.to_python(row[pk_name])
+            except ValidationError as err:
+                self.add_error(errors, index, err)
+                continue
+            changes.append((index, pk, values))
+        self.check_errors(errors)
+
+        objs, fields = [], set()
+        queryset = self.get_queryset()
+        for start in range(0, len(changes), self.batch_size):
+            batch = changes[start:start + self.batch_size]
+            found = queryset.in_bulk([pk for index, pk, values in batch])
+            for index, pk, values in batch:
+                obj = found.get(pk)
+                try:
+                    if obj is None:
+                        raise ValidationError('Not found.')
+                    for field, value in values.items():
+                        setattr(obj, field.attname, value)
+                    self.validate(obj, values)
+                except ValidationError as err:
+                    self.add_error(errors, index, err)
+                    continue
+                objs.append(obj)
+                fields.update(f.name for f in values if not f.primary_key)
+        self.check_errors(errors)
+
+        if fields:
+            # bulk_update() sets no auto_now fields, as save() would.
+            for field in self.model._meta.concrete_fields:
+                if getattr(field, 'auto_now', False):
+                    fields.add(field.name)
+                    for obj in objs:
+                        field.pre_save(obj, False)
+            self.write(self.model._default_manager.bulk_update, objs,
+                       sorted(fields), batch_size=self.batch_size)
+        return {'updated': len(objs)}
+
+    def delete_list(self, *args, **kwargs):
+        pk_name = self.pk_name()
+        pk_field = self.model._meta.pk
+        pks, errors = [], []
+        for index, row in enumerate(self.read_rows()):
+            try:
+                pk = row.get(pk_name) if isinstance(row, dict) else row
+                if pk is None:
+                    raise ValidationError(
+                        'Each row must be a primary key or carry "{}".'.format(
+                            pk_name))
+                pks.append(pk_field.to_python(pk))
+            except ValidationError as err:
+                self.add_error(errors, index, err)
+        self.check_errors(errors)
+
+        queryset = self.get_queryset()
+        # delete() also counts the rows removed by cascades.
+        deleted = self.write(
+            lambda: queryset.filter(pk__in=pks).delete()[1].get(
+                self.model._meta.label, 0)) if pks else 0
+        return {'deleted': deleted}
@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class KernelConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'kernel'
+
+    def ready(self):
+        from .api import _cache_registry, connect_invalidation
+
+        # The Api classes defined before the models were ready.
+        for label in list(_cache_registry):
+            connect_invalidation(label)
@@ -0,0 +1,245 @@
+"""
+Timing harness for kernel.api.
+
+    python manage.py benchapi       (see kernel/management/commands)
+    python -m kernel.bench
+"""
+import os
+import timeit
+
+
+def setup():    # pragma: no cover
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webBase.settings')
+    import django
+    django.setup()
+
+
+def make_rows(count):
+    from accounts.models import User, UserProfile
+
+    rows = []
+    for n in range(count):
+        usr = User(pk=n, username='user{}'.format(n),
+                   email='user{}@example.com'.format(n))
+        rows.append(UserProfile(user=usr, company='Company {}'.format(n),
+                                location='Kansas'))
+    return rows
+
+
+FIELDS = {
+    'username': 'user.username',
+    'email': 'user.email',
+    'company': 'company',
+    'location': 'location',
+}
+
+
+class Nested(object):
+    """
+    An object graph for lookups several levels deep, mixing attributes,
+    dict keys and methods.
+    """
+
+    def __init__(self, depth):
+        self.name = 'level {}'.format(depth)
+        self.options = {'depth': depth, 'tags': ['a', 'b']}
+        self.child = Nested(depth - 1) if depth else None
+
+    def label(self):
+        return self.name.upper()
+
+
+NESTED_LOOKUPS = ['child.child.child.name', 'child.options.depth',
+                  'child.child.label', 'options.tags', 'child.child.child.child']
+
+
+def bench_extract(count=10000, repeat=5, lookups=NESTED_LOOKUPS):
+    """
+    Time ``Preparer.extract_data`` on nested lookups, ``count`` times each.
+    """
+    from .api import Preparer
+
+    prep = Preparer(None)
+    data = Nested(4)
+
+    def run():
+        for _ in range(count):
+            for lookup in lookups:
+                prep.extract_data(lookup, data)
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def bench_prepare(count=10000, repeat=5, fields=FIELDS):
+    from .api import Preparer
+
+    rows = make_rows(count)
+    prep = Preparer(fields)
+
+    def run():
+        for row in rows:
+            prep.prepare(row)
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def seed_profiles(count):
+    """
+    Fill the (test) database with ``count`` users, each with a profile.
+    """
+    from django.contrib.auth.hashers import make_password
+    from accounts.models import User, UserProfile
+
+    password = make_password(None)
+    User.objects.bulk_create(
+        User(username='user{}'.format(n), email='user{}@example.com'.format(n),
+             password=password)
+        for n in range(count))
+    UserProfile.objects.bulk_create(
+        UserProfile(user=usr, company='Company {}'.format(usr.pk))
+        for usr in User.objects.all())
+
+
+def bench_queryset(repeat=5, fields=FIELDS):
+    """
+    Time ``Preparer.prepare`` over the seeded profiles, through the
+    values_list() path and through per-object model instances.
+    """
+    from accounts.models import UserProfile
+    from .api import Preparer
+
+    prep = Preparer(fields)
+    qs = UserProfile.objects.all()
+    fast = min(timeit.repeat(lambda: prep.prepare(qs.all()),
+                             number=1, repeat=repeat))
+    slow = min(timeit.repeat(
+        lambda: [prep.prepare(obj) for obj in qs.select_related('user')],
+        number=1, repeat=repeat))
+    return fast, slow
+
+
+def user_payload(count):
+    """
+    A list response as a User/UserProfile Api would send it.
+    """
+    from django.utils import timezone
+
+    now = timezone.now()
+    rows = [{
+        'id': n, 'username': 'user{}'.format(n),
+        'email': 'user{}@example.com'.format(n),
+        'first_name': 'First', 'last_name': 'Last {}'.format(n),
+        'is_active': True, 'date_joined': now, 'last_login': None,
+        'gender': 4, 'location': 'Kansas', 'website': None,
+        'company': 'Company {}'.format(n),
+    } for n in range(count)]
+    return {'objects': rows, 'next': None}
+
+
+def bench_serializers(count=10000, repeat=5):
+    """
+    Time each registered serializer backend on the same payload.
+    """
+    from django.core.serializers.json import DjangoJSONEncoder
+    from .serializers import _registry, get_serializer
+
+    data = user_payload(count)
+    results = {}
+    for name in _registry:
+        dumps = get_serializer(name, DjangoJSONEncoder).dumps
+        results[name] = min(timeit.repeat(lambda: dumps(data),
+                                          number=1, repeat=repeat))
+    return results
+
+
+def bench_handle(count=2000, repeat=5):
+    """
+    Time ``ApiBase.handle`` end to end through RequestFactory, on a view
+    with nothing to do: the dispatch overhead of every call.
+    """
+    from django.test import RequestFactory
+    from .api import ApiBase
+
+    class PingApi(ApiBase):
+        def list(self):
+            return {'ok': True}
+
+    view = PingApi.as_list()
+    requests = [RequestFactory().get('/api/ping') for _ in range(count)]
+
+    def run():
+        for request in requests:
+            view(request)
+
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def bench_build_response(count=10000, repeat=5):
+    """
+    Time ``ApiBase.build_response`` encoding a prepared list.
+    """
+    from django.test import RequestFactory
+    from .api import ApiBase
+
+    api = ApiBase()
+    api.request = RequestFactory().get('/api/user')
+    data = user_payload(count)
+    return min(timeit.repeat(lambda: api.build_response(data),
+                             number=1, repeat=repeat))
+
+
+def run_suite(repeat=5, sizes=(10, 1000, 100000), database=True):
+    """
+    Runs every benchmark; returns ``{name: {"count": ..., "seconds": ...}}``
+    with the best time of ``repeat`` runs.  The queryset benchmarks need
+    a database to fill, so they are left out unless ``database``.
+    """
+    results = {}
+
+    def add(name, count, secs):
+        results[name] = {'count': count, 'seconds': secs}
+
+    add('extract_data nested', 10000 * len(NESTED_LOOKUPS),
+        bench_extract(10000, repeat))
+    for count in sizes:
+        add('prepare x{}'.format(count), count,
+            bench_prepare(count, repeat if count <= 10000 else 1))
+    add('handle dispatch', 2000, bench_handle(2000, repeat))
+    add('build_response x10000', 10000, bench_build_response(10000, repeat))
+    for name, secs in bench_serializers(10000, repeat).items():
+        add('serializer {} x10000'.format(name), 10000, secs)
+    if database:
+        count = 10000
+        seed_profiles(count)
+        fast, slow = bench_queryset(repeat)
+        add('prepare(queryset) values', count, fast)
+        add('prepare(queryset) objects', count, slow)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Returns ``[(name, seconds, baseline seconds, ratio, regressed)]`` for
+    the benchmarks in both; ``regressed`` when slower by more than the
+    ``threshold`` fraction.
+    """
+    rows = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]['seconds']
+        ratio = result['seconds'] / before if before else 1.0
+        rows.append((name, result['seconds'], before, ratio,
+                     ratio > 1 + threshold))
+    return rows
+
+
+def main():     # pragma: no cover
+    from django.core.management import call_command
+
+    setup()
+    call_command('benchapi')
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
@@ -0,0 +1,121 @@
+"""
+Storage for the responses to requests made with an ``Idempotency-Key``
+header (see ``ApiBase.idempotent``).
+
+A store keeps one record per key: the fingerprint of the request that
+claimed it, and once that request is answered, its response as
+``(content, status, headers)``.  Stores are registered by name; an Api
+class picks one with its ``idempotency_store`` attribute.
+"""
+import datetime
+
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+_registry = {}
+
+
+def register(name, store):
+    """
+    Make ``store`` -- an instance -- available as
+    ``idempotency_store = name``.
+    """
+    _registry[name] = store
+
+
+def get_store(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise ValueError('Unknown idempotency store: {}'.format(name))
+
+
+class CacheStore(object):
+    """
+    Keeps records in a cache; claims rely on ``cache.add()`` being atomic,
+    as it is with memcached, Redis or the database cache.  Not for the
+    local-memory cache (Django's default), which each process has its
+    own of: a retry sent to another process would run again.
+    """
+
+    def __init__(self, alias=DEFAULT_CACHE_ALIAS):
+        self.alias = alias
+
+    def cache_key(self, key):
+        return 'kernel.idempotency:{}'.format(key)
+
+    def claim(self, key, fingerprint, timeout):
+        """
+        Claims ``key`` for a request, for ``timeout`` seconds: returns None
+        if it's the first with the key, else the key's record, as a dict
+        of ``fingerprint`` and ``response`` (None while in flight).
+        """
+        cache = caches[self.alias]
+        record = {'fingerprint': fingerprint, 'response': None}
+        if cache.add(self.cache_key(key), record, timeout):
+            return None
+        # If the claim has just expired, this request waits a turn.
+        return cache.get(self.cache_key(key)) or record
+
+    def save(self, key, fingerprint, response, timeout):
+        record = {'fingerprint': fingerprint, 'response': response}
+        caches[self.alias].set(self.cache_key(key), record, timeout)
+
+    def release(self, key):
+        caches[self.alias].delete(self.cache_key(key))
+
+
+class DatabaseStore(object):
+    """
+    Keeps records in the ``IdempotencyRecord`` table, which survives cache
+    evictions and restarts.  Expired records are replaced when their key
+    comes back; ``purge()`` clears out the rest.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+
+    def records(self):
+        from .models import IdempotencyRecord
+        return IdempotencyRecord.objects.using(self.using)
+
+    def claim(self, key, fingerprint, timeout):
+        now = timezone.now()
+        records = self.records()
+        records.filter(key=key, expires__lte=now).delete()
+        try:
+            with transaction.atomic(using=records.db):
+                records.create(key=key, fingerprint=fingerprint,
+                               expires=now + datetime.timedelta(seconds=timeout))
+            return None
+        except IntegrityError:
+            pass
+        record = records.filter(key=key).first()
+        if record is None:
+            return {'fingerprint': fingerprint, 'response': None}
+        response = None
+        if record.status is not None:
+            response = (bytes(record.content), record.status,
+                        [tuple(header) for header in record.headers])
+        return {'fingerprint': record.fingerprint, 'response': response}
+
+    def save(self, key, fingerprint, response, timeout):
+        content, status, headers = response
+        expires = timezone.now() + datetime.timedelta(seconds=timeout)
+        self.records().filter(key=key).update(
+            fingerprint=fingerprint, status=status, content=content,
+            headers=headers, expires=expires)
+
+    def release(self, key):
+        self.records().filter(key=key).delete()
+
+    def purge(self):
+        """
+        Deletes the expired records; returns how many there were.
+        """
+        return self.records().filter(expires__lte=timezone.now()).delete()[0]
+
+
+register('cache', CacheStore())
+register('database', DatabaseStore())
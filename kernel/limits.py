@@ -0,0 +1,168 @@
+"""
+Caps on the requests a process works on at once, per group of routes.
+
+Groups are set in ``CONCURRENCY_LIMITS``:
+
+    CONCURRENCY_LIMITS = {
+        'api': {'paths': ['/api/'], 'limit': 16, 'retry_after': 1},
+        ...
+    }
+
+``ConcurrencyLimitMiddleware`` applies a group to requests under its
+``paths``; the ``concurrency_limit(group)`` decorator applies it to one
+view.  A request that finds its group full is answered at once with a 503
+and a ``Retry-After`` header rather than waiting for a thread, so slow
+routes can't take every worker and leave cheap ones queueing behind
+them.  Limits are per process.
+"""
+import asyncio
+from functools import wraps
+from threading import Lock
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+
+class ConcurrencyLimiter(object):
+    """
+    Counts the requests of one group in flight, turning away those over
+    ``limit``.
+    """
+
+    def __init__(self, name, limit, retry_after=1, paths=()):
+        self.name = name
+        self.limit = limit
+        self.retry_after = retry_after
+        self.paths = tuple(paths)
+        self.lock = Lock()
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.shed = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.in_flight >= self.limit:
+                self.shed += 1
+                return False
+            self.in_flight += 1
+            self.admitted += 1
+            self.peak = max(self.peak, self.in_flight)
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def reject(self):
+        response = HttpResponse('Too busy just now; please try again.',
+                                content_type='text/plain', status=503)
+        response['Retry-After'] = str(self.retry_after)
+        return response
+
+    def stats(self):
+        with self.lock:
+            return {'limit': self.limit, 'in_flight': self.in_flight,
+                    'peak': self.peak, 'admitted': self.admitted,
+                    'shed': self.shed}
+
+
+_limiters = None
+_limiters_lock = Lock()
+
+
+def get_limiters():
+    global _limiters
+    with _limiters_lock:
+        if _limiters is None:
+            _limiters = {
+                name: ConcurrencyLimiter(name, **options)
+                for name, options in getattr(
+                    settings, 'CONCURRENCY_LIMITS', {}).items()}
+        return _limiters
+
+
+def get_limiter(name):
+    try:
+        return get_limiters()[name]
+    except KeyError:
+        raise ImproperlyConfigured(
+            'No concurrency limit "{}" in CONCURRENCY_LIMITS.'.format(name))
+
+
+def concurrency_stats():
+    """
+    For each group, in this process: its limit, the requests in flight
+    now and at most, and how many were let in and turned away.
+    """
+    return {name: limiter.stats() for name, limiter in get_limiters().items()}
+
+
+@receiver(setting_changed)
+def reset_limiters(setting, **kwargs):
+    global _limiters
+    if setting == 'CONCURRENCY_LIMITS':
+        with _limiters_lock:
+            _limiters = None
+
+
+def limit_streaming(response, limiter):
+    """
+    Keeps a streaming response's slot until its body has been sent, or
+    the response is closed -- which the server does even when the body
+    is never read (a HEAD request, a client gone away).
+    """
+    chunks = response.streaming_content
+    once = Lock()
+
+    def release():
+        if once.acquire(blocking=False):
+            limiter.release()
+
+    def stream():
+        try:
+            yield from chunks
+        finally:
+            release()
+
+    response.streaming_content = stream()
+    response._resource_closers.append(release)
+    return response
+
+
+def concurrency_limit(group):
+    """
+    Decorator for views: caps the requests in flight for ``group``.
+    """
+    def decorator(view):
+        if asyncio.iscoroutinefunction(view):
+            @wraps(view)
+            async def _wrapped(request, *args, **kwargs):
+                limiter = get_limiter(group)
+                if not limiter.acquire():
+                    return limiter.reject()
+                try:
+                    return await view(request, *args, **kwargs)
+                finally:
+                    limiter.release()
+            return _wrapped
+
+        @wraps(view)
+        def _wrapped(request, *args, **kwargs):
+            limiter = get_limiter(group)
+            if not limiter.acquire():
+                return limiter.reject()
+            try:
+                response = view(request, *args, **kwargs)
+            except BaseException:
+                limiter.release()
+                raise
+            if response.streaming:
+                return limit_streaming(response, limiter)
+            limiter.release()
+            return response
+        return _wrapped
+    return decorator
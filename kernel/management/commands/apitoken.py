@@ -0,0 +1,49 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from kernel import tokens
+
+
+class Command(BaseCommand):
+    help = 'Mints an API token for a user, or revokes one.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['mint', 'revoke'])
+        parser.add_argument('value',
+                            help='a username to mint for, or a token to revoke')
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='seconds the new token is good for')
+        parser.add_argument('--key-version', type=int, default=None,
+                            help='the key to sign with (default: current)')
+
+    def handle(self, *args, **options):
+        if options['action'] == 'mint':
+            return self.mint(options['value'], options['max_age'],
+                             options['key_version'])
+        return self.revoke(options['value'])
+
+    def mint(self, username, max_age, version):
+        User = get_user_model()
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            raise CommandError('No user named {}.'.format(username))
+        if version is not None and version not in tokens.get_keys():
+            raise CommandError('No key with version {}.'.format(version))
+        return tokens.mint(user, max_age, version)
+
+    def revoke(self, token):
+        if not tokens.revocations.is_shared():
+            raise CommandError(
+                'API_TOKEN_CACHE is local to this process, so the servers '
+                'would never see the revocation; point it at a shared cache.')
+        try:
+            token = tokens.revocations.revoke(token)
+        except tokens.InvalidToken as err:
+            raise CommandError('Not a token: {}.'.format(err))
+        if token.expires < time.time():
+            return 'The token had expired already.'
+        return 'Revoked until {}.'.format(time.strftime(
+            '%Y-%m-%d %H:%M:%S UTC', time.gmtime(token.expires)))
@@ -0,0 +1,93 @@
+import json
+import platform
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from kernel import bench
+
+
+class Command(BaseCommand):
+    help = ('Times kernel.api (the Preparer, handle() and build_response) '
+            'and compares the results with a stored baseline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--baseline', default=getattr(
+                settings, 'BENCH_BASELINE',
+                Path(settings.BASE_DIR, 'bench_baseline.json')),
+            help='the baseline results file (default: %(default)s)')
+        parser.add_argument('--save-baseline', action='store_true',
+                            help='make these results the new baseline')
+        parser.add_argument('--output',
+                            help='also write the results, as JSON, here')
+        parser.add_argument(
+            '--threshold', type=float,
+            default=getattr(settings, 'BENCH_REGRESSION_THRESHOLD', 0.2),
+            help='fail when a benchmark is slower than the baseline by more '
+                 'than this fraction (default: %(default)s)')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='runs of each benchmark; the best counts')
+        parser.add_argument('--sizes', default='10,1000,100000',
+                            help='list sizes for Preparer.prepare')
+        parser.add_argument('--no-db', action='store_false', dest='database',
+                            help='skip the benchmarks that need a database')
+
+    def handle(self, *args, **options):
+        sizes = [int(size) for size in options['sizes'].split(',') if size]
+        if options['database']:
+            # The queryset benchmarks fill a throwaway test database.
+            name = connection.creation.create_test_db(verbosity=0)
+            try:
+                results = bench.run_suite(options['repeat'], sizes)
+            finally:
+                connection.creation.destroy_test_db(name, verbosity=0)
+        else:
+            results = bench.run_suite(options['repeat'], sizes,
+                                      database=False)
+
+        document = {
+            'meta': {
+                'timestamp': timezone.now().isoformat(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'machine': platform.machine(),
+            },
+            'results': results,
+        }
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(document, indent=2))
+
+        baseline_path = Path(options['baseline'])
+        if options['save_baseline']:
+            baseline_path.write_text(json.dumps(document, indent=2))
+            self.stdout.write('Saved the baseline in {}.'.format(baseline_path))
+        if not baseline_path.exists():
+            for name, result in results.items():
+                self.write_row(name, result['seconds'])
+            self.stdout.write('No baseline at {}; run with --save-baseline to '
+                              'make one.'.format(baseline_path))
+            return
+
+        baseline = json.loads(baseline_path.read_text())['results']
+        rows = bench.compare(results, baseline, options['threshold'])
+        for name, secs, before, ratio, regressed in rows:
+            self.write_row(name, secs, before, ratio, regressed)
+        regressions = [row[0] for row in rows if row[4]]
+        if regressions:
+            raise CommandError('{} benchmark(s) more than {:.0%} slower than '
+                               'the baseline: {}'.format(
+                                   len(regressions), options['threshold'],
+                                   ', '.join(regressions)))
+
+    def write_row(self, name, secs, before=None, ratio=None, regressed=False):
+        line = '{:<30} {:10.3f} ms'.format(name, secs * 1000)
+        if before is not None:
+            line += '  baseline {:10.3f} ms  {:+7.1%}'.format(before * 1000,
+                                                              ratio - 1)
+        style = self.style.ERROR if regressed else (lambda text: text)
+        self.stdout.write(style(line))
@@ -0,0 +1,274 @@
+import gzip
+import time
+import zlib
+from collections import Counter
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.utils.cache import patch_vary_headers
+from django.utils.regex_helper import _lazy_re_compile
+
+from .limits import get_limiters, limit_streaming
+
+try:
+    import brotli
+except ImportError:     # optional; gzip and deflate are always available
+    brotli = None
+
+
+_accept_encoding_re = _lazy_re_compile(
+    r'\s*([\w*-]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?\s*(?:,|$)')
+_strong_etag_re = _lazy_re_compile(r'^\s*"')
+
+
+def accepted_encodings(header):
+    """
+    The codings an Accept-Encoding header allows, with their q-values.
+    """
+    accepted = {}
+    for coding, q in _accept_encoding_re.findall(header or ''):
+        try:
+            accepted[coding.lower()] = float(q) if q else 1.0
+        except ValueError:
+            accepted[coding.lower()] = 0.0
+    return accepted
+
+
+class _Deflater:
+    """
+    An incremental compressor, used the same way for every encoding:
+    ``compress()`` each chunk, then ``flush()`` at the end.
+    """
+    def __init__(self, encoding, level):
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=min(level, 11))
+            self.compress = self.compressor.process
+            self.flush = self.compressor.finish
+            self.sync = self.compressor.flush
+            return
+        wbits = 16 + zlib.MAX_WBITS if encoding == 'gzip' else zlib.MAX_WBITS
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, wbits)
+        self.compress = self.compressor.compress
+        self.flush = self.compressor.flush
+
+    def sync(self):
+        return self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def compress(encoding, data, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    if encoding == 'gzip':
+        return gzip.compress(data, level, mtime=0)
+    return zlib.compress(data, level)
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses in the best encoding the client accepts: brotli
+    (when the ``brotli`` package is installed), gzip or deflate.
+
+    Bodies shorter than ``COMPRESSION_MIN_SIZE`` and content types not
+    listed in ``COMPRESSION_TYPES`` are sent as they are.  Streaming
+    responses are compressed chunk by chunk, each chunk flushed so the
+    client never waits on the compressor's buffer.
+
+    A response may carry a ``compressed`` dict of ready-made bodies by
+    encoding, and a ``store_compressed(encoding, body)`` callable to keep
+    a new one; ``ApiBase`` uses these so a cached response is compressed
+    once per encoding rather than once per request.
+
+    Each compressed response reports its ratio and compression CPU time
+    in a ``Server-Timing`` header; running totals are in ``stats()``.
+    """
+    _stats = Counter()
+    _stats_lock = Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 200)
+        self.level = getattr(settings, 'COMPRESSION_LEVEL', 6)
+        self.types = tuple(getattr(settings, 'COMPRESSION_TYPES', (
+            'text/', 'application/json', 'application/javascript',
+            'application/xml', 'image/svg+xml')))
+        encodings = getattr(settings, 'COMPRESSION_ENCODINGS',
+                            ('br', 'gzip', 'deflate'))
+        self.encodings = [coding for coding in encodings
+                          if coding != 'br' or brotli is not None]
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        return self.process_response(request, response)
+
+    def choose_encoding(self, request):
+        """
+        The server's most preferred encoding among those the client likes
+        best, or None to send the body as it is.
+        """
+        accepted = accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING'))
+        wildcard = accepted.get('*', 0.0)
+        best, best_q = None, 0.0
+        for coding in self.encodings:
+            q = accepted.get(coding, wildcard)
+            if q > best_q:
+                best, best_q = coding, q
+        return best
+
+    def process_response(self, request, response):
+        if response.has_header('Content-Encoding'):
+            return response
+        content_type = response.get('Content-Type', '')
+        if not content_type.startswith(self.types):
+            return response
+        if not response.streaming and len(response.content) < self.min_size:
+            return response
+
+        # Whatever happens, the body now depends on Accept-Encoding.
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = self.choose_encoding(request)
+        if encoding is None:
+            return response
+
+        if response.streaming:
+            response.streaming_content = self.compress_stream(
+                encoding, response.streaming_content)
+            del response['Content-Length']
+        else:
+            original = len(response.content)
+            body, cpu = self.compress_body(encoding, response)
+            if len(body) >= original:
+                return response
+            response.content = body
+            response['Content-Length'] = str(len(body))
+            self.record(encoding, original, len(body), cpu)
+            response['Server-Timing'] = (
+                'compress;dur={:.3f};desc="{} {:.1%}"'.format(
+                    cpu * 1000, encoding, len(body) / original))
+
+        # The compressed body isn't byte-for-byte what a strong ETag names.
+        etag = response.get('ETag')
+        if etag and _strong_etag_re.match(etag):
+            response['ETag'] = 'W/' + etag
+        response['Content-Encoding'] = encoding
+        return response
+
+    def compress_body(self, encoding, response):
+        """
+        The compressed body and the CPU seconds spent compressing it,
+        which are none when the response brought it along.
+        """
+        ready = getattr(response, 'compressed', None) or {}
+        if encoding in ready:
+            return ready[encoding], 0.0
+        started = time.thread_time()
+        body = compress(encoding, response.content, self.level)
+        cpu = time.thread_time() - started
+        store = getattr(response, 'store_compressed', None)
+        if store is not None:
+            store(encoding, body)
+        return body, cpu
+
+    def compress_stream(self, encoding, chunks):
+        deflater = _Deflater(encoding, self.level)
+        original = compressed = 0
+        cpu = 0.0
+        for chunk in chunks:
+            original += len(chunk)
+            started = time.thread_time()
+            data = deflater.compress(chunk) + deflater.sync()
+            cpu += time.thread_time() - started
+            compressed += len(data)
+            if data:
+                yield data
+        started = time.thread_time()
+        data = deflater.flush()
+        cpu += time.thread_time() - started
+        compressed += len(data)
+        self.record(encoding, original, compressed, cpu)
+        yield data
+
+    @classmethod
+    def record(cls, encoding, original, compressed, cpu):
+        with cls._stats_lock:
+            cls._stats[encoding, 'responses'] += 1
+            cls._stats[encoding, 'original'] += original
+            cls._stats[encoding, 'compressed'] += compressed
+            cls._stats[encoding, 'cpu'] += cpu
+
+    @classmethod
+    def stats(cls):
+        """
+        Per encoding: responses compressed, bytes before and after, the
+        overall ratio and CPU seconds spent, in this process.
+        """
+        with cls._stats_lock:
+            stats = {}
+            for (encoding, name), value in cls._stats.items():
+                stats.setdefault(encoding, {})[name] = value
+        for totals in stats.values():
+            totals['ratio'] = (totals['compressed'] / totals['original']
+                               if totals['original'] else 1.0)
+        return stats
+
+
+class SelectiveSessionMiddleware(SessionMiddleware):
+    """
+    SessionMiddleware, except for paths under ``SESSIONLESS_PATHS``: those
+    (meant for the Api classes, with token authentication) get an empty
+    session that is never loaded or saved, so they cost no session
+    queries.  Their ``request.user`` is anonymous until a token says
+    otherwise.
+    """
+
+    def __init__(self, get_response):
+        super().__init__(get_response)
+        self.sessionless = tuple(getattr(settings, 'SESSIONLESS_PATHS', ()))
+
+    def is_sessionless(self, request):
+        return bool(self.sessionless) and request.path_info.startswith(
+            self.sessionless)
+
+    def process_request(self, request):
+        if self.is_sessionless(request):
+            request.session = self.SessionStore(None)
+            return
+        super().process_request(request)
+
+    def process_response(self, request, response):
+        if self.is_sessionless(request):
+            return response
+        return super().process_response(request, response)
+
+
+class ConcurrencyLimitMiddleware:
+    """
+    Applies the ``CONCURRENCY_LIMITS`` groups to requests under their
+    ``paths`` (the first group that matches), shedding what's over the
+    limit with a 503; see kernel.limits.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        limiter = self.find_limiter(request.path_info)
+        if limiter is None:
+            return self.get_response(request)
+        if not limiter.acquire():
+            return limiter.reject()
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            limiter.release()
+            raise
+        if response.streaming:
+            return limit_streaming(response, limiter)
+        limiter.release()
+        return response
+
+    def find_limiter(self, path):
+        for limiter in get_limiters().values():
+            if limiter.paths and path.startswith(limiter.paths):
+                return limiter
+        return None
@@ -0,0 +1,39 @@
+from django.db import models
+
+
+class IdempotencyRecord(models.Model):
+    """
+    A request made with an Idempotency-Key, and once it is answered, its
+    response (see kernel.idempotency).
+    """
+    key = models.CharField(max_length=64, primary_key=True)
+    fingerprint = models.CharField(max_length=64)
+    status = models.PositiveSmallIntegerField(null=True)   # null: in flight
+    content = models.BinaryField(default=b'')
+    headers = models.JSONField(default=list)
+    expires = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return 'Idempotency record {}'.format(self.key)
+
+
+class Tombstone(models.Model):
+    """
+    Marks a deleted row, so that clients syncing changes hear about it.
+    Connect ``Tombstone.record`` to ``post_delete`` for the models that
+    need them.
+    """
+    model = models.CharField(max_length=100)    # "app_label.modelname"
+    object_pk = models.CharField(max_length=64)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['model', 'deleted_at'])]
+
+    def __str__(self):
+        return 'Tombstone for {} {}'.format(self.model, self.object_pk)
+
+    @classmethod
+    def record(cls, sender, instance, using=None, **kwargs):
+        cls.objects.using(using).create(model=sender._meta.label_lower,
+                                        object_pk=str(instance.pk))
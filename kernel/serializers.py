@@ -0,0 +1,318 @@
+"""
+Serializer backends for the Api classes in kernel.api.
+
+A backend turns the data an Api hands back into the bytes of the response
+body.  Backends are registered by name; an Api class picks one with its
+``serializer_backend`` attribute, while its ``serializer`` (a JSONEncoder
+subclass) still decides how values JSON cannot express are converted.
+Besides ``dumps()``, a backend has ``loads()`` for request bodies in its
+format, and says whether its output is JSON text (``streaming``), which
+the Api classes can write and read incrementally.
+"""
+import datetime
+import decimal
+import json
+import struct
+import uuid
+
+from django.utils.duration import duration_iso_string
+from django.utils.functional import Promise
+from django.utils.timezone import is_aware
+
+_registry = {}
+_instances = {}
+
+
+def register(name, backend):
+    """
+    Make ``backend`` -- a class taking the Api's encoder class -- available
+    as ``serializer_backend = name``.
+    """
+    _registry[name] = backend
+    for key in [key for key in _instances if key[0] == name]:
+        del _instances[key]
+
+
+def get_serializer(name, encoder):
+    """
+    Returns the (shared) backend instance for ``name`` and ``encoder``.
+    """
+    key = (name, encoder)
+    backend = _instances.get(key)
+    if backend is None:
+        try:
+            backend = _instances[key] = _registry[name](encoder)
+        except KeyError:
+            raise ValueError('Unknown serializer backend: {}'.format(name))
+    return backend
+
+
+class JSONSerializer(object):
+    """
+    The json module, with the encoder's ``default()`` for anything else.
+    """
+    content_type = 'application/json'
+    streaming = True
+
+    def __init__(self, encoder):
+        self.encoder = encoder
+
+    def dumps(self, data):
+        return json.dumps(data, cls=self.encoder).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+
+def _datetime(value):
+    # as DjangoJSONEncoder does it
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:23] + text[26:]
+    if text.endswith('+00:00'):
+        text = text[:-6] + 'Z'
+    return text
+
+
+def _time(value):
+    if is_aware(value):
+        raise ValueError("JSON can't represent timezone-aware times.")
+    text = value.isoformat()
+    if value.microsecond:
+        text = text[:12]
+    return text
+
+
+class FastJSONSerializer(object):
+    """
+    Writes the same JSON text as JSONSerializer with a DjangoJSONEncoder,
+    but cheaper:
+
+    - values JSON has no type for (datetimes, Decimals, UUIDs...) are
+      converted by a function looked up on their exact type, in one dict
+      access, instead of falling through a chain of isinstance() checks;
+      subclasses are matched on their MRO once, then cached.
+    - there is no circular reference check: prepared data is a tree.
+    - everything else -- strings, numbers, keys, nesting -- is left to the
+      json module's C encoder, writing the document into a single buffer.
+
+    Encoding repeated keys and rows in Python was tried too, and lost to
+    the C encoder on every realistic payload.  Values with no entry in the
+    table still go to the encoder's ``default()``.
+    """
+    content_type = 'application/json'
+    streaming = True
+
+    def __init__(self, encoder):
+        self.fallback = encoder().default
+        self.convert = {
+            datetime.datetime: _datetime,
+            datetime.date: datetime.date.isoformat,
+            datetime.time: _time,
+            datetime.timedelta: duration_iso_string,
+            decimal.Decimal: str,
+            uuid.UUID: str,
+        }
+        self.encode = json.JSONEncoder(default=self.default,
+                                       check_circular=False).encode
+
+    def dumps(self, data):
+        return self.encode(data).encode()
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def default(self, value):
+        convert = self.convert.get(type(value))
+        if convert is None:
+            convert = self.find_converter(value)
+        return convert(value)
+
+    def find_converter(self, value):
+        """
+        Finds the converter for a type without an entry of its own -- that
+        of its nearest base class, or else the encoder's ``default()``.
+        """
+        cls = type(value)
+        for base in cls.__mro__[1:]:
+            if base in self.convert:
+                convert = self.convert[cls] = self.convert[base]
+                return convert
+        if isinstance(value, Promise):
+            return str
+        return self.fallback
+
+
+_pack_int = {code: struct.Struct(fmt).pack for code, fmt in (
+    (0xcc, '>BB'), (0xcd, '>BH'), (0xce, '>BI'), (0xcf, '>BQ'),
+    (0xd0, '>Bb'), (0xd1, '>Bh'), (0xd2, '>Bi'), (0xd3, '>Bq'))}
+_pack_float = struct.Struct('>Bd').pack
+_pack_size = {1: struct.Struct('>BB').pack, 2: struct.Struct('>BH').pack,
+              4: struct.Struct('>BI').pack}
+
+
+def _pack_header(out, size, fix, fix_limit, codes):
+    """
+    Writes the header of a string, binary, array or map of ``size`` items:
+    one byte when under ``fix_limit``, else one of the 8, 16 or 32 bit
+    ``codes``.
+    """
+    if size < fix_limit:
+        out.append(fix | size)
+    elif size < 0x100 and codes[0]:
+        out += _pack_size[1](codes[0], size)
+    elif size < 0x10000:
+        out += _pack_size[2](codes[1], size)
+    elif size < 0x100000000:
+        out += _pack_size[4](codes[2], size)
+    else:
+        raise ValueError('Too large for MessagePack: {} items.'.format(size))
+
+
+class MessagePackSerializer(FastJSONSerializer):
+    """
+    MessagePack (https://msgpack.org), a binary format with the same data
+    model as JSON that is smaller and much cheaper to parse.
+
+    Values MessagePack has no type for are converted just as the JSON
+    backends convert them -- datetimes to ISO 8601 strings, and so on --
+    so clients see the same data whichever format they ask for.  Integers
+    beyond 64 bits, which JSON could carry, are refused.
+    """
+    content_type = 'application/msgpack'
+    streaming = False
+
+    def dumps(self, data):
+        out = bytearray()
+        self.pack(data, out)
+        return bytes(out)
+
+    def pack(self, value, out):
+        cls = type(value)
+        if cls is str:
+            data = value.encode()
+            _pack_header(out, len(data), 0xa0, 32, (0xd9, 0xda, 0xdb))
+            out += data
+        elif cls is int:
+            self.pack_int(value, out)
+        elif value is None:
+            out.append(0xc0)
+        elif cls is bool:
+            out.append(0xc3 if value else 0xc2)
+        elif cls is float:
+            out += _pack_float(0xcb, value)
+        elif cls is dict:
+            _pack_header(out, len(value), 0x80, 16, (0, 0xde, 0xdf))
+            for key, item in value.items():
+                self.pack(key, out)
+                self.pack(item, out)
+        elif cls is list or cls is tuple:
+            _pack_header(out, len(value), 0x90, 16, (0, 0xdc, 0xdd))
+            for item in value:
+                self.pack(item, out)
+        elif cls is bytes or cls is bytearray:
+            _pack_header(out, len(value), 0, 0, (0xc4, 0xc5, 0xc6))
+            out += value
+        else:
+            # subclasses of the types above, or something to convert
+            if isinstance(value, str):
+                return self.pack(str.__str__(value), out)
+            for base in (int, float, dict, list, tuple, bytes):
+                if isinstance(value, base):
+                    return self.pack(base(value), out)
+            self.pack(self.default(value), out)
+
+    def pack_int(self, value, out):
+        if 0 <= value < 0x80:
+            out.append(value)
+        elif -32 <= value < 0:
+            out.append(value & 0xff)
+        elif value >= 0:
+            for code, limit in ((0xcc, 8), (0xcd, 16), (0xce, 32), (0xcf, 64)):
+                if value >> limit == 0:
+                    out += _pack_int[code](code, value)
+                    return
+            raise ValueError('Integer too large for MessagePack.')
+        else:
+            for code, bits in ((0xd0, 7), (0xd1, 15), (0xd2, 31), (0xd3, 63)):
+                if value >= -(1 << bits):
+                    out += _pack_int[code](code, value)
+                    return
+            raise ValueError('Integer too large for MessagePack.')
+
+    def loads(self, data):
+        data = bytes(data)
+        try:
+            value, end = _unpack(data, 0)
+        except (IndexError, struct.error):
+            raise ValueError('Truncated MessagePack data.')
+        except (TypeError, RecursionError):
+            raise ValueError('Invalid MessagePack data.')
+        if end != len(data):
+            raise ValueError('Extra data after the MessagePack value.')
+        return value
+
+
+# MessagePack type codes with a fixed-size payload: (struct, size).
+_fixed = {code: (struct.Struct(fmt), struct.calcsize(fmt)) for code, fmt in (
+    (0xca, '>f'), (0xcb, '>d'),
+    (0xcc, '>B'), (0xcd, '>H'), (0xce, '>I'), (0xcf, '>Q'),
+    (0xd0, '>b'), (0xd1, '>h'), (0xd2, '>i'), (0xd3, '>q'))}
+# Codes followed by a length: (kind, struct of the length, its size).
+_sized = {code: (kind, struct.Struct(fmt), struct.calcsize(fmt))
+          for code, kind, fmt in (
+    (0xc4, bytes, '>B'), (0xc5, bytes, '>H'), (0xc6, bytes, '>I'),
+    (0xd9, str, '>B'), (0xda, str, '>H'), (0xdb, str, '>I'),
+    (0xdc, list, '>H'), (0xdd, list, '>I'),
+    (0xde, dict, '>H'), (0xdf, dict, '>I'))}
+_constants = {0xc0: None, 0xc2: False, 0xc3: True}
+
+
+def _unpack(data, pos):
+    """
+    Reads the value starting at ``data[pos]``; returns it and the position
+    just after it.
+    """
+    code = data[pos]
+    pos += 1
+    if code < 0x80:
+        return code, pos
+    if code >= 0xe0:
+        return code - 0x100, pos
+    if code < 0xc0:
+        kind, size = (dict, code & 0x0f) if code < 0x90 else (
+            (list, code & 0x0f) if code < 0xa0 else (str, code & 0x1f))
+    elif code in _constants:
+        return _constants[code], pos
+    elif code in _fixed:
+        fmt, size = _fixed[code]
+        return fmt.unpack_from(data, pos)[0], pos + size
+    elif code in _sized:
+        kind, fmt, length = _sized[code]
+        size = fmt.unpack_from(data, pos)[0]
+        pos += length
+    else:
+        raise ValueError('Unsupported MessagePack type 0x{:02x}.'.format(code))
+
+    if kind is list:
+        items = []
+        for _ in range(size):
+            item, pos = _unpack(data, pos)
+            items.append(item)
+        return items, pos
+    if kind is dict:
+        items = {}
+        for _ in range(size):
+            key, pos = _unpack(data, pos)
+            items[key], pos = _unpack(data, pos)
+        return items, pos
+    end = pos + size
+    if end > len(data):
+        raise IndexError(end)
+    chunk = data[pos:end]
+    return (chunk.decode() if kind is str else chunk), end
+
+
+register('json', JSONSerializer)
+register('fast', FastJSONSerializer)
+register('msgpack', MessagePackSerializer)
@@ -1,12 +1,30 @@
+import asyncio
 import json
-from datetime import date
+import threading
+import time
+from datetime import date, timedelta
+from io import BytesIO
+from unittest import mock
+from urllib.parse import urlsplit
 
-from django.http import JsonResponse
-from django.test import RequestFactory, TestCase
-from django.urls import path
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models.deletion import Collector
+from django.db.models.signals import post_delete
+from django.http import JsonResponse, StreamingHttpResponse
+from django.test import (AsyncRequestFactory, RequestFactory, TestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
-from accounts.models import User
-from ..api import Preparer, ApiError, ApiBase
+from accounts.models import User, UserProfile
+from ..api import (Preparer, ApiError, ApiBase, AsyncApiBase, BatchApi,
+                   ModelApi, iter_json_array)
+from ..models import IdempotencyRecord
+from ..serializers import get_serializer
 
 
 class TestPreparer(TestCase):
@@ -60,6 +78,86 @@ class TestPreparer(TestCase):
         rc = prep.extract_data('child.result.__class__', to)
         self.assertIsInstance(rc, object, "should handle multiple dot-levels")
 
+    def test_compiled_accessors(self):
+        usr = User(username='dorothy', email='dot@kansas.gov')
+        prep = Preparer({'name': 'username', 'mail': 'email'})
+        prep.prepare(usr)
+        plan = prep._plans[User]
+        rc = prep.prepare(User(username='glinda', email='good@north.gov'))
+        self.assertIs(prep._plans[User], plan, "should reuse compiled plan")
+        self.assertDictEqual(rc, {'name': 'glinda', 'mail': 'good@north.gov'})
+
+        rc = prep.prepare({'username': 'toto'}, {'name': 'username'})
+        self.assertDictEqual(rc, {'name': 'toto'},
+                             "should compile separately per source type")
+        self.assertIn(('username', dict), prep._accessors)
+
+        rc = prep.extract_data('username.upper', usr)
+        self.assertEqual(rc, 'DOROTHY', "should call methods mid-path")
+        rc = prep.extract_data('username..upper', usr)
+        self.assertEqual(rc, 'dorothy', "should stop at an empty chunk")
+
+
+class TestPreparerQuerySet(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('dorothy', 'glinda', 'evillene'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov',
+                                           password='rubySlippers')
+            UserProfile(user=usr, company='{} & Co.'.format(name)).save()
+
+    def test_values_path(self):
+        prep = Preparer({'name': 'user.username', 'company': 'company',
+                         'id': 'user_id', 'again': 'company'})
+        qs = UserProfile.objects.order_by('user__username')
+        expected = [prep.prepare(obj) for obj in qs]
+        with self.assertNumQueries(1):
+            rc = prep.prepare(qs)
+        self.assertListEqual(rc, expected)
+        self.assertEqual(rc[0]['name'], 'dorothy')
+        self.assertIsNotNone(prep._columns[UserProfile])
+
+    def test_fallback_path(self):
+        prep = Preparer({'name': 'get_username', 'mail': 'email'})
+        rc = prep.prepare(User.objects.order_by('username'))
+        self.assertEqual(rc[0], {'name': 'dorothy', 'mail': 'dorothy@oz.gov'})
+        self.assertIsNone(prep._columns[User], "should need per-object path")
+
+        for lookup in ('userprofile.company', 'groups', 'userprofile',
+                       'username.upper', 'nothing'):
+            rc = prep.columns(User, {'x': lookup})
+            self.assertIsNone(rc, "{} is not a column".format(lookup))
+
+        rc = prep.prepare(User.objects.values('username'), {'x': 'username'})
+        self.assertEqual(len(rc), 3, "should handle values() querysets")
+
+    def test_optimize(self):
+        prep = Preparer({'name': 'get_username',
+                         'company': 'userprofile.company',
+                         'groups': 'groups.all'})
+        select, prefetch, only = prep.loads(User)
+        self.assertEqual(select, ('userprofile',))
+        self.assertEqual(prefetch, ('groups',))
+        self.assertIsNone(only, "a method may need any column")
+
+        with self.assertNumQueries(2):
+            rc = prep.prepare(User.objects.order_by('username'))
+        self.assertEqual(rc[0]['company'], 'dorothy & Co.')
+
+        prep = Preparer({'name': 'username', 'company': 'userprofile.company'})
+        with CaptureQueriesContext(connection) as ctx:
+            rc = prep.prepare(User.objects.all())
+        self.assertEqual(len(ctx.captured_queries), 1,
+                         "query count should not depend on row count")
+        self.assertNotIn('about_me', ctx.captured_queries[0]['sql'])
+        self.assertNotIn('password', ctx.captured_queries[0]['sql'])
+
+        qs = prep.optimize(User.objects.select_related('userprofile'))
+        self.assertEqual(qs.query.deferred_loading, (frozenset(), True),
+                         "should leave the caller's select_related alone")
+
 
 class TestApiError(TestCase):
 
@@ -115,3 +213,651 @@ class TestApiBase(TestCase):
         d = json.loads(resp.content)
         self.assertIn('error', d, "should contain error message")
         self.assertEquals(d['error'], 'The "list" method is not implemented.')
+
+
+class UserApi(ApiBase):
+    preparer = Preparer({'name': 'username',
+                         'company': 'userprofile.company'})
+
+    def list(self):
+        return User.objects.order_by('username')
+
+
+class VersionedUserApi(UserApi):
+
+    def get_etag(self, endpoint, *args, **kwargs):
+        return User.objects.count()
+
+    def get_last_modified(self, endpoint, *args, **kwargs):
+        return User.objects.latest('date_joined').date_joined
+
+
+class CachedUserApi(UserApi):
+    cache_timeout = 60
+    cache_models = ['accounts.User', UserProfile]
+
+
+class TestApiList(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('dorothy', 'glinda', 'evillene'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov',
+                                           password='rubySlippers')
+            UserProfile(user=usr, company='{} & Co.'.format(name)).save()
+
+    def test_list(self):
+        rf = RequestFactory()
+        resp = UserApi.as_list()(rf.get('user'))
+        self.assertIsInstance(resp, JsonResponse, "should return JsonResponse")
+        d = json.loads(resp.content)
+        self.assertEqual(len(d['objects']), 3)
+        self.assertDictEqual(d['objects'][0],
+                             {'name': 'dorothy', 'company': 'dorothy & Co.'})
+
+    def test_streaming(self):
+        rf = RequestFactory()
+        expected = json.loads(UserApi.as_list()(rf.get('user')).content)
+
+        UserApi.streaming, UserApi.chunk_size = True, 2
+        try:
+            resp = UserApi.as_list()(rf.get('user'))
+            self.assertIsInstance(resp, StreamingHttpResponse)
+            self.assertEqual(resp['Content-Type'], 'application/json')
+            with self.assertNumQueries(1):
+                chunks = list(resp.streaming_content)
+        finally:
+            UserApi.streaming, UserApi.chunk_size = False, 2000
+        self.assertEqual(len(chunks), 4, "should send rows in chunks")
+        self.assertDictEqual(json.loads(b''.join(chunks)), expected)
+
+        preparer = Preparer({'name': 'get_username', 'groups': 'groups.all'})
+        rows = preparer.iterate(User.objects.all(), chunk_size=2)
+        with self.assertNumQueries(3):  # one select, a prefetch per chunk
+            self.assertEqual(len(list(rows)), 3)
+
+        # MySQL's driver would buffer the whole result: page by keyset.
+        with mock.patch.object(connection, 'vendor', 'mysql'):
+            rows = Preparer({'name': 'get_username'}).iterate(
+                User.objects.order_by('-username'), chunk_size=2)
+            with self.assertNumQueries(4):  # keys and rows for each page
+                self.assertListEqual([row['name'] for row in rows],
+                                     ['glinda', 'evillene', 'dorothy'])
+
+    def test_pagination(self):
+        for name in ('scarecrow', 'tinman', 'lion'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov')
+            UserProfile(user=usr).save()
+
+        rf = RequestFactory()
+        func = UserApi.as_list()
+        names, url, pages = [], '/api/user?limit=2', 0
+        while url:
+            with self.assertNumQueries(2):
+                d = json.loads(func(rf.get(url)).content)
+            self.assertLessEqual(len(d['objects']), 2)
+            names.extend(row['name'] for row in d['objects'])
+            url, pages = d['next'], pages + 1
+        self.assertEqual(pages, 3)
+        self.assertListEqual(names, sorted(names))
+        self.assertEqual(len(names), User.objects.count())
+
+        d = json.loads(func(rf.get('/api/user', {'limit': 5000})).content)
+        self.assertEqual(len(d['objects']), 6, "should cap the limit")
+        self.assertIsNone(d['next'])
+
+        for params in ({'cursor': 'forged'}, {'limit': 'all'}, {'limit': 0}):
+            d = json.loads(func(rf.get('/api/user', params)).content)
+            self.assertIn('error', d, "should reject {}".format(params))
+
+        UserApi.page_size = 4
+        try:
+            d = json.loads(func(rf.get('/api/user')).content)
+        finally:
+            UserApi.page_size = None
+        self.assertEqual(len(d['objects']), 4, "should paginate by default")
+
+    def test_keyset_ordering(self):
+        rf = RequestFactory()
+        api = UserApi()
+        api.request = rf.get('/api/user', {'limit': 1})
+        qs = User.objects.order_by('-date_joined', 'username')
+        first = api.paginate(qs)
+        api.request = rf.get(first['next'])
+        second = api.paginate(qs)
+        self.assertNotEqual(first['objects'], second['objects'])
+        self.assertEqual(second['objects'][0]['name'], 'glinda')
+
+        api.request = rf.get(first['next'])
+        with self.assertRaisesMessage(ApiError, 'Invalid cursor.'):
+            api.paginate(qs.order_by('username'))
+        with self.assertRaisesMessage(ApiError, 'cannot be paginated'):
+            api.paginate(qs.order_by('?'))
+
+    def test_keyset_microseconds(self):
+        start = timezone.now().replace(microsecond=0)
+        for n in range(6):
+            usr = User.objects.create_user(
+                username='munchkin{}'.format(n),
+                email='munchkin{}@oz.gov'.format(n),
+                date_joined=start + timedelta(microseconds=100 * n))
+            UserProfile(user=usr).save()
+        munchkins = User.objects.filter(username__startswith='munchkin')
+        rf = RequestFactory()
+        api = UserApi()
+        for ordering in ('date_joined', '-date_joined'):
+            qs = munchkins.order_by(ordering)
+            names, url = [], '/api/user?limit=2'
+            while url and len(names) < 10:
+                api.request = rf.get(url)
+                page = api.paginate(qs)
+                names.extend(row['name'] for row in page['objects'])
+                url = page['next']
+            self.assertEqual(names, [u.username for u in qs],
+                             "should page through keys under a millisecond "
+                             "apart ({})".format(ordering))
+
+    def test_conditional_get(self):
+        rf = RequestFactory()
+        func = VersionedUserApi.as_list()
+        resp = func(rf.get('/api/user'))
+        self.assertEqual(resp.status_code, 200)
+        etag, modified = resp['ETag'], resp['Last-Modified']
+
+        with mock.patch.object(VersionedUserApi, 'list') as view:
+            resp = func(rf.get('/api/user', HTTP_IF_NONE_MATCH=etag))
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp['ETag'], etag)
+            self.assertIn('Accept', resp['Vary'])
+            resp = func(rf.get('/api/user', HTTP_IF_MODIFIED_SINCE=modified))
+            self.assertEqual(resp.status_code, 304)
+            view.assert_not_called()
+
+        resp = func(rf.get('/api/user', HTTP_IF_NONE_MATCH=etag,
+                           HTTP_ACCEPT='application/msgpack'))
+        self.assertEqual(resp.status_code, 200,
+                         "should tag each format separately")
+
+        resp = func(rf.get('/api/user', {'limit': 1},
+                           HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(resp.status_code, 200,
+                         "should tag each query string separately")
+
+        usr = User.objects.create_user(username='toto', email='toto@oz.gov')
+        UserProfile(user=usr).save()
+        resp = func(rf.get('/api/user', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(resp.status_code, 200, "should see the change")
+        self.assertNotEqual(resp['ETag'], etag)
+
+    def test_head(self):
+        rf = RequestFactory()
+        with mock.patch.object(Preparer, 'prepare') as prepare:
+            with self.assertNumQueries(0):
+                resp = UserApi.as_list()(rf.head('/api/user'))
+            prepare.assert_not_called()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content, b'')
+        self.assertEqual(resp['Content-Type'], 'application/json')
+
+        resp = VersionedUserApi.as_list()(rf.head('/api/user'))
+        self.assertIn('ETag', resp)
+
+    def test_cache(self):
+        rf = RequestFactory()
+        func = CachedUserApi.as_list()
+        CachedUserApi.invalidate_cache()
+        before = CachedUserApi.cache_stats()
+
+        first = func(rf.get('/api/user'))
+        with mock.patch.object(CachedUserApi, 'list') as view:
+            with mock.patch.object(CachedUserApi, 'build_response') as build:
+                second = func(rf.get('/api/user'))
+            view.assert_not_called()
+            build.assert_not_called()
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Vary'], first['Vary'])
+        third = func(rf.get('/api/user', {'limit': 1}))
+        self.assertNotEqual(third.content, first.content)
+
+        profile = UserProfile.objects.get(user__username='glinda')
+        profile.company = 'Bubble Transport'
+        profile.save()
+        d = json.loads(func(rf.get('/api/user')).content)
+        self.assertIn('Bubble Transport',
+                      [row['company'] for row in d['objects']],
+                      "saving a profile should invalidate the cache")
+        profile.user.delete()
+        d = json.loads(func(rf.get('/api/user')).content)
+        self.assertEqual(len(d['objects']), 2, "so should deleting a user")
+
+        stats = CachedUserApi.cache_stats()
+        self.assertEqual(stats['hits'] - before['hits'], 1)
+        self.assertEqual(stats['misses'] - before['misses'], 4)
+        self.assertGreaterEqual(
+            stats['invalidations'] - before['invalidations'], 3)
+        self.assertEqual(UserApi.cache_stats()['hits'], 0)
+
+        # Only the models depended on get the receiver: others can still be
+        # deleted without fetching them first.
+        self.assertTrue(post_delete.has_listeners(User))
+        self.assertTrue(Collector(using='default').can_fast_delete(
+            IdempotencyRecord.objects.all()))
+
+
+class AsyncUserApi(AsyncApiBase):
+    preparer = UserApi.preparer
+
+    async def list(self):
+        return User.objects.order_by('username')
+
+    def detail(self, pk):
+        return self.preparer.prepare(User.objects.get(pk=pk))
+
+
+class TestAsyncApiBase(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('dorothy', 'glinda'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov')
+            UserProfile(user=usr, company='{} & Co.'.format(name)).save()
+        cls.pk = usr.pk
+
+    async def test_handler(self):
+        arf = AsyncRequestFactory()
+        func = AsyncUserApi.as_list()
+        self.assertTrue(asyncio.iscoroutinefunction(func))
+        self.assertTrue(func.csrf_exempt)
+
+        resp = await func(arf.get('/api/user'))
+        self.assertIsInstance(resp, JsonResponse, "should return JsonResponse")
+        d = json.loads(resp.content)
+        self.assertEqual([row['name'] for row in d['objects']],
+                         ['dorothy', 'glinda'])
+
+        d = json.loads((await func(arf.get('/api/user?limit=1'))).content)
+        self.assertEqual(len(d['objects']), 1, "should paginate")
+        self.assertIsNotNone(d['next'])
+
+        d = json.loads((await func(arf.post('/api/user', {}))).content)
+        self.assertEqual(d['error'], "Unauthorized")
+
+        resp = await AsyncUserApi.as_detail()(arf.get('/api/user/1'),
+                                              pk=self.pk)
+        self.assertIn('name', json.loads(resp.content),
+                      "should run plain methods in a thread")
+
+
+class SlowApi(ApiBase):
+    coalesce = True
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def list(self):
+        self.calls.append(self.request.GET.get('n'))
+        if len(self.calls) == 1:
+            self.started.set()
+            self.release.wait(5)
+        return {'calls': len(self.calls)}
+
+
+class AsyncSlowApi(AsyncApiBase):
+    coalesce = True
+    calls = 0
+
+    async def list(self):
+        AsyncSlowApi.calls += 1
+        await asyncio.sleep(0.05)
+        return {'calls': AsyncSlowApi.calls}
+
+
+class TestSingleFlight(TestCase):
+
+    def setUp(self):
+        SlowApi.calls = []
+        SlowApi.started.clear()
+        SlowApi.release.clear()
+
+    def get(self, results, path='/api/slow'):
+        results.append(SlowApi.as_list()(RequestFactory().get(path)))
+
+    def run_followers(self, count, path='/api/slow'):
+        results = []
+        leader = threading.Thread(target=self.get, args=(results,))
+        leader.start()
+        SlowApi.started.wait(5)
+        followers = [threading.Thread(target=self.get, args=(results, path))
+                     for _ in range(count)]
+        for thread in followers:
+            thread.start()
+        return results, leader, followers
+
+    def test_coalesced(self):
+        before = SlowApi.coalesce_stats()
+        results, leader, followers = self.run_followers(3)
+        time.sleep(0.1)     # let the followers get in line
+        SlowApi.release.set()
+        for thread in [leader] + followers:
+            thread.join()
+
+        self.assertEqual(len(SlowApi.calls), 1, "should run the view once")
+        self.assertEqual([json.loads(r.content) for r in results],
+                         [{'calls': 1}] * 4)
+        self.assertEqual(len({id(r) for r in results}), 4,
+                         "should send each request a response of its own")
+        after = SlowApi.coalesce_stats()
+        self.assertEqual(after['coalesced'] - before['coalesced'], 3)
+        self.assertEqual(after['leaders'] - before['leaders'], 1)
+
+    def test_timeout_and_keys(self):
+        before = SlowApi.coalesce_stats()
+        with mock.patch.object(SlowApi, 'coalesce_timeout', 0.05):
+            results, leader, followers = self.run_followers(2)
+            for thread in followers:
+                thread.join()
+        SlowApi.release.set()
+        leader.join()
+        self.assertEqual(len(SlowApi.calls), 3,
+                         "followers should answer for themselves")
+        self.assertEqual(SlowApi.coalesce_stats()['timeouts'] -
+                         before['timeouts'], 2)
+
+        SlowApi.calls = []
+        SlowApi.release.clear()
+        SlowApi.started.clear()
+        results, leader, followers = self.run_followers(1, '/api/slow?n=2')
+        followers[0].join()
+        SlowApi.release.set()
+        leader.join()
+        self.assertEqual(SlowApi.calls, [None, '2'],
+                         "should not share between different queries")
+
+    async def test_async(self):
+        AsyncSlowApi.calls = 0
+        func = AsyncSlowApi.as_list()
+        arf = AsyncRequestFactory()
+        results = await asyncio.gather(
+            *[func(arf.get('/api/slow')) for _ in range(5)])
+        self.assertEqual(AsyncSlowApi.calls, 1)
+        self.assertEqual([json.loads(r.content) for r in results],
+                         [{'calls': 1}] * 5)
+        self.assertEqual(AsyncSlowApi.coalesce_stats()['coalesced'], 4)
+
+        # A user only loaded from the session when first asked about.
+        usr = await sync_to_async(User.objects.create_user)('dorothy')
+        requests = [arf.get('/api/slow') for _ in range(2)]
+        for request in requests:
+            request.user = SimpleLazyObject(
+                lambda: User.objects.get(pk=usr.pk))
+        results = await asyncio.gather(*[func(r) for r in requests])
+        self.assertEqual([json.loads(r.content) for r in results],
+                         [{'calls': 2}] * 2)
+
+
+class EchoApi(ApiBase):
+
+    def list(self):
+        return {'thread': threading.current_thread().name,
+                'query': self.request.GET.dict()}
+
+    def detail(self, pk):
+        return {'pk': pk}
+
+    def create(self):
+        return {'body': json.loads(self.request.body)}
+
+    def is_authenticated(self):
+        return True
+
+
+class BrokenApi(ApiBase):
+
+    def list(self):
+        raise ValueError('not an ApiError')
+
+
+urlpatterns = [
+    path('api/', include(UserApi.urls() + EchoApi.urls() + BatchApi.urls() +
+                         BrokenApi.urls())),
+]
+
+
+@override_settings(ROOT_URLCONF='kernel.tests.test_api')
+class TestBatchApi(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        usr = User.objects.create_user(username='dorothy',
+                                       email='dorothy@oz.gov')
+        UserProfile(user=usr, company='Kansas Farms').save()
+
+    def post(self, items, **headers):
+        req = RequestFactory().post('/api/batch', json.dumps(items),
+                                    content_type='application/json',
+                                    **headers)
+        return json.loads(BatchApi.as_list()(req).content)
+
+    def test_batch_headers(self):
+        items = [{'method': 'POST', 'path': '/api/echo', 'body': {'n': n}}
+                 for n in (1, 2)]
+        results = self.post(items, HTTP_IDEMPOTENCY_KEY='batch-1')['objects']
+        self.assertEqual(results, [{'status': 200, 'body': {'body': {'n': 1}}},
+                                   {'status': 200, 'body': {'body': {'n': 2}}}],
+                         "should not share the batch's key with its items")
+
+        api = BatchApi()
+        api.request = RequestFactory().post(
+            '/api/batch', HTTP_IF_NONE_MATCH='"x"', HTTP_USER_AGENT='lion',
+            HTTP_IF_MODIFIED_SINCE='Sat, 01 Jan 2000 00:00:00 GMT')
+        meta = api.sub_request('GET', urlsplit('/api/echo'), None).META
+        self.assertNotIn('HTTP_IF_NONE_MATCH', meta)
+        self.assertNotIn('HTTP_IF_MODIFIED_SINCE', meta)
+        self.assertEqual(meta['HTTP_USER_AGENT'], 'lion')
+
+    def test_batch(self):
+        d = self.post([
+            {'method': 'GET', 'path': '/api/echo?page=1'},
+            {'method': 'GET', 'path': '/api/echo?page=2'},
+            {'method': 'GET', 'path': '/api/echo/7'},
+            {'method': 'POST', 'path': '/api/user', 'body': {'name': 'toto'}},
+            {'method': 'GET', 'path': '/api/user'},
+            {'method': 'DELETE', 'path': '/api/nothing'},
+            {'path': '/api/batch'},
+        ])
+        results = d['objects']
+        self.assertEqual(len(results), 7)
+        self.assertEqual([r['status'] for r in results], [200] * 5 + [404] * 2)
+        self.assertEqual(results[0]['body']['query'], {'page': '1'})
+        self.assertTrue(results[0]['body']['thread'].startswith('api-batch'),
+                        "reads should run in the pool")
+        self.assertEqual(results[2]['body'], {'pk': 7})
+        self.assertEqual(results[3]['body']['error'], 'Unauthorized')
+        self.assertEqual(results[4]['body']['objects'],
+                         [{'name': 'dorothy', 'company': 'Kansas Farms'}])
+
+    def test_failed_item(self):
+        items = [{'path': '/api/broken'}, {'path': '/api/echo/7'}]
+        with self.assertLogs('django.request', 'ERROR') as logs:
+            results = self.post(items)['objects']
+        self.assertIn('not an ApiError', logs.output[0],
+                      "should log the traceback")
+        self.assertEqual(results, [
+            {'status': 500, 'body': {'error': 'Server Error'}},
+            {'status': 200, 'body': {'pk': 7}},
+        ])
+        with self.settings(DEBUG=True), self.assertLogs('django.request'):
+            results = self.post(items)['objects']
+        self.assertIn('not an ApiError', results[0]['body']['traceback'])
+
+    def test_bad_batch(self):
+        self.assertIn('error', self.post({'path': '/api/echo'}))
+        self.assertIn('error', self.post([{'path': '/api/echo'}] * 30))
+        resp = BatchApi.as_list()(RequestFactory().get('/api/batch'))
+        self.assertIn('error', json.loads(resp.content))
+
+
+class ProfileApi(ModelApi):
+    model = UserProfile
+    preparer = Preparer({'id': 'user_id', 'name': 'user.username',
+                         'company': 'company', 'gender': 'gender'})
+
+    def is_authenticated(self):
+        return True
+
+
+class TestModelApi(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.pks = []
+        for name in ('dorothy', 'glinda', 'evillene'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov')
+            cls.pks.append(usr.pk)
+
+    def call(self, method, rows, endpoint='list'):
+        req = RequestFactory().generic(method, '/api/profile',
+                                       json.dumps(rows),
+                                       content_type='application/json')
+        func = getattr(ProfileApi, 'as_' + endpoint)()
+        return json.loads(func(req).content)
+
+    def test_iter_json_array(self):
+        doc = b'[ 1, 22.5e1 ,"x\\u00e9\\"]", {"a": [1, 2]}, null, true ]'
+        for size in (1, 2, 3, 1000):
+            rc = list(iter_json_array(BytesIO(doc), chunk_size=size))
+            self.assertEqual(rc, [1, 225.0, 'x\xe9"]', {'a': [1, 2]}, None,
+                                  True])
+        self.assertEqual(list(iter_json_array(BytesIO(b' [ ] '))), [])
+        for bad in (b'{}', b'[1, 2', b'[1 2]', b''):
+            with self.assertRaises(ValueError):
+                list(iter_json_array(BytesIO(bad), chunk_size=2))
+
+    def test_bulk_writes(self):
+        rows = [{'id': pk, 'company': 'Co. {}'.format(pk)} for pk in self.pks]
+        with CaptureQueriesContext(connection) as ctx:
+            d = self.call('POST', rows)
+        self.assertEqual(d, {'created': 3})
+        inserts = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 1, "should insert in one statement")
+
+        rows = [{'id': pk, 'gender': 1} for pk in self.pks[:2]]
+        with CaptureQueriesContext(connection) as ctx:
+            d = self.call('PUT', rows)
+        self.assertEqual(d, {'updated': 2})
+        updates = [q for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1, "should update in one statement")
+        self.assertEqual(UserProfile.objects.filter(gender=1).count(), 2)
+
+        d = self.call('DELETE', self.pks[:2])
+        self.assertEqual(d, {'deleted': 2})
+        self.assertEqual(UserProfile.objects.count(), 1)
+
+        d = self.call('DELETE', ['abc', self.pks[2], None])
+        self.assertEqual([e['index'] for e in d['error']['invalid']], [0, 2])
+        self.assertEqual(UserProfile.objects.count(), 1,
+                         "should delete nothing when a key is bad")
+
+        req = RequestFactory().get('/api/profile')
+        d = json.loads(ProfileApi.as_detail()(req, pk=self.pks[2]).content)
+        self.assertEqual(d['name'], 'evillene')
+
+    def test_msgpack(self):
+        msgpack = get_serializer('msgpack', DjangoJSONEncoder)
+        rows = [{'id': pk, 'company': 'Munchkin Co.'} for pk in self.pks]
+        req = RequestFactory().post('/api/profile', msgpack.dumps(rows),
+                                    content_type='application/msgpack',
+                                    HTTP_ACCEPT='application/msgpack')
+        resp = ProfileApi.as_list()(req)
+        self.assertEqual(resp['Content-Type'], 'application/msgpack')
+        self.assertIn('Accept', resp['Vary'])
+        self.assertEqual(msgpack.loads(resp.content), {'created': 3})
+
+        req = RequestFactory().get(
+            '/api/profile',
+            HTTP_ACCEPT='application/json;q=0.5, application/msgpack')
+        d = msgpack.loads(ProfileApi.as_list()(req).content)
+        self.assertEqual(len(d['objects']), 3)
+        self.assertEqual(d['objects'][0]['company'], 'Munchkin Co.')
+
+        req = RequestFactory().put('/api/profile', b'\x92\x01',
+                                   content_type='application/msgpack',
+                                   HTTP_ACCEPT='application/msgpack')
+        d = msgpack.loads(ProfileApi.as_list()(req).content)
+        self.assertIn('error', d, "should send errors in the same format")
+
+        req = RequestFactory().get('/api/profile', HTTP_ACCEPT='text/html, */*')
+        resp = ProfileApi.as_list()(req)
+        self.assertEqual(resp['Content-Type'], 'application/json')
+
+    def test_validation(self):
+        rows = [{'id': self.pks[0], 'company': 'Emerald City'},
+                {'id': self.pks[1], 'gender': 99},
+                {'id': self.pks[2], 'name': 'toto'},
+                'nonsense']
+        d = self.call('POST', rows)
+        invalid = d['error']['invalid']
+        self.assertEqual([err['index'] for err in invalid], [1, 2, 3])
+        self.assertIn('gender', invalid[0]['errors'])
+        self.assertEqual(UserProfile.objects.count(), 0,
+                         "nothing should be written")
+
+        d = self.call('PUT', [{'id': 12345, 'gender': 2}, {'gender': 2}])
+        self.assertEqual(d['error']['invalid'][0]['index'], 1)
+        d = self.call('PUT', [{'id': 12345, 'gender': 2}])
+        self.assertEqual(d['error']['invalid'][0]['errors'], ['Not found.'])
+        self.assertIn('error', self.call('DELETE', [{'gender': 2}]))
+        self.assertIn('error', self.call('POST', {'id': 1}))
+
+    def test_delete_cascade(self):
+        class UserModelApi(ModelApi):
+            model = User
+            preparer = Preparer({'id': 'id', 'name': 'username'})
+
+            def is_authenticated(self):
+                return True
+
+        UserProfile.objects.create(user_id=self.pks[0])
+        req = RequestFactory().generic('DELETE', '/api/user',
+                                       json.dumps(self.pks[:1]),
+                                       content_type='application/json')
+        d = json.loads(UserModelApi.as_list()(req).content)
+        self.assertEqual(d, {'deleted': 1},
+                         "should not count the profile deleted with it")
+
+    def test_sparse_fieldsets(self):
+        profile = UserProfile(user_id=self.pks[0], company='Emerald City',
+                              about_me='Lost.')
+        profile.save()
+        rf = RequestFactory()
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = ProfileApi.as_detail()(
+                rf.get('/api/profile', {'fields': 'company'}), pk=self.pks[0])
+        self.assertEqual(json.loads(resp.content), {'company': 'Emerald City'})
+        sql = ctx.captured_queries[-1]['sql']
+        self.assertNotIn('about_me', sql, "should not fetch other columns")
+        self.assertNotIn('username', sql)
+
+        with CaptureQueriesContext(connection) as ctx:
+            resp = ProfileApi.as_list()(
+                rf.get('/api/profile', {'exclude': 'name,gender'}))
+        self.assertEqual(json.loads(resp.content)['objects'],
+                         [{'id': self.pks[0], 'company': 'Emerald City'}])
+        self.assertNotIn('JOIN', ctx.captured_queries[-1]['sql'])
+
+        resp = ProfileApi.as_list()(rf.get('/api/profile', {'limit': 1,
+                                                            'fields': 'name'}))
+        self.assertEqual(json.loads(resp.content)['objects'],
+                         [{'name': 'dorothy'}])
+
+        for params in ({'fields': 'name,about_me'}, {'exclude': 'password'},
+                       {'fields': ''}):
+            resp = ProfileApi.as_list()(rf.get('/api/profile', params))
+            self.assertIn('error', json.loads(resp.content))
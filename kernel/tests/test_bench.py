@@ -0,0 +1,44 @@
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from .. import bench
+
+
+class TestBenchApi(SimpleTestCase):
+
+    def test_suite_runs(self):
+        results = bench.run_suite(repeat=1, sizes=(10,), database=False)
+        self.assertIn('prepare x10', results)
+        self.assertIn('handle dispatch', results)
+        self.assertTrue(all(r['seconds'] > 0 for r in results.values()))
+
+    def test_command(self):
+        results = {'prepare x10': {'count': 10, 'seconds': 0.010},
+                   'handle dispatch': {'count': 2000, 'seconds': 0.050}}
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = Path(tmp, 'baseline.json')
+            output = Path(tmp, 'out.json')
+
+            def run(*args, **options):
+                with mock.patch.object(bench, 'run_suite',
+                                       return_value=results):
+                    call_command('benchapi', '--no-db', '--baseline',
+                                 str(baseline), *args, stdout=StringIO(),
+                                 **options)
+
+            run('--save-baseline', output=str(output))
+            saved = json.loads(output.read_text())
+            self.assertEqual(saved['results'], results)
+            self.assertIn('python', saved['meta'])
+
+            results['prepare x10'] = {'count': 10, 'seconds': 0.011}
+            run()     # 10% slower: within the threshold
+            with self.assertRaisesMessage(CommandError, 'prepare x10'):
+                run(threshold=0.05)
@@ -0,0 +1,140 @@
+import json
+import threading
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.test import AsyncRequestFactory, RequestFactory, TestCase
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from accounts.models import User
+from ..api import ApiBase, ApiError, AsyncApiBase
+from ..idempotency import get_store
+from ..models import IdempotencyRecord
+
+
+class CounterApi(ApiBase):
+    idempotency_store = 'cache'
+    calls = 0
+    started = threading.Event()
+    release = threading.Event()
+    block = False
+
+    def is_authenticated(self):
+        return True
+
+    def create(self):
+        CounterApi.calls += 1
+        if json.loads(self.request.body).get('fail'):
+            raise ApiError('The changes could not be saved.')
+        if self.block:
+            self.started.set()
+            self.release.wait(5)
+        return {'calls': CounterApi.calls,
+                'body': json.loads(self.request.body)}
+
+
+class DatabaseCounterApi(CounterApi):
+    idempotency_store = 'database'
+
+
+class AsyncCounterApi(AsyncApiBase):
+    idempotency_store = 'cache'
+
+    async def is_authenticated(self):
+        return True
+
+    async def create(self):
+        CounterApi.calls += 1
+        return {'calls': CounterApi.calls}
+
+
+class TestIdempotency(TestCase):
+
+    def setUp(self):
+        CounterApi.calls = 0
+        cache.clear()
+
+    def post(self, body, key=None, api=CounterApi):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        req = RequestFactory().post('/api/counter', json.dumps(body),
+                                    content_type='application/json',
+                                    **headers)
+        return api.as_list()(req)
+
+    def check_replays(self, api, key):
+        first = self.post({'x': 1}, key, api)
+        again = self.post({'x': 1}, key, api)
+        self.assertEqual(CounterApi.calls, 1, "should not call the view again")
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(again['Idempotent-Replayed'], 'true')
+        self.assertEqual(again['Content-Type'], first['Content-Type'])
+
+        d = json.loads(self.post({'x': 2}, key, api).content)
+        self.assertIn('different request', d['error'])
+        self.post({'x': 1}, None, api)
+        self.assertEqual(CounterApi.calls, 2,
+                         "should not remember requests without a key")
+
+    def test_cache_store(self):
+        self.check_replays(CounterApi, 'cache-key-1')
+
+    def test_database_store(self):
+        self.check_replays(DatabaseCounterApi, 'db-key-1')
+        record = IdempotencyRecord.objects.get()
+        self.assertEqual(record.status, 200)
+
+        record.expires = timezone.now() - timedelta(seconds=1)
+        record.save()
+        self.post({'x': 1}, 'db-key-1', DatabaseCounterApi)
+        self.assertEqual(CounterApi.calls, 3, "should forget expired keys")
+        IdempotencyRecord.objects.update(expires=record.expires)
+        self.assertEqual(get_store('database').purge(), 1)
+
+    def test_errors_not_kept(self):
+        for api in (CounterApi, DatabaseCounterApi):
+            for _ in range(2):
+                resp = self.post({'fail': 1}, 'failing-key', api)
+                self.assertIn('error', json.loads(resp.content))
+        self.assertEqual(CounterApi.calls, 4, "should run each retry")
+
+    async def test_async_lazy_user(self):
+        usr = await sync_to_async(User.objects.create_user)('dorothy')
+        func = AsyncCounterApi.as_list()
+        for _ in range(2):
+            request = AsyncRequestFactory().post(
+                '/api/counter', '{}', content_type='application/json')
+            request.META['HTTP_IDEMPOTENCY_KEY'] = 'async-key'
+            # Only loaded from the session when first asked about.
+            request.user = SimpleLazyObject(
+                lambda: User.objects.get(pk=usr.pk))
+            resp = await func(request)
+        self.assertEqual(json.loads(resp.content), {'calls': 1})
+        self.assertEqual(resp['Idempotent-Replayed'], 'true')
+
+    def test_concurrent_duplicates(self):
+        CounterApi.started.clear()
+        CounterApi.release.clear()
+        CounterApi.block = True
+        results = []
+
+        def post():
+            results.append(self.post({'x': 1}, 'concurrent-key'))
+
+        try:
+            threads = [threading.Thread(target=post) for _ in range(3)]
+            threads[0].start()
+            CounterApi.started.wait(5)
+            for thread in threads[1:]:
+                thread.start()
+            CounterApi.release.set()
+            for thread in threads:
+                thread.join()
+        finally:
+            CounterApi.block = False
+
+        self.assertEqual(CounterApi.calls, 1)
+        self.assertEqual(len({r.content for r in results}), 1)
+        self.assertEqual(sum(r.has_header('Idempotent-Replayed')
+                             for r in results), 2)
@@ -0,0 +1,76 @@
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, override_settings
+
+from ..limits import concurrency_limit, concurrency_stats, reset_limiters
+from ..middleware import ConcurrencyLimitMiddleware
+
+
+LIMITS = {
+    'slow': {'paths': ['/slow/'], 'limit': 1, 'retry_after': 3},
+    'named': {'limit': 1},
+}
+
+
+@override_settings(CONCURRENCY_LIMITS=LIMITS)
+class TestConcurrencyLimits(SimpleTestCase):
+
+    def setUp(self):
+        reset_limiters(setting='CONCURRENCY_LIMITS')
+
+    def get(self, path):
+        return RequestFactory().get(path)
+
+    def test_middleware(self):
+        inner = {}
+
+        def view(request):
+            if request.path == '/slow/first':
+                # Meanwhile, on another thread...
+                inner['slow'] = middleware(self.get('/slow/second'))
+                inner['cheap'] = middleware(self.get('/cheap/'))
+            return HttpResponse('ok')
+
+        middleware = ConcurrencyLimitMiddleware(view)
+        resp = middleware(self.get('/slow/first'))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(inner['slow'].status_code, 503)
+        self.assertEqual(inner['slow']['Retry-After'], '3')
+        self.assertEqual(inner['cheap'].status_code, 200,
+                         "should not limit other routes")
+
+        stats = concurrency_stats()['slow']
+        self.assertEqual((stats['in_flight'], stats['peak'], stats['admitted'],
+                          stats['shed']), (0, 1, 1, 1))
+
+    def test_streaming(self):
+        middleware = ConcurrencyLimitMiddleware(
+            lambda request: StreamingHttpResponse(iter([b'a', b'b'])))
+        resp = middleware(self.get('/slow/'))
+        self.assertEqual(concurrency_stats()['slow']['in_flight'], 1,
+                         "should hold the slot while the body is sent")
+        self.assertEqual(b''.join(resp.streaming_content), b'ab')
+        self.assertEqual(concurrency_stats()['slow']['in_flight'], 0)
+        resp.close()
+        self.assertEqual(concurrency_stats()['slow']['in_flight'], 0,
+                         "should release only once")
+
+        resp = middleware(self.get('/slow/'))
+        resp.close()    # the body never read
+        self.assertEqual(concurrency_stats()['slow']['in_flight'], 0)
+
+    def test_decorator(self):
+        inner = {}
+
+        @concurrency_limit('named')
+        def view(request):
+            if 'again' not in inner:
+                inner['again'] = view(request)
+            return HttpResponse('ok')
+
+        self.assertEqual(view(self.get('/')).status_code, 200)
+        self.assertEqual(inner['again'].status_code, 503)
+        self.assertEqual(concurrency_stats()['named']['shed'], 1)
+
+        with self.assertRaises(ImproperlyConfigured):
+            concurrency_limit('missing')(view)(self.get('/'))
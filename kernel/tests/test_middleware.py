@@ -0,0 +1,95 @@
+import gzip
+import json
+import zlib
+
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from accounts.models import User, UserProfile
+from ..middleware import CompressionMiddleware, accepted_encodings
+from .test_api import CachedUserApi
+
+
+BODY = json.dumps([{'name': 'user%d' % i} for i in range(100)])
+
+
+class TestCompressionMiddleware(TestCase):
+
+    def middleware(self, response):
+        return CompressionMiddleware(lambda request: response)
+
+    def get(self, response, accept='gzip, deflate'):
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING=accept)
+        return self.middleware(response)(request)
+
+    def test_accepted_encodings(self):
+        rc = accepted_encodings('gzip;q=0.5, deflate, br;q=0')
+        self.assertDictEqual(rc, {'gzip': 0.5, 'deflate': 1.0, 'br': 0.0})
+        self.assertDictEqual(accepted_encodings(None), {})
+
+    @override_settings(COMPRESSION_ENCODINGS=('gzip', 'deflate'))
+    def test_negotiation(self):
+        def response():
+            return HttpResponse(BODY, content_type='application/json')
+
+        rc = self.get(response())
+        self.assertEqual(rc['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(rc.content).decode(), BODY)
+        self.assertIn('Accept-Encoding', rc['Vary'])
+        self.assertIn('compress;dur=', rc['Server-Timing'])
+
+        rc = self.get(response(), 'gzip;q=0.5, deflate')
+        self.assertEqual(rc['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(rc.content).decode(), BODY)
+
+        rc = self.get(response(), 'identity')
+        self.assertFalse(rc.has_header('Content-Encoding'))
+        self.assertEqual(rc.content.decode(), BODY)
+        self.assertIn('Accept-Encoding', rc['Vary'])
+
+    def test_skipped(self):
+        rc = self.get(HttpResponse('tiny', content_type='text/plain'))
+        self.assertEqual(rc.content, b'tiny', "should skip short bodies")
+        rc = self.get(HttpResponse(BODY, content_type='image/png'))
+        self.assertEqual(rc.content.decode(), BODY,
+                         "should skip types not listed")
+
+    def test_weak_etag(self):
+        response = HttpResponse(BODY, content_type='application/json')
+        response['ETag'] = '"abc"'
+        rc = self.get(response)
+        self.assertEqual(rc['ETag'], 'W/"abc"')
+
+    def test_streaming(self):
+        chunks = [BODY[i:i + 500].encode() for i in range(0, len(BODY), 500)]
+        response = StreamingHttpResponse(iter(chunks),
+                                         content_type='application/json')
+        before = CompressionMiddleware.stats().get('gzip', {})
+        rc = self.get(response, 'gzip')
+        self.assertEqual(rc['Content-Encoding'], 'gzip')
+        parts = list(rc.streaming_content)
+        self.assertGreater(len(parts), 2, "should compress chunk by chunk")
+        self.assertEqual(gzip.decompress(b''.join(parts)).decode(), BODY)
+        stats = CompressionMiddleware.stats()['gzip']
+        self.assertEqual(stats['original'] - before.get('original', 0),
+                         len(BODY))
+
+    def test_cached_response(self):
+        for name in ('dorothy', 'glinda', 'evillene', 'toto', 'scarecrow'):
+            usr = User.objects.create_user(username=name,
+                                           email=name + '@oz.gov')
+            UserProfile.objects.create(user=usr, company='Emerald City')
+        CachedUserApi.invalidate_cache()
+        middleware = CompressionMiddleware(CachedUserApi.as_list())
+        request = RequestFactory().get('/', HTTP_ACCEPT_ENCODING='gzip')
+        request.user = User.objects.get(username='dorothy')
+
+        first = middleware(request)
+        with self.assertNumQueries(0):
+            second = middleware(request)
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(second.content, first.content)
+        self.assertIn('dur=0.000', second['Server-Timing'],
+                      "should reuse the stored compressed body")
+        data = json.loads(gzip.decompress(second.content))
+        self.assertEqual(len(data['objects']), 5)
@@ -0,0 +1,116 @@
+import json
+import uuid
+from collections import OrderedDict
+from datetime import date, datetime, time, timedelta, timezone
+from decimal import Decimal
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.test import RequestFactory, TestCase
+from django.utils.translation import gettext_lazy
+
+from accounts.models import UserProfile
+from ..api import ApiBase
+from ..serializers import (FastJSONSerializer, JSONSerializer,
+                           MessagePackSerializer, get_serializer, register)
+
+
+class TestFastJSONSerializer(TestCase):
+
+    def test_same_as_json(self):
+        fast = FastJSONSerializer(DjangoJSONEncoder)
+        plain = JSONSerializer(DjangoJSONEncoder)
+        row = {
+            'name': 'Glinda ✨ "the Good"', 'id': 12, 'ratio': 0.1,
+            'big': 1e300, 'nan': float('inf'), 'yes': True, 'no': None,
+            'joined': datetime(2021, 5, 6, 1, 2, 3, 456789,
+                               tzinfo=timezone.utc),
+            'naive': datetime(2021, 5, 6, 1, 2, 3), 'born': date(1900, 1, 1),
+            'at': time(12, 30, 15, 5), 'took': timedelta(days=1, seconds=5),
+            'cost': Decimal('1.50'), 'uid': uuid.UUID(int=7),
+            'gender': UserProfile.Gender.FEMALE, 'lazy': gettext_lazy('Male'),
+            'nested': OrderedDict(a=[1, (2, 3), {}], b=[]),
+            3: 'int key', None: 'null key', False: 'bool key',
+        }
+        data = {'objects': [row, dict(row, id=13)], 'next': None}
+        self.assertEqual(fast.dumps(data), plain.dumps(data))
+        self.assertEqual(fast.dumps(data), plain.dumps(data),
+                         "should reuse cached converters to the same effect")
+        self.assertEqual(fast.dumps([]), b'[]')
+
+        class Moment(datetime):
+            pass
+
+        moment = Moment(2021, 5, 6, 1, 2, 3)
+        self.assertEqual(fast.dumps(moment), plain.dumps(moment))
+        self.assertIn(Moment, fast.convert, "should cache subclass lookups")
+
+        class Unknown(object):
+            pass
+
+        with self.assertRaises(TypeError):
+            fast.dumps({'x': Unknown()})
+        with self.assertRaises(TypeError):
+            fast.dumps({(1, 2): 'tuple key'})
+        with self.assertRaises(ValueError):
+            fast.dumps({'x': time(1, tzinfo=timezone.utc)})
+
+    def test_registry(self):
+        backend = get_serializer('fast', DjangoJSONEncoder)
+        self.assertIs(get_serializer('fast', DjangoJSONEncoder), backend,
+                      "should share backend instances")
+        with self.assertRaises(ValueError):
+            get_serializer('yaml', DjangoJSONEncoder)
+
+        class ShoutingSerializer(JSONSerializer):
+            def dumps(self, data):
+                return super().dumps(data).upper()
+
+        class ShoutingApi(ApiBase):
+            serializer_backend = 'shouting'
+
+            def list(self):
+                return {'say': 'hello'}
+
+        register('shouting', ShoutingSerializer)
+        resp = ShoutingApi.as_list()(RequestFactory().get('/api/shouting'))
+        self.assertEqual(json.loads(resp.content), {'SAY': 'HELLO'})
+
+
+class TestMessagePackSerializer(TestCase):
+
+    def test_encoding(self):
+        pack = MessagePackSerializer(DjangoJSONEncoder).dumps
+        # examples from the MessagePack specification
+        self.assertEqual(pack({'compact': True, 'schema': 0}),
+                         b'\x82\xa7compact\xc3\xa6schema\x00')
+        self.assertEqual(pack([None, False, -1, -33, 255, 1.5]),
+                         b'\x96\xc0\xc2\xff\xd0\xdf\xcc\xff'
+                         b'\xcb\x3f\xf8\x00\x00\x00\x00\x00\x00')
+        self.assertEqual(pack('x' * 40)[:2], b'\xd9\x28')
+        self.assertEqual(pack(list(range(20)))[:3], b'\xdc\x00\x14')
+        with self.assertRaises(ValueError):
+            pack(1 << 64)
+
+    def test_round_trip(self):
+        backend = MessagePackSerializer(DjangoJSONEncoder)
+        plain = JSONSerializer(DjangoJSONEncoder)
+        row = {
+            'name': 'Glinda ✨', 'long': 'y' * 70000, 'id': 12,
+            'ints': [0, 127, 128, -32, -129, 65536, 1 << 40, -(1 << 40)],
+            'ratio': 0.1, 'yes': True, 'no': None, 'blob': b'\x00\xff',
+            'joined': datetime(2021, 5, 6, 1, 2, 3, 456789,
+                               tzinfo=timezone.utc),
+            'cost': Decimal('1.50'), 'uid': uuid.UUID(int=7),
+            'gender': UserProfile.Gender.FEMALE, 'lazy': gettext_lazy('Male'),
+            'nested': OrderedDict(a=[1, (2, 3), {}], b=[]),
+        }
+        rc = backend.loads(backend.dumps(row))
+        self.assertEqual(rc.pop('blob'), b'\x00\xff')
+        del row['blob']
+        self.assertEqual(rc, json.loads(plain.dumps(row)),
+                         "should carry the same data as JSON")
+
+        for bad in (b'\x92\x01', b'\xd9\x05abc', b'\x01\x02', b'\xc1',
+                    b'\x81\x90\x01'):
+            with self.assertRaises(ValueError):
+                backend.loads(bad)
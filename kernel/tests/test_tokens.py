@@ -0,0 +1,112 @@
+import json
+import tempfile
+from io import StringIO
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from accounts.models import User
+from .. import tokens
+from ..api import ApiBase
+from ..middleware import SelectiveSessionMiddleware
+
+
+class TokenApi(ApiBase):
+    token_auth = True
+    http_methods = {'list': {'POST': 'create'}}
+
+    def create(self):
+        return {'user': self.request.user.username}
+
+
+class TestTokens(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.usr = User.objects.create_user(username='dorothy',
+                                           email='dot@kansas.gov')
+
+    def setUp(self):
+        cache.delete(tokens.revocations.cache_key)
+        tokens.revocations.loaded_at = None
+
+    def test_mint_and_verify(self):
+        token = tokens.mint(self.usr)
+        with self.assertNumQueries(0):
+            rc = tokens.verify(token)
+        self.assertEqual(rc.user_id, str(self.usr.pk))
+
+        for bad in (token[:-1] + ('A' if token[-1] != 'A' else 'B'),
+                    token.replace('.', '.2', 1), 'nonsense', ''):
+            with self.assertRaises(tokens.InvalidToken):
+                tokens.verify(bad)
+        with self.assertRaises(tokens.InvalidToken):
+            tokens.verify(tokens.mint(self.usr, max_age=-1))
+
+    def test_key_rotation(self):
+        with override_settings(API_TOKEN_KEYS={1: 'old'}):
+            old = tokens.mint(self.usr)
+        with override_settings(API_TOKEN_KEYS={1: 'old', 2: 'new'}):
+            new = tokens.mint(self.usr)
+            self.assertEqual(tokens.verify(new).version, 2,
+                             "should sign with the newest key")
+            self.assertEqual(tokens.verify(old).version, 1,
+                             "should still accept the old key")
+        with override_settings(API_TOKEN_KEYS={2: 'new'}):
+            tokens.verify(new)
+            with self.assertRaises(tokens.InvalidToken):
+                tokens.verify(old)
+
+    def test_command(self):
+        token = call_command('apitoken', 'mint', 'dorothy', '--max-age=60',
+                             stdout=StringIO())
+        tokens.verify(token)
+        with self.assertRaisesMessage(CommandError, 'local to this process'):
+            call_command('apitoken', 'revoke', token)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = {
+                'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                'LOCATION': tmp,
+            }
+            with override_settings(CACHES={'default': shared}):
+                call_command('apitoken', 'revoke', token, stdout=StringIO())
+                tokens.revocations.loaded_at = None
+                with self.assertRaises(tokens.InvalidToken):
+                    tokens.verify(token)
+                tokens.verify(tokens.mint(self.usr))
+                with self.assertRaisesMessage(CommandError, 'Not a token'):
+                    call_command('apitoken', 'revoke', 'nonsense')
+        tokens.revocations.loaded_at = None
+        with self.assertRaises(CommandError):
+            call_command('apitoken', 'mint', 'nobody')
+
+    def test_api(self):
+        def post(**headers):
+            req = RequestFactory().post('/api/token', **headers)
+            req.user = AnonymousUser()
+            return json.loads(TokenApi.as_list()(req).content)
+
+        self.assertEqual(post(), {'error': 'Unauthorized'})
+        d = post(HTTP_AUTHORIZATION='Bearer nonsense')
+        self.assertEqual(d, {'error': 'Invalid token: malformed.'})
+        token = tokens.mint(self.usr)
+        self.assertEqual(post(HTTP_AUTHORIZATION='Bearer ' + token),
+                         {'user': 'dorothy'})
+
+    def test_sessionless_paths(self):
+        def view(request):
+            request.session['visited'] = True
+            return HttpResponse()
+
+        with override_settings(SESSIONLESS_PATHS=['/api/']):
+            middleware = SelectiveSessionMiddleware(view)
+            with self.assertNumQueries(0):
+                resp = middleware(RequestFactory().get('/api/token'))
+            self.assertNotIn('sessionid', resp.cookies)
+            resp = middleware(RequestFactory().get('/home/'))
+            self.assertIn('sessionid', resp.cookies)
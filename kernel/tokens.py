@@ -0,0 +1,166 @@
+"""
+Stateless API tokens, for the Api classes in kernel.api.
+
+A token reads ``<user id>.<key version>.<expiry>.<nonce>.<signature>``:
+the signature is an HMAC of the rest under the key of that version, so a
+token is checked without touching the database.  Keys live in the
+``API_TOKEN_KEYS`` setting, ``{version: secret}``; new tokens are signed
+with ``API_TOKEN_KEY_VERSION`` (the highest by default).  To rotate, add
+a key and make it current; once the old tokens have expired -- or right
+away, to cut them off -- remove the old key.
+
+Single tokens are revoked by their nonce.  Revocations are kept in the
+cache, until the token would have expired anyway, and every process
+checks against its own copy of them, reloaded every
+``API_TOKEN_REVOCATION_REFRESH`` seconds; for the ``apitoken`` command to
+reach the servers, the cache must be one they share.
+"""
+import base64
+import time
+from collections import namedtuple
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.utils.crypto import (constant_time_compare, get_random_string,
+                                 salted_hmac)
+from django.utils.http import base36_to_int, int_to_base36
+
+KEY_SALT = 'kernel.tokens'
+
+Token = namedtuple('Token', 'user_id version expires nonce')
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def get_keys():
+    keys = getattr(settings, 'API_TOKEN_KEYS', None) or {1: settings.SECRET_KEY}
+    return {int(version): key for version, key in keys.items()}
+
+
+def current_version():
+    return getattr(settings, 'API_TOKEN_KEY_VERSION', None) or max(get_keys())
+
+
+def signature(payload, key):
+    digest = salted_hmac(KEY_SALT, payload, secret=key,
+                         algorithm='sha256').digest()
+    return base64.urlsafe_b64encode(digest).rstrip(b'=').decode()
+
+
+def mint(user, max_age=None, version=None):
+    """
+    Returns a new token for ``user`` (or a user id), good for ``max_age``
+    seconds -- by default ``API_TOKEN_MAX_AGE``, or a day.
+    """
+    if max_age is None:
+        max_age = getattr(settings, 'API_TOKEN_MAX_AGE', 24 * 60 * 60)
+    if version is None:
+        version = current_version()
+    key = get_keys()[version]
+    payload = '.'.join([str(getattr(user, 'pk', user)), str(version),
+                        int_to_base36(int(time.time() + max_age)),
+                        get_random_string(12)])
+    return '{}.{}'.format(payload, signature(payload, key))
+
+
+def read(token):
+    """
+    Returns the ``Token`` a string holds if its signature is good, whether
+    or not it has expired or been revoked.
+    """
+    try:
+        payload, sig = token.rsplit('.', 1)
+        user_id, version, expires, nonce = payload.split('.')
+        version = int(version)
+        expires = base36_to_int(expires)
+    except ValueError:
+        raise InvalidToken('malformed')
+    key = get_keys().get(version)
+    if key is None:
+        raise InvalidToken('unknown key')
+    if not constant_time_compare(sig, signature(payload, key)):
+        raise InvalidToken('bad signature')
+    return Token(user_id, version, expires, nonce)
+
+
+def verify(token):
+    """
+    Returns the ``Token`` a string holds, if it may be used now.
+    """
+    token = read(token)
+    if token.expires < time.time():
+        raise InvalidToken('expired')
+    if revocations.is_revoked(token.nonce):
+        raise InvalidToken('revoked')
+    return token
+
+
+def get_user(token):
+    """
+    The user a token was issued to.  This is the only query tokens ever
+    make: the Api classes put it off until something asks for the user.
+    """
+    try:
+        return get_user_model()._default_manager.get(pk=token.user_id)
+    except (get_user_model().DoesNotExist, ValueError):
+        return AnonymousUser()
+
+
+class Revocations(object):
+    """
+    The nonces of revoked tokens, with their expiry times.
+    """
+    cache_key = 'kernel.tokens.revoked'
+
+    def __init__(self):
+        self.revoked = {}
+        self.loaded_at = None
+        self.lock = Lock()
+
+    def cache(self):
+        return caches[getattr(settings, 'API_TOKEN_CACHE', DEFAULT_CACHE_ALIAS)]
+
+    def is_shared(self):
+        """
+        Whether revocations made here reach other processes.
+        """
+        return not isinstance(self.cache(), (LocMemCache, DummyCache))
+
+    def is_revoked(self, nonce):
+        refresh = getattr(settings, 'API_TOKEN_REVOCATION_REFRESH', 30)
+        if self.loaded_at is None or time.monotonic() - self.loaded_at > refresh:
+            self.load()
+        return nonce in self.revoked
+
+    def load(self):
+        with self.lock:
+            self.revoked = self.cache().get(self.cache_key) or {}
+            self.loaded_at = time.monotonic()
+
+    def revoke(self, token):
+        """
+        Revokes a token (a string); returns its ``Token``.
+        """
+        token = read(token)
+        now = time.time()
+        with self.lock:
+            revoked = self.cache().get(self.cache_key) or {}
+            revoked = {nonce: expires for nonce, expires in revoked.items()
+                       if expires > now}
+            revoked[token.nonce] = token.expires
+            timeout = max(revoked.values()) - now
+            if timeout > 0:
+                self.cache().set(self.cache_key, revoked, timeout)
+            self.revoked = revoked
+            self.loaded_at = time.monotonic()
+        return token
+
+
+revocations = Revocations()
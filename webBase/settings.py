@@ -40,11 +40,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'kernel.middleware.ConcurrencyLimitMiddleware',
+    'kernel.middleware.CompressionMiddleware',
+    'kernel.middleware.SelectiveSessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'accounts.middleware.PasswordPoolMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -126,6 +129,26 @@ USE_TZ = True
 SITE_ID = 1
 
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+SESSIONLESS_PATHS = ['/api/']   # see kernel.middleware and kernel.tokens
+
+# Requests in flight at once, per process, before more are turned away
+# with a 503; see kernel.limits
+CONCURRENCY_LIMITS = {
+    'api': {'paths': ['/api/'], 'limit': 16},
+    'profile': {'paths': ['/accounts/profile/'], 'limit': 8},
+}
+
+# Threads hashing passwords, and hashes let wait for them before sign-ins
+# are turned away; see accounts.hashing.  Workers default to the CPU count.
+PASSWORD_POOL_WORKERS = None
+PASSWORD_POOL_QUEUE = 32
+
+# Registration emails are queued, and sent by `manage.py sendqueuedmail`;
+# see accounts.mailqueue
+MAIL_QUEUE_BATCH = 100
+MAIL_QUEUE_MAX_ATTEMPTS = 6
+MAIL_QUEUE_BACKOFF = 60         # seconds, doubling with each retry
+MAIL_QUEUE_KEEP_SENT = 7 * 24 * 60 * 60   # seconds, before sent ones go
 
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/3.2/howto/static-files/
@@ -16,6 +16,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from accounts.api import UserSyncApi, UsernameApi
 from kernel import views
 
 urlpatterns = [
@@ -24,4 +25,5 @@ urlpatterns = [
     path('accounts/', include('accounts.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
     path('admin/', admin.site.urls),
+    path('api/', include(UserSyncApi.urls() + UsernameApi.urls())),
 ]
@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'webBase.settings')
 
 application = get_wsgi_application()
+
+# Fill this worker's username filter before its first request.
+from django.db import DatabaseError  # noqa: E402
+
+from accounts.bloom import usernames  # noqa: E402
+
+try:
+    usernames.refresh()
+except DatabaseError:   # pragma: no cover -- it's built on first use instead
+    pass